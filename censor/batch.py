@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# #########################################################################
+# Copyright (c) 2017, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2017. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+"""
+This module runs checks and repairs on many data sets, and provides the "censor" command.
+
+The data sets are processed concurrently, each data set by one process of a shared pool, so a
+sweep over many scans uses all cores. The checks and fixers are given in JSON spec file, and the
+outcome of each data set is written into JSON summary.
+
+Spec file example:
+{"checks": {"IS_SIZE": [360, 1024, 1024], "HAS_NO_NAN": [], "MEAN_IN_RANGE": [0, 5000]},
+ "fixers": {"REPLACE_NAN": 0, "TO_TYPE": "float32"},
+ "dataset": "/exchange/data",
+ "axis": 0,
+ "par": "v",
+ "cache": "/tmp/censor_cache"}
+
+With "cache" directory, the results of checks are kept on disk, and data sets that did not
+change since the previous run are not evaluated again. The cache size is limited by optional
+"cache_bytes".
+The fixers are applied only to data sets that failed the checks, unless "repair_passed" is true.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import time
+from multiprocessing import Pool, cpu_count
+import numpy as np
+import censor.checks as checker
+import censor.repairs as repairer
+import censor.hdf as hdf
+import censor.cache as cache_store
+
+__author__ = "Barbara Frosik"
+__copyright__ = "Copyright (c), UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+__all__ = ['load_spec',
+           'find_datasets',
+           'process_dataset',
+           'run_batch',
+           'main']
+
+# file extensions of data sets found in directories
+NPY_EXTENSIONS = ('.npy',)
+HDF_EXTENSIONS = ('.h5', '.hdf5', '.hdf')
+# suffix of repaired data sets, these are not picked up from directories
+FIXED_SUFFIX = '.fixed.npy'
+
+
+def load_spec(path):
+    """
+    This function reads checks and fixers spec from JSON file.
+
+    The lists of arguments are converted to tuples, and the type in "TO_TYPE" fixer to numpy dtype.
+
+    Parameters
+    ----------
+    path : str
+        path to the spec file
+    Returns
+    -------
+    spec : dict
+        spec with "checks" and "fixers" dictionaries and optional processing parameters
+    """
+    with open(path) as f:
+        spec = json.load(f)
+    checks = {}
+    for check_id, args in spec.get('checks', {}).items():
+        checks[str(check_id)] = tuple(args) if isinstance(args, list) else (args,)
+    fixers = {}
+    for fix_id, arg in spec.get('fixers', {}).items():
+        fixers[str(fix_id)] = np.dtype(str(arg)) if fix_id == 'TO_TYPE' else arg
+    spec['checks'] = checks
+    spec['fixers'] = fixers
+    return spec
+
+
+def find_datasets(paths):
+    """
+    This function finds data set files given by directories, glob patterns or file paths.
+
+    The repaired data sets, written by previous runs, are excluded.
+
+    Parameters
+    ----------
+    paths : list
+        list of directories, glob patterns, or files
+    Returns
+    -------
+    files : list
+        sorted list of data set files
+    """
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for name in os.listdir(path):
+                if name.endswith(NPY_EXTENSIONS + HDF_EXTENSIONS) and not name.endswith(FIXED_SUFFIX):
+                    files.add(os.path.join(path, name))
+        else:
+            files.update(name for name in glob.glob(path) if not name.endswith(FIXED_SUFFIX))
+    return sorted(files)
+
+
+def get_logger(logfile):
+    """
+    This function returns logger of the batch, writing to the given file.
+
+    Parameters
+    ----------
+    logfile : str
+        path to the log file
+    Returns
+    -------
+    logger : logger instance
+        the logger
+    """
+    logger = logging.getLogger(__name__)
+    if len(logger.handlers) == 0:
+        logger.setLevel(logging.INFO)
+        handler = logging.FileHandler(logfile)
+        handler.setLevel(logging.INFO)
+        logger.addHandler(handler)
+    return logger
+
+
+def process_dataset(path, spec, logfile='censor.log', out_dir=None):
+    """
+    This function checks, and optionally repairs, one data set.
+
+    The .npy files are memory mapped, and the HDF5 files are read in blocks. A data set that failed
+    the checks, or any data set if the spec sets "repair_passed", is repaired; the repaired .npy
+    data set is written into a new file in the "out_dir" directory; repairs of HDF5 data sets are
+    not supported.
+
+    Parameters
+    ----------
+    path : str
+        path to the data set file
+    spec : dict
+        spec as returned by "load_spec"
+    logfile : str
+        path to the log file
+    out_dir : str
+        directory the repaired data sets are written to, defaults to the data set directory
+    Returns
+    -------
+    summary : dict
+        outcome of the data set: 'path', 'verified', 'repaired' (output path or None),
+        'error' (message or None), and 'time' in seconds
+    """
+    logger = get_logger(logfile)
+    summary = {'path': path, 'verified': None, 'repaired': None, 'error': None}
+    start_time = time.time()
+    try:
+        # the pool processes can not start child processes, so frames are not evaluated by engine
+        par = spec.get('par', 'v')
+        if par == 'p':
+            par = 'v'
+        cache = None
+        if spec.get('cache') is not None:
+            cache = cache_store.ResultCache(spec['cache'], spec.get('cache_bytes', cache_store.CACHE_BYTES))
+        if path.endswith(HDF_EXTENSIONS):
+            summary['verified'] = bool(checker.check_hdf(path, dict(spec['checks']),
+                                                         spec.get('dataset', hdf.EXCHANGE_DATA),
+                                                         path, logger, spec.get('axis', 0),
+                                                         cache=cache))
+        else:
+            summary['verified'] = bool(checker.check_file(path, dict(spec['checks']), path, logger,
+                                                          axis=spec.get('axis', 0), par=par,
+                                                          cache=cache))
+        repair = len(spec['fixers']) > 0 and (not summary['verified'] or
+                                              spec.get('repair_passed', False))
+        if repair and path.endswith(HDF_EXTENSIONS):
+            summary['error'] = 'repair of HDF5 data set is not supported'
+        elif repair:
+            base = os.path.splitext(os.path.basename(path))[0] + FIXED_SUFFIX
+            out_path = os.path.join(out_dir or os.path.dirname(path), base)
+            repairer.replace_file(path, out_path, spec['fixers'], path, logger)
+            summary['repaired'] = out_path
+    except Exception as e:
+        summary['error'] = str(e)
+        logger.error(path + ' failed: ' + str(e))
+    summary['time'] = time.time() - start_time
+    return summary
+
+
+def process_task(task):
+    """
+    This function unpacks pool task and processes the data set.
+
+    Parameters
+    ----------
+    task : tuple
+        arguments of "process_dataset"
+    Returns
+    -------
+    summary : dict
+        outcome of the data set
+    """
+    return process_dataset(*task)
+
+
+def run_batch(paths, spec, num_workers=None, logfile='censor.log', out_dir=None):
+    """
+    This function processes data sets concurrently on a pool of processes.
+
+    Parameters
+    ----------
+    paths : list
+        list of data set files
+    spec : dict
+        spec as returned by "load_spec"
+    num_workers : int
+        number of processes, defaults to number of cpus
+    logfile : str
+        path to the log file
+    out_dir : str
+        directory the repaired data sets are written to
+    Returns
+    -------
+    summaries : list
+        list of data sets outcomes, in the order of paths
+    """
+    if num_workers is None:
+        num_workers = cpu_count()
+    tasks = [(path, spec, logfile, out_dir) for path in paths]
+    pool = Pool(num_workers)
+    try:
+        summaries = list(pool.imap_unordered(process_task, tasks))
+    finally:
+        pool.close()
+        pool.join()
+    order = dict((path, i) for i, path in enumerate(paths))
+    return sorted(summaries, key=lambda summary: order[summary['path']])
+
+
+def main(argv=None):
+    """
+    This function is the entry point of the "censor" command.
+
+    Parameters
+    ----------
+    argv : list
+        command line arguments, defaults to sys.argv
+    Returns
+    -------
+        exit status, 0 if all data sets were verified, 1 otherwise
+    """
+    parser = argparse.ArgumentParser(prog='censor', description='Check and repair scientific data sets.')
+    parser.add_argument('paths', nargs='+', help='data set files, directories, or glob patterns')
+    parser.add_argument('-s', '--spec', required=True, help='JSON file with checks and fixers')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='number of processes')
+    parser.add_argument('-o', '--summary', default='censor_summary.json', help='summary JSON file')
+    parser.add_argument('-l', '--log', default='censor.log', help='log file')
+    parser.add_argument('-d', '--out-dir', default=None, help='directory for repaired data sets')
+    args = parser.parse_args(argv)
+
+    spec = load_spec(args.spec)
+    paths = find_datasets(args.paths)
+    summaries = run_batch(paths, spec, args.workers, args.log, args.out_dir)
+    with open(args.summary, 'w') as f:
+        json.dump({'spec': args.spec,
+                   'datasets': summaries,
+                   'verified': sum(1 for s in summaries if s['verified']),
+                   'total': len(summaries)}, f, indent=2)
+    return 0 if all(s['verified'] and s['error'] is None for s in summaries) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
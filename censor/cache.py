@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# #########################################################################
+# Copyright (c) 2017, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2017. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+
+"""
+This module keeps results of data sets evaluation on disk, so unchanged data sets are not
+evaluated again.
+
+The results are keyed by identity of the data and by the checks. Data in memory is identified by
+hash of its content, computed in chunks; data memory-mapped read-only from file, and HDF5 data
+sets, are identified by the file path, size, and modification time, so the file is not read. The least
+recently used results are evicted when the cache exceeds its size limit.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+import numpy as np
+import censor
+import censor.common.containers as ct
+
+__author__ = "Barbara Frosik"
+__copyright__ = "Copyright (c), UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+__all__ = ['ResultCache',
+           'data_id',
+           'file_id']
+
+# default limit of the cache directory size (bytes)
+CACHE_BYTES = 1 << 30
+# size of array chunk hashed at once (bytes)
+HASH_CHUNK_BYTES = 1 << 24
+# extension of the cache entries
+ENTRY_EXTENSION = '.npz'
+
+
+def file_id(path):
+    """
+    This function identifies file by its path, size, and modification time.
+
+    Parameters
+    ----------
+    path : str
+        path to the file
+    Returns
+    -------
+    id : str
+        the file identity
+    """
+    stat = os.stat(path)
+    # nanoseconds are not available in python 2
+    mtime = getattr(stat, 'st_mtime_ns', None) or repr(stat.st_mtime)
+    return 'file:' + os.path.abspath(path) + ':' + str(stat.st_size) + ':' + str(mtime)
+
+
+def data_id(arr):
+    """
+    This function identifies array by its content.
+
+    An array memory-mapped read-only from file, as a whole, is identified by the file, the offset,
+    and the array layout. Otherwise, including views of mapped arrays and arrays mapped in writable
+    or copy-on-write mode, which may differ from the file, the content is hashed in chunks of frames. The chunks are hashed by a pool of
+    threads, as hashing releases the GIL, and the identity is the hash of the chunks hashes.
+
+    Parameters
+    ----------
+    arr : ndarray
+        the array
+    Returns
+    -------
+    id : str
+        the array identity, or None if the object is not an array
+    """
+    if not isinstance(arr, np.ndarray):
+        return None
+    layout = str(arr.shape) + ':' + arr.dtype.str
+    if isinstance(arr, np.memmap) and getattr(arr, 'filename', None) is not None and \
+            arr.mode == 'r' and isinstance(arr.base, mmap.mmap):
+        return (file_id(arr.filename) + ':' + str(arr.offset) + ':' + layout + ':' +
+                str(arr.strides))
+    digest = hashlib.sha256(layout.encode('utf-8'))
+    if arr.ndim == 0 or arr.size == 0:
+        digest.update(np.ascontiguousarray(arr).tobytes())
+    else:
+        step = max(1, HASH_CHUNK_BYTES // max(1, arr[0].nbytes))
+
+        def hash_chunk(start):
+            chunk = np.ascontiguousarray(arr[start:start + step]).reshape(-1).view(np.uint8)
+            return hashlib.sha256(chunk).digest()
+
+        starts = range(0, arr.shape[0], step)
+        if len(starts) == 1:
+            digest.update(hash_chunk(0))
+        else:
+            pool = ThreadPool(min(cpu_count(), len(starts)))
+            try:
+                for chunk_digest in pool.imap(hash_chunk, starts):
+                    digest.update(chunk_digest)
+            finally:
+                pool.close()
+                pool.join()
+    return 'data:' + digest.hexdigest()
+
+
+def canonical_args(arg):
+    """
+    This function converts check arguments into canonical form, used in cache keys.
+
+    Lists, tuples, and arrays, at any depth, are converted to lists, and numpy scalars to python
+    scalars. Other values than numbers, strings, and booleans are represented by repr.
+
+    Parameters
+    ----------
+    arg : object
+        arguments of a check
+    Returns
+    -------
+        canonical arguments, serializable to JSON
+    """
+    if isinstance(arg, np.ndarray):
+        arg = arg.tolist()
+    elif isinstance(arg, np.generic):
+        arg = arg.item()
+    if isinstance(arg, (list, tuple)):
+        return [canonical_args(item) for item in arg]
+    if arg is None or isinstance(arg, (bool, int, float, type(''))):
+        return arg
+    return repr(arg)
+
+
+class ResultCache:
+    """
+    This class is an on-disk cache of results tables.
+
+    Each entry is a NPZ file in the cache directory, named by the key. An entry's modification time
+    is updated when it is read, and the least recently used entries are removed when the total
+    size exceeds the limit. The entries are written to a temporary file and renamed, so a cache
+    directory can be shared by concurrent processes.
+    """
+    def __init__(self, directory, max_bytes=CACHE_BYTES):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        directory : str
+            the cache directory, created if it does not exist
+        max_bytes : int
+            limit of the total size of entries
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, identity, checks, axis=0):
+        """
+        This function creates cache key for data identity and checks.
+
+        The checks are canonicalized, so the key does not depend on the order of checks, or on
+        arguments given as list or tuple, at any depth, or as numpy or python scalars.
+
+        Parameters
+        ----------
+        identity : str
+            identity of the data, as returned by "data_id" or "file_id"
+        checks : dict
+            contains functions ids as keys, and corresponding tuple of parameters as value
+        axis : int
+            an axis by which the frames are ordered
+        Returns
+        -------
+        key : str
+            the key, or None if the identity is None
+        """
+        if identity is None:
+            return None
+        canonical = json.dumps({'version': censor.__version__,
+                                'data': identity,
+                                'axis': axis,
+                                'checks': dict((check_id, canonical_args(checks[check_id]))
+                                               for check_id in checks)},
+                               sort_keys=True)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        """
+        This function returns path of the cache entry.
+
+        Parameters
+        ----------
+        key : str
+            the key
+        Returns
+        -------
+        path : str
+            path to the entry file
+        """
+        return os.path.join(self.directory, key + ENTRY_EXTENSION)
+
+    def get(self, key):
+        """
+        This function reads results table from the cache.
+
+        Parameters
+        ----------
+        key : str
+            the key
+        Returns
+        -------
+        table : ResultTable
+            the cached table, or None if the key is not in the cache
+        """
+        path = self.path(key)
+        try:
+            with np.load(path) as entry:
+                table = ct.ResultTable(entry['passed'].shape[0], entry['check_ids'].tolist())
+                table.passed[...] = entry['passed']
+                table.values[...] = entry['values']
+                table.evaluated[...] = entry['evaluated']
+                table.globals = json.loads(str(entry['globals']))
+            # mark the entry as recently used
+            os.utime(path, None)
+        except (IOError, OSError, KeyError, ValueError):
+            # missing entry, or entry being evicted or written by other process
+            return None
+        return table
+
+    def put(self, key, table):
+        """
+        This function writes results table into the cache, and evicts the least recently used
+        entries if the cache exceeds the size limit.
+
+        Parameters
+        ----------
+        key : str
+            the key
+        table : ResultTable
+            the table
+        Returns
+        -------
+        none
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, passed=table.passed, values=table.values, evaluated=table.evaluated,
+                         check_ids=np.array(table.check_ids, dtype=str),
+                         globals=np.array(json.dumps(dict((check, bool(res))
+                                                          for check, res in table.globals.items()))))
+            # rename replaces existing file on posix, python 2 has no os.replace
+            getattr(os, 'replace', os.rename)(tmp_path, self.path(key))
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """
+        This function removes the least recently used entries until the cache fits the size limit.
+
+        Returns
+        -------
+        none
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(ENTRY_EXTENSION):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, name, stat.st_size))
+            total += stat.st_size
+        for mtime, name, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        """
+        This function removes all entries.
+
+        Returns
+        -------
+        none
+        """
+        for name in os.listdir(self.directory):
+            if name.endswith(ENTRY_EXTENSION):
+                os.remove(os.path.join(self.directory, name))
@@ -58,11 +58,16 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
 import numpy as np
-from multiprocessing import Queue, Process
+from multiprocessing import Queue, Process, cpu_count
+from multiprocessing.pool import ThreadPool
+from collections import deque
 import logging
+import math
 import censor.handler as handler
 import censor.common.containers as ct
 import censor.frame as framer
+import censor.hdf as hdf
+import censor.cache as cache_store
 import time
 
 __author__ = "Barbara Frosik"
@@ -71,12 +76,35 @@ __docformat__ = 'restructuredtext en'
 __all__ = ['is_nparray',
            'has_no_negative',
            'has_no_nan',
+           'has_no_inf',
            'is_int',
            'is_float',
            'is_complex',
            'is_size',
+           'scan_values',
            'check_slices',
-           'check']
+           'check_slices_thr',
+           'check_slices_vec',
+           'check_slices_seq',
+           'log_table',
+           'compile_plan',
+           'upper_bound',
+           'sample_frames',
+           'check_sample',
+           'check',
+           'check_file',
+           'check_hdf',
+           'recheck',
+           'check_stream']
+
+# default limit of frame data queued or being evaluated in parallel processing (bytes)
+MAX_QUEUED_BYTES = 1 << 28
+# default size of frames chunk evaluated by vectorized functions (bytes)
+VECTOR_CHUNK_BYTES = 1 << 26
+# size of array chunk scanned at once by value checks (bytes)
+SCAN_CHUNK_BYTES = 1 << 22
+# size of array up to which the planned frames evaluation is vectorized in the calling process (bytes)
+AUTO_VECTOR_BYTES = 1 << 28
 
 
 def is_nparray(arr, *args):
@@ -106,7 +134,7 @@ def has_no_negative(arr, *args):
     -------
         boolean
     """
-    return not ((arr < 0).any())
+    return scan_values(arr, ('negative',))['negative'] == 0
 
 
 def has_no_nan(arr, *args):
@@ -121,7 +149,22 @@ def has_no_nan(arr, *args):
     -------
         boolean
     """
-    return not (np.isnan(arr).any())
+    return scan_values(arr, ('nan',))['nan'] == 0
+
+
+def has_no_inf(arr, *args):
+    """
+    This function returns True if the given array has no infinite elements, False otherwise.
+
+    Parameters
+    ----------
+    arr : ndarray
+        an evaluated array
+    Returns
+    -------
+        boolean
+    """
+    return scan_values(arr, ('inf',))['inf'] == 0
 
 
 def is_int(arr, *args):
@@ -190,21 +233,167 @@ def is_size(arr, *args):
     return True
 
 
+def scan_chunks(arr, chunk_bytes):
+    """
+    This function generates views of consecutive chunks of array, each about chunk_bytes large.
+
+    Parameters
+    ----------
+    arr : ndarray
+        an evaluated array
+    chunk_bytes : int
+        approximate size of a chunk
+    Returns
+    -------
+        generator of array views
+    """
+    if arr.flags.c_contiguous:
+        flat = arr.reshape(-1)
+        step = max(chunk_bytes // max(arr.itemsize, 1), 1)
+        for i in range(0, flat.shape[0], step):
+            yield flat[i:i+step]
+    elif arr[0].nbytes > chunk_bytes:
+        for row in arr:
+            for chunk in scan_chunks(row, chunk_bytes):
+                yield chunk
+    else:
+        step = max(chunk_bytes // max(arr[0].nbytes, 1), 1)
+        for i in range(0, arr.shape[0], step):
+            yield arr[i:i+step]
+
+
+def scan_values(arr, stats, chunk_bytes=SCAN_CHUNK_BYTES):
+    """
+    This function computes requested statistics of array values in one pass.
+
+    The array is read in cache sized chunks, and all statistics are accumulated from each chunk
+    before the next chunk is read. The temporary memory is limited to the size of one chunk.
+    Supported statistics are: 'negative' - number of negative elements, 'nan' - number of nan
+    elements, 'inf' - number of infinite elements, 'min' and 'max' - minimum and maximum value,
+    ignoring nans.
+
+    Parameters
+    ----------
+    arr : ndarray
+        an evaluated array
+    stats : sequence
+        names of the requested statistics
+    chunk_bytes : int
+        approximate size of array chunk processed at once
+    Returns
+    -------
+    results : dict
+        statistics names as keys, and computed values
+    """
+    results = {}
+    for stat in stats:
+        if stat in ('negative', 'nan', 'inf'):
+            results[stat] = 0
+        else:
+            results[stat] = None
+    scratch = None
+    for chunk in scan_chunks(arr, chunk_bytes):
+        if chunk.size == 0:
+            continue
+        if scratch is None or scratch.shape != chunk.shape:
+            scratch = np.empty(chunk.shape, dtype=bool)
+        if 'negative' in results:
+            np.less(chunk, 0, out=scratch)
+            results['negative'] += int(np.count_nonzero(scratch))
+        if 'nan' in results:
+            np.isnan(chunk, out=scratch)
+            results['nan'] += int(np.count_nonzero(scratch))
+        if 'inf' in results:
+            np.isinf(chunk, out=scratch)
+            results['inf'] += int(np.count_nonzero(scratch))
+        if 'min' in results:
+            mn = np.fmin.reduce(chunk, axis=None)
+            results['min'] = mn if results['min'] is None else np.fmin(results['min'], mn)
+        if 'max' in results:
+            mx = np.fmax.reduce(chunk, axis=None)
+            results['max'] = mx if results['max'] is None else np.fmax(results['max'], mx)
+    return results
+
+
+def merge_values(total, stats):
+    """
+    This function merges statistics computed by "scan_values" on parts of array.
+
+    Parameters
+    ----------
+    total : dict
+        statistics accumulated so far, updated by this function
+    stats : dict
+        statistics of the next part of the array
+    Returns
+    -------
+    total : dict
+        the merged statistics
+    """
+    for stat, value in stats.items():
+        if total.get(stat) is None:
+            total[stat] = value
+        elif value is None:
+            continue
+        elif stat == 'min':
+            total[stat] = np.fmin(total[stat], value)
+        elif stat == 'max':
+            total[stat] = np.fmax(total[stat], value)
+        else:
+            total[stat] += value
+    return total
+
+
 function_mapper = { 'IS_NPARRAY' : is_nparray,
                     'HAS_NO_NEGATIVE' : has_no_negative,
                     'HAS_NO_NAN' : has_no_nan,
+                    'HAS_NO_INF' : has_no_inf,
                     'IS_INT' : is_int,
                     'IS_FLOAT' : is_float,
                     'IS_COMPLEX': is_complex,
                     'IS_SIZE' : is_size
                    }
 
+# maps the value checks to the statistics they are answered from; all value checks
+# requested in one "check" call are computed in a single pass over the array
+value_mapper = { 'HAS_NO_NEGATIVE' : 'negative',
+                 'HAS_NO_NAN' : 'nan',
+                 'HAS_NO_INF' : 'inf'
+                }
+
+# maps the repair ID to the value statistic that is zero after the repair
+repaired_values = { 'REPLACE_NEGATIVE' : 'negative',
+                    'REPLACE_NAN' : 'nan'
+                   }
+
+# estimated relative cost of the functions, the checks are run from the cheapest;
+# metadata checks are free, value checks scan the whole array
+function_cost = { 'IS_NPARRAY' : 0,
+                  'IS_INT' : 1,
+                  'IS_FLOAT' : 1,
+                  'IS_COMPLEX': 1,
+                  'IS_SIZE' : 1,
+                  'HAS_NO_NEGATIVE' : 10,
+                  'HAS_NO_NAN' : 10,
+                  'HAS_NO_INF' : 10
+                 }
+
+# maps the value checks to the dtype kinds that can not hold the looked for values, the checks
+# pass on arrays of these kinds without reading the data
+value_elided_kinds = { 'HAS_NO_NEGATIVE' : 'bu',
+                       'HAS_NO_NAN' : 'biu',
+                       'HAS_NO_INF' : 'biu'
+                      }
+
 
-def check_slices(arr, checks, data_tag, logger, axis):
+def check_slices(arr, checks, data_tag, logger, axis, engine=None, transport='queue', chunk_size=None,
+                 max_queued_bytes=MAX_QUEUED_BYTES, fail_fast=False):
     """
     This function provides data validation using functions validating frame by frame.
 
-    It starts a handler process that will receive data frame by frame via queue.
+    It starts a handler process that will receive data in blocks of frames via queue, and dispatch
+    the blocks to the engine's worker processes. With the shared memory transport the frames
+    are not pickled, the workers read them from the shared segment.
 
     Parameters
     ----------
@@ -216,29 +405,280 @@ def check_slices(arr, checks, data_tag, logger, axis):
         string identifying the data
     logger : logger instance
         logger used to log events
+    axis : int
+        an axis by which the frames are ordered
+    engine : CheckEngine
+        a worker pool evaluating frames, if not given, a temporary engine is created
+    transport : str
+        'queue' to deliver each frame via queue, or 'shm' to copy the stack once into shared memory
+        and deliver only frame references to the workers
+    chunk_size : int
+        number of consecutive frames delivered to a worker in one message, if not given, it is
+        tuned from the frame size and the measured evaluation time of a frame
+    max_queued_bytes : int
+        approximate limit of frame data that is queued or evaluated at any time; when reached,
+        the frames submission waits for results; None for no limit
+    fail_fast : bool
+        if True, the remaining frames are not evaluated after any frame fails
     Returns
     -------
-        True if all functions are verified, False otherwise
+    table : ResultTable
+        results of the frames
+    nframes : int
+        number of frames
     """
-    dataq = Queue()
-    returnq = Queue()
-    p = Process(target=handler.handle_data, args=(dataq, checks, returnq, data_tag, logger))
-    p.start()
+    if engine is None:
+        with handler.CheckEngine() as engine:
+            return check_slices(arr, checks, data_tag, logger, axis, engine, transport, chunk_size,
+                                max_queued_bytes, fail_fast)
+
+    if transport == 'shm' and handler.shared_memory is None:
+        logger.warning('shared memory is not supported, frames are delivered via queue')
+        transport = 'queue'
 
     if len(arr.shape) == 2:
         arr = np.expand_dims(arr, axis)
 
     arr = np.moveaxis(arr,axis, 0)
 
-    for num_slice in range(arr.shape[0]):
-        slice = arr[num_slice,:,:]
-        dataq.put(ct.Data(ct.Data.DATA_STATUS_DATA, slice))
-    dataq.put(ct.Data(ct.Data.DATA_STATUS_END))
-    result = returnq.get()
-    return result, num_slice+1
+    if chunk_size is None:
+        chunk_size = handler.tune_chunk_size(arr, checks, engine.num_workers)
+
+    # the window of blocks is split between the data queue and the blocks dispatched to workers
+    if max_queued_bytes is None:
+        queued, max_inflight = 0, None
+    else:
+        window = max(max_queued_bytes // max(chunk_size * arr[0].nbytes, 1), 2)
+        queued, max_inflight = window // 2, window - window // 2
+
+    if transport == 'shm':
+        segment, refs = handler.share(arr, chunk_size)
+        datas = (ct.Data(ct.Data.DATA_STATUS_SHARED, ref) for ref in refs)
+    else:
+        segment = None
+        datas = (ct.Data(ct.Data.DATA_STATUS_DATA, arr[num_slice:num_slice+chunk_size,:,:])
+                 for num_slice in range(0, arr.shape[0], chunk_size))
+    try:
+        table = dispatch(datas, checks, data_tag, logger, engine, arr.shape[0], queued, max_inflight,
+                         fail_fast)
+    finally:
+        if segment is not None:
+            segment.close()
+            segment.unlink()
+    return table, arr.shape[0]
+
+
+def dispatch(datas, checks, data_tag, logger, engine, num_frames, queued=0, max_inflight=None,
+             fail_fast=False, stats=None):
+    """
+    This function evaluates blocks of frames using engine's workers.
+
+    It starts a handler process that receives the data containers via queue, dispatches them to
+    the workers, and collects the results. The workers write the results into results table in
+    shared memory. If a worker fails to evaluate a block, RuntimeError with the
+    worker's traceback is raised.
+
+    Parameters
+    ----------
+    datas : iterable
+        Data containers with blocks of frames or references to blocks of frames, in frames order
+    checks : dict
+        contains functions ids as keys, and corresponding tuple of parameters as value
+    data_tag : str
+        string identifying the data
+    logger : logger instance
+        logger used to log events
+    engine : CheckEngine
+        a worker pool evaluating frames
+    num_frames : int
+        number of frames
+    queued : int
+        maximum number of blocks in the data queue, 0 for no limit
+    max_inflight : int
+        maximum number of blocks dispatched to the workers and not yet collected, None for no limit
+    fail_fast : bool
+        if True, the remaining blocks are not evaluated after any frame fails
+    stats : dict
+        if given, the value statistics computed by the workers on the blocks read from file are
+        merged into it
+    Returns
+    -------
+    table : ResultTable
+        results of the frames
+    """
+    segment, table, table_ref = handler.share_table(num_frames, checks)
+    try:
+        job = engine.new_job()
+        dataq = Queue(queued)
+        returnq = Queue()
+        p = Process(target=handler.handle_data,
+                    args=(dataq, checks, returnq, data_tag, logger, engine, table_ref, max_inflight,
+                          job, fail_fast))
+        p.start()
+
+        for data in datas:
+            if engine.is_cancelled(job):
+                break
+            dataq.put(data)
+        dataq.put(ct.Data(ct.Data.DATA_STATUS_END))
+        verified, local_table, failure, block_stats = returnq.get()
+        p.join()
+        if failure is not None:
+            raise failure.error()
+        if stats is not None:
+            for part in block_stats:
+                merge_values(stats, part)
+        if local_table is not None:
+            table = local_table
+        elif segment is not None:
+            # move the results out of the shared memory
+            table = table.copy()
+    finally:
+        if segment is not None:
+            segment.close()
+            segment.unlink()
+    return table
+
+
+def log_table(table, data_tag, logger, log_frames='all', records=None):
+    """
+    This function logs frames results held in results table.
+
+    Parameters
+    ----------
+    table : ResultTable
+        results of frames
+    data_tag : str
+        string identifying the data
+    logger : logger instance
+        logger used to log events
+    log_frames : str
+        'all' to log a line per frame and check, 'summary' to log a line per check with the
+        failed frames encoded as runs, or None to not log frames results
+    records : str
+        path to JSON lines file the frames results are appended to, if given
+    Returns
+    -------
+    none
+    """
+    aggregate = ct.Aggregate(logger, data_tag)
+    if log_frames is not None:
+        aggregate.handle_table(logger, table, framer.ver_ids, summary=log_frames == 'summary')
+    if records is not None:
+        aggregate.write_records(records, table, framer.ver_ids)
+
+
+def check_slices_thr(arr, checks, data_tag, logger, axis, num_threads=None, chunk_size=None,
+                     fail_fast=False):
+    """
+    This function provides data validation using functions validating frame by frame.
 
+    It runs in one process, using a pool of threads. The frame functions spend most of the time in
+    numpy routines that release the GIL, so the threads evaluate frames concurrently, without
+    copying the frames.
 
-def check_slices_seq(arr, checks, data_tag, logger, axis):
+    Parameters
+    ----------
+    arr : ndarray
+        an evaluated array
+    checks : dict
+        contains functions ids as keys, and corresponding tuple of parameters as value
+    data_tag : str
+        string identifying the data
+    logger : logger instance
+        logger used to log events
+    axis : int
+        an axis by which the frames are ordered
+    num_threads : int
+        number of threads, defaults to number of cpus
+    chunk_size : int
+        number of consecutive frames evaluated by a thread in one task, tuned if not given
+    fail_fast : bool
+        if True, the remaining frames are not evaluated after any frame fails
+    Returns
+    -------
+    table : ResultTable
+        results of the frames
+    nframes : int
+        number of frames
+    """
+    if num_threads is None:
+        num_threads = cpu_count()
+
+    if len(arr.shape) == 2:
+        arr = np.expand_dims(arr, axis)
+
+    arr = np.moveaxis(arr,axis, 0)
+
+    if chunk_size is None:
+        chunk_size = handler.tune_chunk_size(arr, checks, num_threads)
+
+    table = ct.ResultTable(arr.shape[0], checks)
+    pool = ThreadPool(num_threads)
+    try:
+        # the threads write results of disjoint blocks of frames directly into the table
+        failures = pool.imap_unordered(lambda i: framer.fill_table(arr[i:i+chunk_size], i, checks, table),
+                                       range(0, arr.shape[0], chunk_size))
+        for failed in failures:
+            if fail_fast and failed:
+                # drop the tasks not yet started
+                pool.terminate()
+                break
+    finally:
+        pool.close()
+        pool.join()
+
+    return table, arr.shape[0]
+
+
+def check_slices_vec(arr, checks, data_tag, logger, axis, chunk_size=None, fail_fast=False):
+    """
+    This function provides data validation using vectorized functions validating frame by frame.
+
+    It runs in one process. The frames are processed in chunks, and each function evaluates all
+    frames in a chunk in one numpy call.
+
+    Parameters
+    ----------
+    arr : ndarray
+        an evaluated array
+    checks : dict
+        contains functions ids as keys, and corresponding tuple of parameters as value
+    data_tag : str
+        string identifying the data
+    logger : logger instance
+        logger used to log events
+    axis : int
+        an axis by which the frames are ordered
+    chunk_size : int
+        number of frames evaluated in one call, if not given, it is limited by VECTOR_CHUNK_BYTES
+    fail_fast : bool
+        if True, the remaining chunks are not evaluated after any frame fails
+    Returns
+    -------
+    table : ResultTable
+        results of the frames
+    nframes : int
+        number of frames
+    """
+    if len(arr.shape) == 2:
+        arr = np.expand_dims(arr, axis)
+
+    arr = np.moveaxis(arr,axis, 0)
+
+    if chunk_size is None:
+        chunk_size = max(VECTOR_CHUNK_BYTES // max(arr[0].nbytes, 1), 1)
+
+    table = ct.ResultTable(arr.shape[0], checks)
+    for num_slice in range(0, arr.shape[0], chunk_size):
+        failed = framer.fill_table(arr[num_slice:num_slice+chunk_size], num_slice, checks, table)
+        if fail_fast and failed:
+            break
+
+    return table, arr.shape[0]
+
+
+def check_slices_seq(arr, checks, data_tag, logger, axis, fail_fast=False):
     """
     This function provides data validation using functions validating frame by frame.
 
@@ -254,29 +694,328 @@ def check_slices_seq(arr, checks, data_tag, logger, axis):
         string identifying the data
     logger : logger instance
         logger used to log events
+    axis : int
+        an axis by which the frames are ordered
+    fail_fast : bool
+        if True, the remaining frames are not evaluated after any frame fails
     Returns
     -------
-        True if all functions are verified, False otherwise
+    table : ResultTable
+        results of the frames
+    nframes : int
+        number of frames
     """
     if len(arr.shape) == 2:
         arr = np.expand_dims(arr, axis)
 
     arr = np.moveaxis(arr,axis, 0)
 
-    result = True
+    table = ct.ResultTable(arr.shape[0], checks)
     for num_slice in range(arr.shape[0]):
-        slice = arr[num_slice,:,:]
-        slice_results = framer.process_frame_seq(ct.Data(ct.Data.DATA_STATUS_DATA, slice), num_slice, checks)
-        for result in slice_results.results:
-            logger.info(data_tag + ' evaluated frame #' + str(num_slice) + ' ' + result.ver_id +
-                        ' with result ' + str(result.res))
-        if slice_results.failed:
-            result = False
+        failed = framer.fill_table(arr[num_slice:num_slice+1], num_slice, checks, table)
+        if fail_fast and failed:
+            break
+
+    return table, arr.shape[0]
 
-    return result, num_slice+1
 
+def default_logger():
+    """
+    This function returns a logger writing to "default.log" file.
 
-def check(arr, checks, data_tag='mydata', logger=None, axis=0, par='p'):
+    Returns
+    -------
+    logger : logger instance
+        the default logger
+    """
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.INFO)
+    handler = logging.FileHandler('default.log')
+    handler.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    return logger
+
+
+def compile_plan(arr, checks, par='auto'):
+    """
+    This function compiles checks into an execution plan, using only the array metadata.
+
+    The functions evaluating the whole array are ordered by cost. The checks of type and shape
+    are answered from metadata, and so are the value checks that can not fail for the array type,
+    for example "HAS_NO_NAN" on integer array. The remaining value checks are merged into one
+    pass over the array. The frame functions are evaluated from shared frames statistics where
+    possible, and the statistics they need are merged. If the execution mode is 'auto', the frames
+    are vectorized in the calling process when all frame functions are vectorized and the array
+    is small or there is one cpu, a pool of threads is used for larger arrays, and parallel
+    processing if a frame function has no vectorized version.
+
+    Parameters
+    ----------
+    arr : ndarray
+        an evaluated array, only its type and shape are used
+    checks : dict
+        contains functions ids as keys, and corresponding tuple of parameters as value
+    par : str
+        requested execution mode of the frames: 's', 'v', 't', 'p', or 'auto'
+    Returns
+    -------
+    plan : CheckPlan
+        the plan
+    """
+    plan = ct.CheckPlan()
+    is_array = isinstance(arr, np.ndarray)
+    for check_id in sorted(checks, key=lambda check_id: (function_cost.get(check_id, 0), check_id)):
+        if check_id in function_mapper:
+            plan.order.append(check_id)
+            if not is_array:
+                if check_id == 'IS_NPARRAY':
+                    plan.static[check_id] = False
+            elif check_id in value_mapper:
+                if arr.size == 0 or arr.dtype.kind in value_elided_kinds.get(check_id, ''):
+                    plan.static[check_id] = True
+                else:
+                    plan.scan[check_id] = value_mapper[check_id]
+            else:
+                plan.static[check_id] = bool(function_mapper[check_id](arr, *checks[check_id]))
+        else:
+            plan.frames[check_id] = checks[check_id]
+            if check_id in framer.stats_mapper:
+                plan.frame_modes[check_id] = 'stats'
+                needed, get_thresholds = framer.stats_needed[check_id]
+                plan.frame_stats.update(needed)
+                if get_thresholds is not None:
+                    plan.thresholds.update(get_thresholds(checks[check_id]))
+            elif check_id in framer.vector_mapper:
+                plan.frame_modes[check_id] = 'vector'
+            else:
+                plan.frame_modes[check_id] = 'frame'
+
+    if par != 'auto':
+        plan.mode = par
+    elif len(plan.frames) > 0:
+        vectorized = all(mode != 'frame' for mode in plan.frame_modes.values())
+        if vectorized and (arr.nbytes <= AUTO_VECTOR_BYTES or cpu_count() == 1):
+            plan.mode = 'v'
+        elif vectorized:
+            plan.mode = 't'
+        else:
+            plan.mode = 'p'
+    return plan
+
+
+def normal_quantile(confidence):
+    """
+    This function returns quantile of the standard normal distribution.
+
+    Parameters
+    ----------
+    confidence : float
+        probability, at least 0.5
+    Returns
+    -------
+        the quantile
+    """
+    # by bisection of the distribution function
+    lo, hi = 0.0, 10.0
+    for i in range(60):
+        z = (lo + hi) / 2
+        if 0.5 * (1 + math.erf(z / math.sqrt(2))) < confidence:
+            lo = z
+        else:
+            hi = z
+    return (lo + hi) / 2
+
+
+def upper_bound(count, total, confidence=0.95):
+    """
+    This function returns upper confidence bound of a fraction observed in a sample.
+
+    It is the one-sided Wilson score bound; with no observed count it is close to the "rule of
+    three", 3 / total at 95% confidence.
+
+    Parameters
+    ----------
+    count : int
+        number of observed items, for example failing frames
+    total : int
+        size of the sample
+    confidence : float
+        confidence level
+    Returns
+    -------
+        upper bound of the fraction, 1.0 for empty sample
+    """
+    if total == 0:
+        return 1.0
+    z = normal_quantile(confidence)
+    p = count / total
+    z2 = z * z / total
+    bound = (p + z2 / 2 + z * math.sqrt(p * (1 - p) / total + z2 / (4 * total))) / (1 + z2)
+    return min(bound, 1.0)
+
+
+def sample_frames(num_frames, sample):
+    """
+    This function selects frames evaluated in sampled evaluation.
+
+    If the sample is given as fraction, it is enlarged to the smallest number of frames that
+    passes the tolerance when no failing frame is found, otherwise a clean data set could never
+    pass the triage.
+
+    Parameters
+    ----------
+    num_frames : int
+        number of frames
+    sample : Sample
+        description of the sample
+    Returns
+    -------
+        sorted array of frames indexes
+    """
+    if isinstance(sample.frames, float):
+        size = int(math.ceil(num_frames * sample.frames))
+        if sample.tolerance <= 0:
+            size = num_frames
+        else:
+            # the upper bound of clean sample is z^2 / (n + z^2)
+            z = normal_quantile(sample.confidence)
+            size = max(size, int(math.ceil(z * z * (1 - sample.tolerance) / sample.tolerance)) + 1)
+    else:
+        size = sample.frames
+    size = min(max(size, 1), num_frames)
+    rng = np.random.RandomState(sample.seed)
+    return np.sort(rng.choice(num_frames, size, replace=False))
+
+
+def sample_estimate(count, total, sample, exact=False):
+    """
+    This function decides a check from number of failures found in a sample.
+
+    Parameters
+    ----------
+    count : int
+        number of failing frames or pixels in the sample
+    total : int
+        number of sampled frames or pixels
+    sample : Sample
+        description of the sample
+    exact : bool
+        True if the sample is the whole data set
+    Returns
+    -------
+    estimate : Estimate
+        the estimate and decision
+    """
+    fraction = count / max(total, 1)
+    upper = fraction if exact else upper_bound(count, total, sample.confidence)
+    if count > 0:
+        decision = 'failed'
+    elif exact or upper <= sample.tolerance:
+        decision = 'passed'
+    else:
+        decision = 'inconclusive'
+    return ct.Estimate(fraction, upper, total, decision)
+
+
+def check_sample(arr, checks, sample, data_tag='mydata', logger=None, axis=0):
+    """
+    This function evaluates a random sample of data set, for fast triage.
+
+    The frames selected by "sample_frames" are evaluated by the frame functions. The value checks
+    scan the sampled frames, or a random tile of each sampled frame if the sample defines tile.
+    The other functions evaluating the whole array, and the value checks that can not fail for the
+    array type, are answered from the array metadata, exactly. For each sampled check an Estimate
+    is stored in the table "estimates": a check fails if a failure is found in the sample, and
+    passes if the upper bound of the failing fraction is not above the sample tolerance, otherwise
+    it is inconclusive and is reported as passed in the table. The bounds of value checks treat
+    the pixels as independent, which is optimistic if the failing pixels are clustered.
+    Frames that were not sampled are not flagged as evaluated in the table.
+
+    Parameters
+    ----------
+    arr : ndarray
+        an evaluated array
+    checks : dict
+        contains functions ids as keys, and corresponding tuple of parameters as value
+    sample : Sample
+        description of the sample
+    data_tag : str
+        string identifying the data
+    logger : logger instance
+        logger used to log events
+    axis : int
+        an axis by which the frames are ordered
+    Returns
+    -------
+    table : ResultTable
+        results of the sampled frames and the functions evaluating the whole array, with estimates
+    """
+    if logger is None:
+        logger = default_logger()
+    start_time = time.time()
+    plan = compile_plan(arr, checks, 'v')
+    frames = np.moveaxis(arr, axis, 0) if arr.ndim == 3 else np.expand_dims(arr, 0)
+    indexes = sample_frames(frames.shape[0], sample) if frames.shape[0] > 0 else np.zeros(0, dtype=int)
+    frame_shape = frames.shape[1:]
+    tile = None
+    if sample.tile is not None and len(plan.scan) > 0:
+        tile = tuple(min(t, n) for t, n in zip(sample.tile, frame_shape))
+        if tile == tuple(frame_shape):
+            tile = None
+        else:
+            # the tiles origins follow the frames selection in the seeded sequence
+            rng = np.random.RandomState(sample.seed + 1)
+            origins = [rng.randint(0, n - t + 1, size=len(indexes)) for t, n in zip(tile, frame_shape)]
+
+    table = ct.ResultTable(frames.shape[0], plan.frames)
+    stat_names = sorted(set(plan.scan.values()))
+    value_stats = {}
+    sample_table = ct.ResultTable(len(indexes), plan.frames)
+    if len(indexes) > 0 and (len(plan.frames) > 0 or tile is None and len(stat_names) > 0):
+        chunk_size = max(1, VECTOR_CHUNK_BYTES // max(frames[0].nbytes, 1))
+        for start in range(0, len(indexes), chunk_size):
+            block = np.asarray(frames[indexes[start:start + chunk_size]])
+            if len(plan.frames) > 0:
+                framer.fill_table(block, start, plan.frames, sample_table)
+            if tile is None and len(stat_names) > 0:
+                merge_values(value_stats, scan_values(block, stat_names))
+    if tile is not None:
+        for i, index in enumerate(indexes):
+            region = frames[index][tuple(slice(origin[i], origin[i] + t) for origin, t in zip(origins, tile))]
+            merge_values(value_stats, scan_values(np.asarray(region), stat_names))
+    table.values[indexes] = sample_table.values
+    table.passed[indexes] = sample_table.passed
+    table.evaluated[indexes] = True
+
+    # the sample is the whole population if all frames and pixels were evaluated
+    complete = len(indexes) == frames.shape[0]
+    num_pixels = len(indexes) * int(np.prod(tile if tile is not None else frame_shape))
+    for check_id in plan.order:
+        if check_id in plan.static:
+            res = plan.static[check_id]
+        elif check_id in plan.scan:
+            estimate = sample_estimate(value_stats.get(plan.scan[check_id], 0), num_pixels, sample,
+                                       complete and tile is None)
+            table.estimates[check_id] = estimate
+            res = estimate.decision != 'failed'
+        else:
+            res = function_mapper[check_id](arr, *checks[check_id])
+        logger.info(data_tag + ' evaluated "' + check_id.lower() + '" with result ' + str(res))
+        table.globals[check_id] = bool(res)
+    for i, check_id in enumerate(table.check_ids):
+        estimate = sample_estimate(int(np.count_nonzero(~sample_table.passed[:, i])), len(indexes),
+                                   sample, complete)
+        table.estimates[check_id] = estimate
+    for check_id in sorted(table.estimates):
+        logger.info(data_tag + ' sampled "' + check_id.lower() + '": ' + repr(table.estimates[check_id]))
+    logger.info("sampled " + str(len(indexes)) + " of " + str(frames.shape[0]) + " frames in " +
+                str(time.time() - start_time) + " sec")
+    return table
+
+
+def check(arr, checks, data_tag='mydata', logger=None, axis=0, par='p', engine=None,
+          transport='queue', chunk_size=None, max_queued_bytes=MAX_QUEUED_BYTES, num_threads=None,
+          fail_fast=False, log_frames='all', records=None, cache=None, sample=None):
     """
     This function provides data validation.
 
@@ -302,11 +1041,45 @@ def check(arr, checks, data_tag='mydata', logger=None, axis=0, par='p'):
     axis : int
         an axis by which the frames are ordered, only used when "frame" functions are requested
     par : str
-        a string indicating whether use sequential processing or parallel, default is parallel
+        a string indicating whether use sequential processing ('s'), parallel processing ('p'),
+        a pool of threads ('t'), or vectorized processing ('v'), or 'auto' to let the check plan
+        choose; default is parallel
+    engine : CheckEngine
+        a worker pool used in parallel processing; an engine can be created once and reused
+        by many "check" calls, if not given, a temporary engine is created for this call
+    transport : str
+        a string indicating how frames are delivered to the workers in parallel processing,
+        'queue' (default) or 'shm' for shared memory
+    chunk_size : int
+        number of frames delivered to a worker in one message in parallel processing, auto-tuned
+        if not given
+    max_queued_bytes : int
+        approximate limit of frame data in flight in parallel processing, None for no limit
+    num_threads : int
+        number of threads used when processing with threads, defaults to number of cpus
+    fail_fast : bool
+        if True, the evaluation stops as soon as any check fails, and the outstanding frame work
+        is cancelled
+    log_frames : str
+        'all' (default) to log a line per frame and check, 'summary' to log a line per check with
+        the failed frames encoded as runs, or None to not log frames results
+    records : str
+        path to JSON lines file the frames results are appended to, one record per frame
+    cache : ResultCache
+        on-disk cache of results; if the data and checks were evaluated before, the cached results
+        are returned without evaluation, otherwise the results are stored in the cache; results
+        of fail_fast evaluation are not stored
+    sample : Sample
+        if given, only a random sample of the data is evaluated, see "check_sample"; the data is
+        evaluated completely if the sample is inconclusive and the sample allows escalation, and
+        the estimates of the sample are kept in the returned table
 
     Returns
     -------
-        True if all functions are verified, False otherwise
+    table : ResultTable
+        results table, with frames results of the frame functions and results of the functions
+        evaluating the whole array; it evaluates to True if all functions are verified,
+        False otherwise
 
     Example:
     checks = {'IS_NPARRAY':(),
@@ -316,36 +1089,566 @@ def check(arr, checks, data_tag='mydata', logger=None, axis=0, par='p'):
               'IS_SIZE':(2,3),
               'MEAN_IN_RANGE':(-1,5),
               'SAT_IN_RANGE':(1, 7)}
-    censor.checks.check(arr, checks)
+    table = censor.checks.check(arr, checks)
+    if not table:
+        print('frames failing mean check', table.failed_frames('MEAN_IN_RANGE'))
+
+    Reusing a worker pool:
+    with censor.handler.CheckEngine(num_workers=8) as engine:
+        for arr in arrays:
+            censor.checks.check(arr, checks, engine=engine)
+
+    Caching results across runs:
+    cache = censor.cache.ResultCache('/tmp/censor_cache')
+    table = censor.checks.check(arr, checks, cache=cache)
+
+    Triage of a scan:
+    table = censor.checks.check(arr, checks, sample=censor.common.containers.Sample(0.01))
+    print(table.estimates)
 
     """
     # if logger not provided, create default
     if logger is None:
-        logger = logging.getLogger(__name__)
-        logger.setLevel(logging.INFO)
-        handler = logging.FileHandler('default.log')
-        handler.setLevel(logging.INFO)
-        logger.addHandler(handler)
-
-    verified = True
-    for check in sorted(checks):
-        if check in function_mapper:
-            args = checks[check]
-            res = function_mapper[check](arr, *args)
-            logger.info(data_tag + ' evaluated "' + check.lower() + '" with result ' + str(res))
-            if not res:
-                verified = False
-            del checks[check]
-    if len(checks) > 0:
+        logger = default_logger()
+
+    key = None
+    if cache is not None:
+        key = cache.key(cache_store.data_id(arr), checks, axis)
+        if key is not None:
+            table = load_cached(cache, key, data_tag, logger, log_frames, records)
+            if table is not None:
+                table.axis = axis
+                return table
+
+    estimates = {}
+    # an object that is not an array has no frames to sample, and fails the array checks
+    if sample is not None and isinstance(arr, np.ndarray):
+        table = check_sample(arr, checks, sample, data_tag, logger, axis)
+        decisions = set(estimate.decision for estimate in table.estimates.values())
+        if 'failed' in decisions or not all(table.globals.values()) or \
+                'inconclusive' not in decisions or not sample.escalate:
+            log_table(table, data_tag, logger, log_frames, records)
+            table.axis = axis
+            return table
+        logger.info(data_tag + ' sample is inconclusive, evaluating all frames')
+        estimates = table.estimates
+
+    plan = compile_plan(arr, checks, par)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(data_tag + ' check plan: ' + plan.describe())
+    par = plan.mode
+
+    global_results = {}
+    stats = None
+    # the cheap checks are run first
+    for check in plan.order:
+        if check in plan.static:
+            res = plan.static[check]
+        elif check in plan.scan:
+            # all value checks are answered from one pass
+            if stats is None:
+                stats = scan_values(arr, sorted(set(plan.scan.values())))
+            res = stats[plan.scan[check]] == 0
+        else:
+            res = function_mapper[check](arr, *checks[check])
+        logger.info(data_tag + ' evaluated "' + check.lower() + '" with result ' + str(res))
+        global_results[check] = bool(res)
+        del checks[check]
+        if not res and fail_fast:
+            break
+    table = ct.ResultTable(0, [])
+    if len(checks) > 0 and not (fail_fast and not all(global_results.values())):
         start_time = time.time()
         if par == 's':
-            res, slices = check_slices_seq(arr, checks, data_tag, logger, axis)
+            table, slices = check_slices_seq(arr, checks, data_tag, logger, axis, fail_fast)
+        elif par == 'v':
+            table, slices = check_slices_vec(arr, checks, data_tag, logger, axis, chunk_size,
+                                             fail_fast)
+        elif par == 't':
+            table, slices = check_slices_thr(arr, checks, data_tag, logger, axis, num_threads,
+                                             chunk_size, fail_fast)
         else:
-            res, slices = check_slices(arr, checks, data_tag, logger, axis)
-        if not res:
-            verified = False
+            table, slices = check_slices(arr, checks, data_tag, logger, axis, engine, transport,
+                                         chunk_size, max_queued_bytes, fail_fast)
 
         end_time = time.time()
+        log_table(table, data_tag, logger, log_frames, records)
         logger.info("evaluated " + str(slices) + " frames in " + str(end_time-start_time) + " sec")
 
-    return verified
+    table.globals = global_results
+    if key is not None and not fail_fast:
+        cache.put(key, table)
+    table.estimates = estimates
+    table.axis = axis
+    return table
+
+
+def load_cached(cache, key, data_tag, logger, log_frames='all', records=None):
+    """
+    This function reads results from cache, and logs them as if the data was evaluated.
+
+    Parameters
+    ----------
+    cache : ResultCache
+        on-disk cache of results
+    key : str
+        cache key of the data and checks
+    data_tag : str
+        string identifying the data
+    logger : logger instance
+        logger used to log events
+    log_frames : str
+        'all', 'summary', or None, see "log_table"
+    records : str
+        path to JSON lines file the frames results are appended to, if given
+    Returns
+    -------
+    table : ResultTable
+        the cached results, or None if not found
+    """
+    table = cache.get(key)
+    if table is None:
+        return None
+    logger.info(data_tag + ' results found in cache')
+    for check in sorted(table.globals):
+        logger.info(data_tag + ' evaluated "' + check.lower() + '" with result ' + str(table.globals[check]))
+    log_table(table, data_tag, logger, log_frames, records)
+    return table
+
+
+def check_file(path, checks, data_tag=None, logger=None, **kwargs):
+    """
+    This function provides validation of data stored in numpy .npy file.
+
+    The file is opened with memory mapping, so the data is not loaded into memory. The global
+    checks read the array in chunks, and the frame checks read the frames as they are evaluated,
+    thus the memory use is proportional to the working set and not to the data set size.
+    The shared memory transport copies the whole data set and should not be used with this function.
+
+    Parameters
+    ----------
+    path : str
+        path to the .npy file
+    checks : dict
+        contains functions ids as keys, and corresponding tuple of parameters as value
+    data_tag : str
+        string identifying the data, defaults to the file path
+    logger : logger instance
+        logger used to log events
+    kwargs : dict
+        other keyword arguments passed to "check"
+    Returns
+    -------
+    table : ResultTable
+        results table, evaluates to True if all functions are verified, False otherwise
+    """
+    if data_tag is None:
+        data_tag = path
+    arr = np.load(path, mmap_mode='r')
+    return check(arr, checks, data_tag, logger, **kwargs)
+
+
+def recheck(arr, checks, previous, record, data_tag='mydata', logger=None, log_frames='all',
+            records=None):
+    """
+    This function re-evaluates repaired data, evaluating only the frames changed by the repair.
+
+    The frames flagged as dirty in the repair record are evaluated by the frame functions, and their
+    results replace the results of the previous evaluation. If the previous evaluation did not
+    evaluate all frames and checks, for example it stopped on failure or was sampled, all frames
+    are evaluated. The value checks scan only the dirty frames: the frames that were not changed
+    keep their previous characteristic, and after a repair of a characteristic no frame has it. A value check that failed before, and was not
+    repaired, scans the whole array. The other functions evaluating the whole array, and the value
+    checks that can not fail for the array type, are answered from the array metadata.
+
+    Parameters
+    ----------
+    arr : ndarray
+        the repaired array
+    checks : dict
+        contains functions ids as keys, and corresponding tuple of parameters as value, the same
+        as in the previous evaluation
+    previous : ResultTable
+        results of the previous evaluation, as returned by "check"
+    record : RepairRecord
+        record of the repair, as filled by "censor.repairs.replace"; its axis must be the axis
+        of the previous evaluation, otherwise ValueError is raised
+    data_tag : str
+        string identifying the data
+    logger : logger instance
+        logger used to log events
+    log_frames : str
+        'all' (default) to log a line per re-evaluated frame and check, 'summary' to log a line
+        per check, or None to not log frames results
+    records : str
+        path to JSON lines file the results of re-evaluated frames are appended to
+    Returns
+    -------
+    table : ResultTable
+        merged results table, evaluates to True if all functions are verified, False otherwise
+
+    Example:
+    table = censor.checks.check(arr, dict(checks))
+    if not table:
+        record = censor.common.containers.RepairRecord(arr.shape)
+        censor.repairs.replace(arr, fixers, record=record)
+        table = censor.checks.recheck(arr, checks, table, record)
+    """
+    if logger is None:
+        logger = default_logger()
+    if tuple(arr.shape) != record.shape:
+        raise ValueError('array shape ' + str(arr.shape) + ' does not match repaired shape ' +
+                         str(record.shape))
+    if previous.axis is not None and previous.axis != record.axis:
+        raise ValueError('frames axis ' + str(previous.axis) + ' of previous results does not match '
+                         'repair record axis ' + str(record.axis))
+    frame_checks = dict((check_id, checks[check_id]) for check_id in checks if check_id not in function_mapper)
+    global_checks = [check_id for check_id in checks if check_id in function_mapper]
+    if previous.num_frames != len(record.dirty) or set(previous.check_ids) != set(frame_checks) or \
+            not previous.evaluated.all() or len(previous.estimates) > 0 or \
+            any(check_id not in previous.globals for check_id in global_checks):
+        # results of frames that were not evaluated, or were estimated, can not be trusted
+        logger.info(data_tag + ' previous results do not match, evaluating all frames')
+        return check(arr, dict(checks), data_tag, logger, record.axis, par='v', log_frames=log_frames,
+                     records=records)
+
+    if arr.ndim == 3:
+        frames = np.moveaxis(arr, record.axis, 0)
+    else:
+        frames = np.expand_dims(arr, 0)
+    dirty = record.dirty_frames()
+    # consecutive dirty frames are evaluated together
+    runs = np.split(dirty, np.nonzero(np.diff(dirty) != 1)[0] + 1) if len(dirty) > 0 else []
+
+    global_results = {}
+    plan = compile_plan(arr, dict((check_id, checks[check_id]) for check_id in checks
+                                  if check_id in function_mapper))
+    dirty_stats = {}
+    if len(plan.scan) > 0:
+        stat_names = sorted(set(plan.scan.values()))
+        for run in runs:
+            merge_values(dirty_stats, scan_values(frames[run[0]:run[-1] + 1], stat_names))
+    repaired = set(repaired_values[fix] for fix in record.fixes if fix in repaired_values)
+    for check_id in plan.order:
+        if check_id in plan.static:
+            res = plan.static[check_id]
+        elif check_id in plan.scan:
+            stat = plan.scan[check_id]
+            if previous.globals.get(check_id) or stat in repaired:
+                res = dirty_stats.get(stat, 0) == 0
+            else:
+                res = scan_values(arr, [stat])[stat] == 0
+        else:
+            res = function_mapper[check_id](arr, *checks[check_id])
+        logger.info(data_tag + ' evaluated "' + check_id.lower() + '" with result ' + str(res))
+        global_results[check_id] = bool(res)
+
+    start_time = time.time()
+    dirty_table = ct.ResultTable(previous.num_frames, previous.check_ids)
+    if len(frame_checks) > 0:
+        frame_nbytes = max(frames[0].nbytes, 1) if frames.shape[0] > 0 else 1
+        chunk_size = max(1, VECTOR_CHUNK_BYTES // frame_nbytes)
+        for run in runs:
+            for start in range(run[0], run[-1] + 1, chunk_size):
+                stop = min(start + chunk_size, run[-1] + 1)
+                framer.fill_table(frames[start:stop], start, frame_checks, dirty_table)
+        end_time = time.time()
+        log_table(dirty_table, data_tag, logger, log_frames, records)
+        logger.info("re-evaluated " + str(len(dirty)) + " frames in " + str(end_time-start_time) + " sec")
+
+    table = previous.copy()
+    table.merge(dirty_table)
+    table.globals = global_results
+    return table
+
+
+def check_hdf(path, checks, dataset=hdf.EXCHANGE_DATA, data_tag=None, logger=None, axis=0, par='s',
+              engine=None, fail_fast=False, log_frames='all', records=None, cache=None):
+    """
+    This function provides validation of a dataset stored in HDF5 file.
+
+    The dataset is read in blocks of frames aligned with its chunk layout, and it is never loaded
+    as a whole. The checks of the array metadata (type, shape) are answered from the dataset's
+    attributes without reading the data. In sequential mode each block is read once, and it feeds
+    both the value checks and the frame checks. In parallel mode the engine's workers read and
+    decompress the blocks in parallel, and the value checks, if requested, read the dataset in the
+    calling process.
+
+    Parameters
+    ----------
+    path : str
+        path to the HDF5 file
+    checks : dict
+        contains functions ids as keys, and corresponding tuple of parameters as value
+    dataset : str
+        path of the dataset in the file, defaults to DXchange data
+    data_tag : str
+        string identifying the data, defaults to the file path and dataset
+    logger : logger instance
+        logger used to log events
+    axis : int
+        an axis by which the frames are ordered
+    par : str
+        's' for sequential processing, or 'p' for parallel processing
+    engine : CheckEngine
+        a worker pool used in parallel processing, if not given, a temporary engine is created
+    fail_fast : bool
+        if True, the evaluation stops as soon as any check fails
+    log_frames : str
+        'all' (default) to log a line per frame and check, 'summary' to log a line per check, or
+        None to not log frames results
+    records : str
+        path to JSON lines file the frames results are appended to, one record per frame
+    cache : ResultCache
+        on-disk cache of results, the file is identified by its path, size, and modification time
+    Returns
+    -------
+    table : ResultTable
+        results table, evaluates to True if all functions are verified, False otherwise
+    """
+    if data_tag is None:
+        data_tag = path + dataset
+    if logger is None:
+        logger = default_logger()
+
+    key = None
+    if cache is not None:
+        key = cache.key(cache_store.file_id(path) + ':' + dataset, checks, axis)
+        table = load_cached(cache, key, data_tag, logger, log_frames, records)
+        if table is not None:
+            table.axis = axis
+            return table
+
+    meta_checks = {}
+    value_checks = {}
+    frame_checks = {}
+    for check_id in checks:
+        if check_id in value_mapper:
+            value_checks[check_id] = checks[check_id]
+        elif check_id in function_mapper:
+            meta_checks[check_id] = checks[check_id]
+        elif check_id in framer.function_mapper:
+            frame_checks[check_id] = checks[check_id]
+
+    f, dset = hdf.open_dataset(path, dataset)
+    try:
+        # an array of the dataset shape and type, holding no data
+        meta = np.broadcast_to(np.zeros((), dtype=dset.dtype), dset.shape)
+        meta_table = check(meta, meta_checks, data_tag, logger, fail_fast=fail_fast)
+        if fail_fast and not meta_table:
+            meta_table.axis = axis
+            return meta_table
+        # value checks that can not fail for the dataset type are not scanned
+        elided = compile_plan(meta, value_checks).static
+
+        num_frames = dset.shape[axis]
+        ranges = hdf.block_ranges(dset, axis)
+        stats = {}
+        stat_names = [value_mapper[check_id] for check_id in value_checks if check_id not in elided]
+        start_time = time.time()
+        if par == 'p' and len(frame_checks) > 0:
+            # the workers compute the value statistics on the blocks they read
+            datas = (ct.Data(ct.Data.DATA_STATUS_FILE, ct.FileRef(path, dataset, start, stop, axis,
+                                                                   tuple(stat_names)))
+                     for start, stop in ranges)
+            if engine is None:
+                with handler.CheckEngine() as engine:
+                    table = dispatch(datas, frame_checks, data_tag, logger, engine, num_frames,
+                                     fail_fast=fail_fast, stats=stats)
+            else:
+                table = dispatch(datas, frame_checks, data_tag, logger, engine, num_frames,
+                                 fail_fast=fail_fast, stats=stats)
+        else:
+            table = ct.ResultTable(num_frames if len(frame_checks) > 0 else 0, frame_checks)
+            for start, stop in ranges:
+                block = hdf.read_block(dset, start, stop, axis)
+                if len(stat_names) > 0:
+                    merge_values(stats, scan_values(block, stat_names))
+                if len(frame_checks) > 0:
+                    failed = framer.fill_table(block, start, frame_checks, table)
+                    if fail_fast and failed:
+                        break
+        log_table(table, data_tag, logger, log_frames, records)
+        table.globals.update(meta_table.globals)
+        for check_id in sorted(value_checks):
+            value_res = elided[check_id] if check_id in elided else stats.get(value_mapper[check_id]) == 0
+            logger.info(data_tag + ' evaluated "' + check_id.lower() + '" with result ' + str(value_res))
+            table.globals[check_id] = value_res
+        if len(frame_checks) > 0:
+            end_time = time.time()
+            logger.info("evaluated " + str(num_frames) + " frames in " + str(end_time-start_time) + " sec")
+    finally:
+        f.close()
+
+    if key is not None and not fail_fast:
+        cache.put(key, table)
+    table.axis = axis
+    return table
+
+
+def check_stream(frames, checks, data_tag='mydata', logger=None, par='s', num_threads=None,
+                 engine=None, max_inflight=None):
+    """
+    This function validates frames delivered by any iterable, as the frames arrive.
+
+    It is a generator. The frames are pulled from the iterable only when there is room for them,
+    so at most "max_inflight" frames are held at any time, and the Results of each frame are
+    yielded as soon as the frame is evaluated. Only the frame functions are applied.
+    In sequential and threads mode the results are yielded in frames order, in parallel mode in
+    the order of completion; the Results index identifies the frame.
+
+    Parameters
+    ----------
+    frames : iterable
+        iterable of 2D frames, for example a generator reading files, or adapter of detector callback
+    checks : dict
+        contains frame functions ids as keys, and corresponding tuple of parameters as value
+    data_tag : str
+        string identifying the data
+    logger : logger instance
+        logger used to log events
+    par : str
+        a string indicating whether use sequential processing ('s'), parallel processing ('p'),
+        or a pool of threads ('t'), default is sequential
+    num_threads : int
+        number of threads used when processing with threads, defaults to number of cpus
+    engine : CheckEngine
+        a worker pool used in parallel processing, if not given, a temporary engine is created
+    max_inflight : int
+        maximum number of frames being evaluated, defaults to twice the number of workers
+    Returns
+    -------
+        generator of Results, one for each frame
+
+    Example:
+    for results in censor.checks.check_stream(frames, {'MEAN_IN_RANGE':(-1,5)}):
+        if results.failed:
+            print('frame', results.index, 'failed')
+    """
+    if logger is None:
+        logger = default_logger()
+    frame_checks = {}
+    for check_id in checks:
+        if check_id in framer.function_mapper:
+            frame_checks[check_id] = checks[check_id]
+        else:
+            logger.warning(data_tag + ' stream can be evaluated only by frame functions, skipping ' +
+                           check_id.lower())
+
+    aggregate = ct.Aggregate(logger, data_tag)
+    if par == 't':
+        results_gen = stream_thr(frames, frame_checks, num_threads, max_inflight)
+    elif par == 'p':
+        results_gen = stream_par(frames, frame_checks, engine, max_inflight)
+    else:
+        results_gen = (framer.process_frame_seq(ct.Data(ct.Data.DATA_STATUS_DATA, frame), index, frame_checks)
+                       for index, frame in enumerate(frames))
+    for results in results_gen:
+        aggregate.handle_results(logger, results)
+        yield results
+
+
+def stream_thr(frames, checks, num_threads=None, max_inflight=None):
+    """
+    This function evaluates frames from iterable using a pool of threads.
+
+    Parameters
+    ----------
+    frames : iterable
+        iterable of 2D frames
+    checks : dict
+        contains frame functions ids as keys, and corresponding tuple of parameters as value
+    num_threads : int
+        number of threads, defaults to number of cpus
+    max_inflight : int
+        maximum number of frames being evaluated, defaults to twice the number of threads
+    Returns
+    -------
+        generator of Results in frames order
+    """
+    if num_threads is None:
+        num_threads = cpu_count()
+    if max_inflight is None:
+        max_inflight = 2 * num_threads
+    pool = ThreadPool(num_threads)
+    pending = deque()
+    try:
+        for index, frame in enumerate(frames):
+            pending.append(pool.apply_async(framer.process_frame_seq,
+                                            (ct.Data(ct.Data.DATA_STATUS_DATA, frame), index, checks)))
+            del frame
+            if len(pending) >= max_inflight:
+                yield pending.popleft().get()
+        while len(pending) > 0:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def stream_par(frames, checks, engine=None, max_inflight=None):
+    """
+    This function evaluates frames from iterable using engine's worker processes.
+
+    The frames are submitted to the workers directly from the calling process, and the results
+    are read from the engine's results queue. If a worker fails to evaluate a frame, RuntimeError with the
+    worker's traceback is raised.
+
+    Parameters
+    ----------
+    frames : iterable
+        iterable of 2D frames
+    checks : dict
+        contains frame functions ids as keys, and corresponding tuple of parameters as value
+    engine : CheckEngine
+        a worker pool evaluating frames, if not given, a temporary engine is created
+    max_inflight : int
+        maximum number of frames being evaluated, defaults to twice the number of workers
+    Returns
+    -------
+        generator of Results in order of completion
+    """
+    if engine is None:
+        with handler.CheckEngine() as engine:
+            for results in stream_par(frames, checks, engine, max_inflight):
+                yield results
+        return
+
+    if max_inflight is None:
+        max_inflight = 2 * engine.num_workers
+    job = engine.new_job()
+    num_pending = 0
+
+    def receive():
+        item = engine.resultsq.get()
+        # skip end markers left by collectors
+        while isinstance(item, ct.Data):
+            item = engine.resultsq.get()
+        return item
+
+    def unpack(item):
+        if isinstance(item, ct.Failure):
+            raise item.error()
+        return ct.Results.unpack(item)
+
+    try:
+        for index, frame in enumerate(frames):
+            engine.submit(ct.Data(ct.Data.DATA_STATUS_DATA, frame[np.newaxis]), index, checks, job)
+            del frame
+            num_pending += 1
+            if num_pending >= max_inflight:
+                block = receive()
+                num_pending -= 1
+                for results in unpack(block):
+                    yield results
+        while num_pending > 0:
+            block = receive()
+            num_pending -= 1
+            for results in unpack(block):
+                yield results
+    finally:
+        # if the caller stopped early, do not leave the job's results in the engine's queue
+        engine.cancel(job)
+        while num_pending > 0:
+            receive()
+            num_pending -= 1
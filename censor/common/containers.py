@@ -49,10 +49,18 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+import json
+import logging
+import struct
+import numpy as np
+
 __author__ = "Barbara Frosik"
 __copyright__ = "Copyright (c), UChicago Argonne, LLC."
 __docformat__ = 'restructuredtext en'
 
+# number of frames records written at once
+RECORDS_BATCH = 1024
+
 
 class Data:
     """
@@ -61,39 +69,599 @@ class Data:
     The Data container is used to pack data frames that are delivered to another process.
     If all frames are enqueued, the providing process communicates the end by enqueuing
     data with the status "DATA_STATUS_END".
-    The status is "DATA_STATUS_DATA" for data containing frame.
+    The status is "DATA_STATUS_DATA" for data containing frame, and "DATA_STATUS_SHARED" for data
+    containing a reference to a frame in shared memory, and "DATA_STATUS_FILE" for data containing
+    a reference to frames in HDF5 file.
+    The containers are slotted and pickled as constructor arguments, as they are delivered
+    once per frame or block of frames.
     """
+    __slots__ = ('status', 'slice', 'ref')
+
     DATA_STATUS_DATA = 0
+    DATA_STATUS_SHARED = 1
     DATA_STATUS_END = 2
+    DATA_STATUS_FILE = 3
 
     def __init__(self, status, slice=None):
         self.status = status
         if status == self.DATA_STATUS_DATA:
             self.slice = slice
+        elif status in (self.DATA_STATUS_SHARED, self.DATA_STATUS_FILE):
+            self.ref = slice
+
+    def __reduce__(self):
+        if self.status == self.DATA_STATUS_DATA:
+            return Data, (self.status, self.slice)
+        elif self.status in (self.DATA_STATUS_SHARED, self.DATA_STATUS_FILE):
+            return Data, (self.status, self.ref)
+        return Data, (self.status,)
+
+
+class FrameRef:
+    """
+    This class describes a frame residing in a shared memory segment.
+
+    The frame reference is delivered to worker processes in place of the frame, with the status
+    "DATA_STATUS_SHARED". The worker attaches to the segment by name and reads the frame as a view,
+    without copying.
+    """
+    __slots__ = ('name', 'offset', 'shape', 'dtype')
+
+    def __init__(self, name, offset, shape, dtype):
+        self.name = name
+        self.offset = offset
+        self.shape = shape
+        self.dtype = dtype
+
+    def __reduce__(self):
+        return FrameRef, (self.name, self.offset, self.shape, self.dtype)
+
+
+class FileRef:
+    """
+    This class describes a block of consecutive frames stored in HDF5 file.
+
+    The file reference is delivered to worker processes with the status "DATA_STATUS_FILE".
+    The worker reads and decompresses the block itself, so the blocks are decompressed in parallel.
+    If value statistics are requested, the worker computes them on the block it read.
+    """
+    __slots__ = ('path', 'dataset', 'start', 'stop', 'axis', 'stats')
+
+    def __init__(self, path, dataset, start, stop, axis, stats=None):
+        self.path = path
+        self.dataset = dataset
+        self.start = start
+        self.stop = stop
+        self.axis = axis
+        self.stats = stats
+
+    def __reduce__(self):
+        return FileRef, (self.path, self.dataset, self.start, self.stop, self.axis, self.stats)
 
 
 class Result:
     """
-    This class encapsulates result of verification and the verification id.
+    This class encapsulates result of verification and the verification id, and optionally
+    the metric the result was derived from.
     """
-    def __init__(self, res, ver_id):
+    __slots__ = ('res', 'ver_id', 'value')
+
+    def __init__(self, res, ver_id, value=None):
         self.res = res
         self.ver_id = ver_id
+        self.value = value
+
+    def __reduce__(self):
+        return Result, (self.res, self.ver_id, self.value)
 
 
 class Results:
     """
     This class encapsulates a results of all quality checks for a single frame, and attributes verification flag
     and index.
+
+    Lists of frames results are delivered between processes in a compact binary encoding, see
+    "pack" and "unpack". Results of a block of frames may carry value statistics of the block.
     """
-    def __init__(self, index, failed, results):
+    __slots__ = ('index', 'failed', 'results', 'stats')
+
+    # number of frames, number of checks, length of the encoded verification ids
+    HEADER = struct.Struct('<III')
+
+    def __init__(self, index, failed, results, stats=None):
         self.index = index
         self.failed = failed
         self.results = results
+        self.stats = stats
+
+    def __reduce__(self):
+        return Results, (self.index, self.failed, self.results, self.stats)
+
+    @staticmethod
+    def pack(block):
+        """
+        This function encodes results of a block of frames into bytes.
+
+        The frames must be evaluated by the same checks, in the same order. The verification ids
+        are encoded once, followed by arrays of frames indexes, failed flags, results, and values.
+        The values are encoded as floats, a missing value as nan.
+
+        Parameters
+        ----------
+        block : list
+            list of Results instances
+        Returns
+        -------
+        buffer : bytes
+            encoded results
+        """
+        num_frames = len(block)
+        ver_ids = [result.ver_id for result in block[0].results] if num_frames > 0 else []
+        num_checks = len(ver_ids)
+        names = '\n'.join(ver_ids).encode('utf-8')
+        indexes = np.fromiter((rs.index for rs in block), dtype=np.int64, count=num_frames)
+        failed = np.fromiter((rs.failed for rs in block), dtype=bool, count=num_frames)
+        res = np.fromiter((result.res for rs in block for result in rs.results), dtype=bool,
+                          count=num_frames * num_checks)
+        values = np.fromiter((np.nan if result.value is None else result.value
+                              for rs in block for result in rs.results),
+                             dtype=np.float64, count=num_frames * num_checks)
+        return b''.join((Results.HEADER.pack(num_frames, num_checks, len(names)), names,
+                         indexes.tobytes(), failed.tobytes(), res.tobytes(), values.tobytes()))
+
+    @staticmethod
+    def unpack(buffer):
+        """
+        This function decodes results of a block of frames encoded by "pack".
+
+        Parameters
+        ----------
+        buffer : bytes
+            encoded results
+        Returns
+        -------
+        block : list
+            list of Results instances
+        """
+        num_frames, num_checks, names_len = Results.HEADER.unpack_from(buffer)
+        offset = Results.HEADER.size
+        ver_ids = buffer[offset:offset + names_len].decode('utf-8').split('\n')
+        offset += names_len
+        indexes = np.frombuffer(buffer, dtype=np.int64, count=num_frames, offset=offset)
+        offset += indexes.nbytes
+        failed = np.frombuffer(buffer, dtype=bool, count=num_frames, offset=offset)
+        offset += failed.nbytes
+        res = np.frombuffer(buffer, dtype=bool, count=num_frames * num_checks, offset=offset)
+        offset += res.nbytes
+        values = np.frombuffer(buffer, dtype=np.float64, count=num_frames * num_checks, offset=offset)
+        res = res.reshape(num_frames, num_checks).tolist()
+        values = values.reshape(num_frames, num_checks).tolist()
+        failed = failed.tolist()
+        block = []
+        for i, index in enumerate(indexes.tolist()):
+            # nan is the only value not equal to itself
+            results = [Result(res[i][j], ver_ids[j], values[i][j] if values[i][j] == values[i][j] else None)
+                       for j in range(num_checks)]
+            block.append(Results(index, failed[i], results))
+        return block
+
+
+class Failure:
+    """
+    This class reports an error raised by worker evaluating a block of frames.
+
+    The worker delivers it in place of the block results, with the formatted traceback, and the
+    process collecting the results raises the error in the caller.
+    """
+    __slots__ = ('index', 'trace')
+
+    def __init__(self, index, trace):
+        self.index = index
+        self.trace = trace
+
+    def __reduce__(self):
+        return Failure, (self.index, self.trace)
+
+    def error(self):
+        """
+        This function returns exception describing the failure.
+
+        Returns
+        -------
+            RuntimeError
+        """
+        return RuntimeError('evaluation of frames from index ' + str(self.index) +
+                            ' failed in worker:\n' + self.trace)
+
+
+class TableRef:
+    """
+    This class describes a results table residing in a shared memory segment.
+
+    The table reference is delivered to worker processes with each block of frames, and the
+    workers write the results of the block directly into the table. If the name is None, shared
+    memory is not available, and the workers deliver the results of each block in a small table.
+    """
+    __slots__ = ('name', 'num_frames', 'check_ids')
+
+    def __init__(self, name, num_frames, check_ids):
+        self.name = name
+        self.num_frames = num_frames
+        self.check_ids = check_ids
+
+    def __reduce__(self):
+        return TableRef, (self.name, self.num_frames, self.check_ids)
+
+
+class FrameStats:
+    """
+    This class holds statistics of a block of frames, one value per frame.
+
+    The statistics are the primitives the frame checks are evaluated from: sum of pixels, minimum,
+    maximum, number of nan pixels, and numbers of pixels above given thresholds. Only the requested
+    statistics are computed, the others are None.
+    """
+    __slots__ = ('size', 'sum', 'min', 'max', 'nan', 'above')
+
+    def __init__(self, size):
+        self.size = size
+        self.sum = None
+        self.min = None
+        self.max = None
+        self.nan = None
+        # maps threshold to numbers of pixels above the threshold
+        self.above = {}
+
+
+class ResultTable:
+    """
+    This class is a columnar store of results of data set evaluation.
+
+    The frame results are held in arrays with one row per frame and one column per frame check:
+    "passed" holds the verification results, and "values" the metrics the results were derived
+    from (for example mean value, number of saturated pixels), nan if the check has no metric.
+    The "evaluated" array flags the frames that were evaluated. The results of the checks
+    evaluating the whole array are kept in "globals" dictionary.
+    The table evaluates to True if all checks passed, so it can be used as a verification flag.
+    """
+    def __init__(self, num_frames, check_ids, buffer=None):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        num_frames : int
+            number of frames
+        check_ids : list
+            ids of the frame checks, in columns order
+        buffer : buffer
+            memory the arrays are placed in, for example shared memory; if not given, the arrays
+            are allocated
+        """
+        self.check_ids = list(check_ids)
+        self.globals = {}
+        # maps check to Estimate, if the table holds results of sampled evaluation
+        self.estimates = {}
+        # axis by which the frames were ordered, if known
+        self.axis = None
+        shape = (num_frames, len(self.check_ids))
+        if buffer is None:
+            self.values = np.full(shape, np.nan)
+            self.passed = np.ones(shape, dtype=bool)
+            self.evaluated = np.zeros(num_frames, dtype=bool)
+        else:
+            self.values = np.ndarray(shape, dtype=np.float64, buffer=buffer)
+            self.passed = np.ndarray(shape, dtype=bool, buffer=buffer, offset=self.values.nbytes)
+            self.evaluated = np.ndarray(num_frames, dtype=bool, buffer=buffer,
+                                        offset=self.values.nbytes + self.passed.nbytes)
+
+    @staticmethod
+    def buffer_size(num_frames, num_checks):
+        """
+        This function returns size of buffer holding table arrays.
+
+        Parameters
+        ----------
+        num_frames : int
+            number of frames
+        num_checks : int
+            number of frame checks
+        Returns
+        -------
+            size in bytes
+        """
+        return num_frames * num_checks * 9 + num_frames
+
+    def __bool__(self):
+        return all(self.globals.values()) and bool(self.passed.all())
+
+    __nonzero__ = __bool__
+
+    @property
+    def num_frames(self):
+        """
+        Number of frames in the table.
+        """
+        return self.passed.shape[0]
+
+    def copy(self):
+        """
+        This function returns a copy of the table, with arrays allocated in memory.
+
+        Returns
+        -------
+        table : ResultTable
+            the copy
+        """
+        table = ResultTable(0, self.check_ids)
+        table.globals = dict(self.globals)
+        table.estimates = dict(self.estimates)
+        table.axis = self.axis
+        table.values = self.values.copy()
+        table.passed = self.passed.copy()
+        table.evaluated = self.evaluated.copy()
+        return table
+
+    def fill(self, index, table):
+        """
+        This function copies results of a block of frames into the table.
+
+        Parameters
+        ----------
+        index : int
+            index of the first frame of the block
+        table : ResultTable
+            results of the block, with the same checks
+        Returns
+        -------
+        none
+        """
+        stop = index + table.num_frames
+        self.values[index:stop] = table.values
+        self.passed[index:stop] = table.passed
+        self.evaluated[index:stop] = table.evaluated
+
+    def merge(self, table):
+        """
+        This function replaces results of frames evaluated in the given table.
+
+        The table must have the same frames and checks. The frames not evaluated in the given table
+        keep their results.
+
+        Parameters
+        ----------
+        table : ResultTable
+            results of re-evaluated frames
+        Returns
+        -------
+        none
+        """
+        rows = np.nonzero(table.evaluated)[0]
+        self.values[rows] = table.values[rows]
+        self.passed[rows] = table.passed[rows]
+        self.evaluated[rows] = True
+        self.globals.update(table.globals)
+
+    def failed_frames(self, check_id=None):
+        """
+        This function returns indexes of frames that failed verification.
+
+        Parameters
+        ----------
+        check_id : str
+            id of the frame check, if not given, frames failing any check are returned
+        Returns
+        -------
+            array of frame indexes
+        """
+        if check_id is None:
+            return np.nonzero(~self.passed.all(axis=1))[0]
+        return np.nonzero(~self.passed[:, self.check_ids.index(check_id)])[0]
+
+    def column(self, check_id):
+        """
+        This function returns results and metrics of the given frame check.
+
+        Parameters
+        ----------
+        check_id : str
+            id of the frame check
+        Returns
+        -------
+        passed : ndarray
+            results of each frame
+        values : ndarray
+            metrics of each frame
+        """
+        i = self.check_ids.index(check_id)
+        return self.passed[:, i], self.values[:, i]
+
+
+class Sample:
+    """
+    This class describes sampled evaluation of data set, used for fast triage.
+
+    A seeded random subset of frames is evaluated, and the value checks optionally scan only
+    a random tile of each sampled frame. The same seed selects the same frames and tiles.
+    A check is decided from the sample when a failure is found, or when the upper confidence
+    bound of the failing fraction is not above the tolerance, otherwise the sample is inconclusive.
+    """
+    __slots__ = ('frames', 'tile', 'seed', 'confidence', 'tolerance', 'escalate')
+
+    def __init__(self, frames=0.01, tile=None, seed=0, confidence=0.95, tolerance=0.01, escalate=True):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        frames : float or int
+            fraction of frames to evaluate if float, or number of frames if int; at least one
+            frame is evaluated, and a fraction is enlarged to the number of frames that can pass
+            the tolerance
+        tile : tuple
+            shape of the tile scanned by the value checks in each sampled frame, if not given,
+            the whole frames are scanned; the frame checks always evaluate whole frames
+        seed : int
+            seed of the random selection
+        confidence : float
+            confidence level of the upper bounds
+        tolerance : float
+            fraction of failing frames or pixels accepted as passing the triage
+        escalate : bool
+            if True, the data set is evaluated completely when the sample is inconclusive
+        """
+        self.frames = frames
+        self.tile = tile
+        self.seed = seed
+        self.confidence = confidence
+        self.tolerance = tolerance
+        self.escalate = escalate
+
+    def __reduce__(self):
+        return Sample, (self.frames, self.tile, self.seed, self.confidence, self.tolerance,
+                        self.escalate)
+
+
+class Estimate:
+    """
+    This class holds result of check estimated from a sample.
+
+    The estimate is the fraction of failing frames, or failing pixels for value checks, in the
+    sample, and the upper is its upper confidence bound. The decision is 'passed', 'failed', or
+    'inconclusive'.
+    """
+    __slots__ = ('estimate', 'upper', 'sampled', 'decision')
+
+    def __init__(self, estimate, upper, sampled, decision):
+        self.estimate = estimate
+        self.upper = upper
+        self.sampled = sampled
+        self.decision = decision
+
+    def __reduce__(self):
+        return Estimate, (self.estimate, self.upper, self.sampled, self.decision)
+
+    def __repr__(self):
+        return (self.decision + ' (estimate ' + format(self.estimate, '.3g') + ', upper bound ' +
+                format(self.upper, '.3g') + ', ' + str(self.sampled) + ' sampled)')
+
+
+class CheckPlan:
+    """
+    This class is an execution plan of checks, compiled before the data is read.
+
+    The functions evaluating the whole array are listed in order of evaluation. Each of them is
+    either answered from the array metadata, or computed from the value statistics that are
+    gathered in one pass over the array, or called. The frame functions are listed with the
+    way each is evaluated: from frames statistics shared by all frame functions, by vectorized
+    function, or frame by frame; the mode is the execution mode chosen for the frames.
+    """
+    def __init__(self):
+        self.order = []
+        # maps check to result answered from metadata
+        self.static = {}
+        # maps check to value statistic computed in the single pass
+        self.scan = {}
+        self.frames = {}
+        # maps frame check to 'stats', 'vector', or 'frame'
+        self.frame_modes = {}
+        self.frame_stats = set()
+        self.thresholds = set()
+        self.mode = None
+
+    def describe(self):
+        """
+        This function returns description of the plan.
+
+        Returns
+        -------
+        description : str
+            the plan in one line
+        """
+        parts = []
+        if len(self.static) > 0:
+            parts.append('metadata: ' + ', '.join(check + '=' + str(self.static[check])
+                                                  for check in self.order if check in self.static))
+        if len(self.scan) > 0:
+            parts.append('one pass: ' + ', '.join(sorted(set(self.scan.values()))))
+        calls = [check for check in self.order if check not in self.static and check not in self.scan]
+        if len(calls) > 0:
+            parts.append('calls: ' + ', '.join(calls))
+        if len(self.frames) > 0:
+            parts.append('frames (' + str(self.mode) + '): ' +
+                         ', '.join(check + '[' + self.frame_modes[check] + ']' for check in self.frames))
+        if len(self.frame_stats) > 0:
+            parts.append('frame statistics: ' + ', '.join(sorted(self.frame_stats)) +
+                         ''.join(' above ' + str(threshold) for threshold in sorted(self.thresholds)))
+        return '; '.join(parts)
+
+
+class RepairRecord:
+    """
+    This class records which frames were changed by a repair.
+
+    The repair flags a frame as dirty if any of its elements was replaced. The values fixes that
+    were applied are recorded, as after the repair no element of the array has the repaired
+    characteristic. A type conversion that may change values makes all frames dirty.
+    """
+    def __init__(self, shape, axis=0):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        shape : tuple
+            shape of the repaired array
+        axis : int
+            an axis by which the frames are ordered
+        """
+        self.axis = axis
+        self.shape = tuple(shape)
+        num_frames = shape[axis] if len(shape) == 3 else 1
+        self.dirty = np.zeros(num_frames, dtype=bool)
+        self.fixes = []
+
+    def mark(self, chunk_slice, mask):
+        """
+        This function flags frames having any element in the mask as dirty.
+
+        Parameters
+        ----------
+        chunk_slice : slice
+            slice of the repaired array along the first axis the mask belongs to, or Ellipsis
+        mask : ndarray
+            flags of replaced elements in the chunk
+        Returns
+        -------
+        none
+        """
+        if len(self.shape) != 3:
+            self.dirty[0] |= bool(mask.any())
+        elif self.axis == 0:
+            self.dirty[chunk_slice] |= mask.reshape(mask.shape[0], -1).any(axis=1)
+        else:
+            other = tuple(i for i in range(3) if i != self.axis)
+            self.dirty |= mask.any(axis=other)
+
+    def dirty_frames(self):
+        """
+        This function returns indexes of dirty frames.
+
+        Returns
+        -------
+            array of frame indexes
+        """
+        return np.nonzero(self.dirty)[0]
+
 
 class Aggregate:
     """
     This class encapsulates a results of data set.
+
+    The results are logged lazily, the messages are not formatted if the logger does not handle
+    INFO level. The frames results can be logged one line per frame and check, or summarized
+    one line per check, with the failed frames encoded as runs. The results can be also written
+    as JSON records, one line per frame, in batches.
     """
     def __init__(self, logger, data_tag):
         self.data_tag = data_tag
@@ -114,11 +682,122 @@ class Aggregate:
         -------
         none
         """
+        if not logger.isEnabledFor(logging.INFO):
+            return
         for result in rs.results:
-            res = result.res
-            ver_id = result.ver_id
-            logger.info(self.data_tag + ' evaluated frame #' + str(rs.index) + ' ' +
-                        ver_id + ' with result ' + str(res))
+            logger.info('%s evaluated frame #%d %s with result %s', self.data_tag, rs.index,
+                        result.ver_id, result.res)
 
+    def handle_table(self, logger, table, ver_ids, summary=False):
+        """
+        This function handles results of evaluation of frames held in results table.
 
+        Each result of evaluated frame is logged in the log file with data tag, frame number,
+        and the evaluation. If summary is requested, one line per check is logged instead, for
+        example: "mydata frames 0-1799 mean_in_range: pass except [17, 933-935]".
 
+        Parameters
+        logger : logger instance
+            logger used to log events
+        table : ResultTable
+            results of frames validation
+        ver_ids : dict
+            maps the frame checks ids to the verification ids
+        summary : bool
+            if True, the results are summarized per check
+        Returns
+        -------
+        none
+        """
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        names = [ver_ids.get(check_id, check_id.lower()) for check_id in table.check_ids]
+        evaluated = np.nonzero(table.evaluated)[0]
+        if summary:
+            if len(evaluated) == 0:
+                return
+            if len(evaluated) == table.num_frames:
+                frames = '0-' + str(table.num_frames - 1)
+            else:
+                frames = format_runs(evaluated)
+            for i in range(len(names)):
+                failed = np.nonzero(~table.passed[evaluated, i])[0]
+                if len(failed) == 0:
+                    outcome = 'pass'
+                elif len(failed) == len(evaluated):
+                    outcome = 'fail'
+                else:
+                    outcome = 'pass except [' + format_runs(evaluated[failed]) + ']'
+                logger.info('%s frames %s %s: %s', self.data_tag, frames, names[i], outcome)
+            return
+        passed = table.passed.tolist()
+        for index in evaluated.tolist():
+            for i in range(len(names)):
+                logger.info('%s evaluated frame #%d %s with result %s', self.data_tag, index, names[i],
+                            passed[index][i])
+
+    def write_records(self, path, table, ver_ids, batch_size=RECORDS_BATCH):
+        """
+        This function appends results of evaluated frames to a JSON lines file.
+
+        Each frame is written as one record with data tag, frame number, and the result and
+        value of each check, for example:
+        {"data_tag": "mydata", "frame": 17, "mean_in_range": false, "mean_in_range_value": 9.0}
+        The records are encoded and written in batches of frames.
+
+        Parameters
+        ----------
+        path : str
+            path to the records file
+        table : ResultTable
+            results of frames validation
+        ver_ids : dict
+            maps the frame checks ids to the verification ids
+        batch_size : int
+            number of records written at once
+        Returns
+        -------
+        none
+        """
+        names = [ver_ids.get(check_id, check_id.lower()) for check_id in table.check_ids]
+        evaluated = np.nonzero(table.evaluated)[0]
+        with open(path, 'a') as f:
+            for start in range(0, len(evaluated), batch_size):
+                rows = evaluated[start:start + batch_size]
+                passed = table.passed[rows].tolist()
+                values = table.values[rows].tolist()
+                lines = []
+                for j, index in enumerate(rows.tolist()):
+                    record = {'data_tag': self.data_tag, 'frame': index}
+                    for i in range(len(names)):
+                        record[names[i]] = passed[j][i]
+                        # nan is the only value not equal to itself
+                        if values[j][i] == values[j][i]:
+                            record[names[i] + '_value'] = values[j][i]
+                    lines.append(json.dumps(record))
+                f.write('\n'.join(lines) + '\n')
+
+
+def format_runs(indexes):
+    """
+    This function encodes sorted indexes as runs of consecutive indexes.
+
+    Parameters
+    ----------
+    indexes : ndarray
+        sorted indexes
+    Returns
+    -------
+    runs : str
+        comma separated runs, for example "17, 933-935"
+    """
+    indexes = np.asarray(indexes)
+    if len(indexes) == 0:
+        return ''
+    breaks = np.nonzero(np.diff(indexes) != 1)[0]
+    starts = np.concatenate(([0], breaks + 1))
+    stops = np.concatenate((breaks, [len(indexes) - 1]))
+    runs = []
+    for start, stop in zip(indexes[starts].tolist(), indexes[stops].tolist()):
+        runs.append(str(start) if start == stop else str(start) + '-' + str(stop))
+    return ', '.join(runs)
@@ -60,9 +60,31 @@ import censor.common.containers as ct
 __author__ = "Barbara Frosik"
 __copyright__ = "Copyright (c), UChicago Argonne, LLC."
 __docformat__ = 'restructuredtext en'
+
+# integer frames of at most this item size are histogrammed exactly, one bin per value
+HIST_MAX_ITEMSIZE = 2
+# default number of bins of frames histograms
+HIST_BINS = 256
+# numbers of thresholds from which the pixels are counted in one pass, by histogram for small
+# integer types, or by searching the thresholds for other types; fewer thresholds are compared
+# one by one, as numpy comparisons are faster per pass
+HIST_MIN_THRESHOLDS = 8
+SEARCH_MIN_THRESHOLDS = 48
 __all__ = ['sat_in_range',
            'mean_in_range',
-           'process_frame']
+           'sat_levels',
+           'sat_in_range_v',
+           'mean_in_range_v',
+           'sat_levels_v',
+           'process_frame',
+           'process_frame_seq',
+           'process_block',
+           'process_stack',
+           'compute_stats',
+           'count_above',
+           'frame_histograms',
+           'evaluate_block',
+           'fill_table']
 
 def sat_in_range(arr, args):
     """
@@ -86,7 +108,7 @@ def sat_in_range(arr, args):
     sat_pixels = (arr > args[0]).sum()
     # args[1] is a limit of saturated pixels
     res = sat_pixels < args[1]
-    result = ct.Result(res, 'saturation_in_range')
+    result = ct.Result(res, 'saturation_in_range', sat_pixels)
     return result
 
 
@@ -108,13 +130,211 @@ def mean_in_range(arr, args):
     """
     mn = np.mean(arr)
     res = mn > args[0] and mn < args[1]
-    return ct.Result(res, 'mean_in_range')
+    return ct.Result(res, 'mean_in_range', mn)
+
+
+def sat_levels(arr, args):
+    """
+    This method validates saturation at several levels. The arguments are positional.
+
+    Each argument is a pair of pixel saturation limit and a limit of number of saturated pixels,
+    at least one pair is given. The frame is saturated if the number of pixels above any of the saturation limits exceeds the
+    corresponding limit. The counts at all levels are computed in one pass over the frame.
+
+    Parameters
+    ----------
+    arr : 2D array
+        a frame
+    args : tuple
+        a tuple containing (saturation limit, saturated pixels limit) pairs
+    Returns
+    -------
+        result : object, with number of levels exceeding the limits as value
+    """
+    result = sat_levels_v(arr[np.newaxis], args)
+    return ct.Result(result.res[0], result.ver_id, result.value[0])
+
+
+def sat_in_range_v(stack, args):
+    """
+    This method validates saturation of each frame in a stack. The arguments are positional.
+
+    It is a vectorized version of sat_in_range; the frames are reduced in one numpy call.
+
+    Parameters
+    ----------
+    stack : 3D array
+        frames ordered by the first axis
+    args : tuple
+        a tuple containing positional arguments
+    Returns
+    -------
+        result : object with array of results, one for each frame
+    """
+    sat_pixels = (stack > args[0]).sum(axis=tuple(range(1, stack.ndim)))
+    return ct.Result(sat_pixels < args[1], 'saturation_in_range', sat_pixels)
+
+
+def mean_in_range_v(stack, args):
+    """
+    This method validates mean value of each frame in a stack. The arguments are positional.
+
+    It is a vectorized version of mean_in_range; the frames are reduced in one numpy call.
+
+    Parameters
+    ----------
+    stack : 3D array
+        frames ordered by the first axis
+    args : tuple
+        a tuple containing positional arguments
+    Returns
+    -------
+        result : object with array of results, one for each frame
+    """
+    mn = np.mean(stack, axis=tuple(range(1, stack.ndim)))
+    return ct.Result((mn > args[0]) & (mn < args[1]), 'mean_in_range', mn)
+
+
+def sat_levels_v(stack, args):
+    """
+    This method validates saturation of each frame in a stack at several levels. The arguments are positional.
+
+    It is a vectorized version of sat_levels.
+
+    Parameters
+    ----------
+    stack : 3D array
+        frames ordered by the first axis
+    args : tuple
+        a tuple containing (saturation limit, saturated pixels limit) pairs
+    Returns
+    -------
+        result : object with array of results, one for each frame
+    """
+    stats = ct.FrameStats(int(np.prod(stack.shape[1:])))
+    stats.above = count_above(stack, levels_thresholds(args))
+    return sat_levels_s(stats, args)
+
+
+def mean_in_range_s(stats, args):
+    """
+    This method validates mean value of each frame from frames statistics. The arguments are positional.
+
+    Parameters
+    ----------
+    stats : FrameStats
+        statistics of frames, with sum
+    args : tuple
+        a tuple containing positional arguments
+    Returns
+    -------
+        result : object with array of results, one for each frame
+    """
+    mn = stats.sum / stats.size
+    return ct.Result((mn > args[0]) & (mn < args[1]), 'mean_in_range', mn)
+
+
+def sat_in_range_s(stats, args):
+    """
+    This method validates saturation of each frame from frames statistics. The arguments are positional.
+
+    Parameters
+    ----------
+    stats : FrameStats
+        statistics of frames, with number of pixels above the saturation limit
+    args : tuple
+        a tuple containing positional arguments
+    Returns
+    -------
+        result : object with array of results, one for each frame
+    """
+    sat_pixels = stats.above[args[0]]
+    return ct.Result(sat_pixels < args[1], 'saturation_in_range', sat_pixels)
+
+
+def sat_levels_s(stats, args):
+    """
+    This method validates saturation of each frame at several levels from frames statistics. The arguments are positional.
+
+    Parameters
+    ----------
+    stats : FrameStats
+        statistics of frames, with numbers of pixels above the saturation limits
+    args : tuple
+        a tuple containing (saturation limit, saturated pixels limit) pairs
+    Returns
+    -------
+        result : object with array of results, one for each frame, and number of levels
+        exceeding the limits as values
+    """
+    exceeded = np.sum([stats.above[threshold] >= limit for threshold, limit in args], axis=0)
+    return ct.Result(exceeded == 0, 'saturation_levels', exceeded)
+
+
+def sat_thresholds(args):
+    """
+    This method returns the thresholds counted by sat_in_range.
+
+    Parameters
+    ----------
+    args : tuple
+        a tuple containing positional arguments of sat_in_range
+    Returns
+    -------
+        tuple of thresholds
+    """
+    return (args[0],)
+
+
+def levels_thresholds(args):
+    """
+    This method returns the thresholds counted by sat_levels.
+
+    Parameters
+    ----------
+    args : tuple
+        a tuple containing (saturation limit, saturated pixels limit) pairs
+    Returns
+    -------
+        tuple of thresholds
+    """
+    return tuple(level[0] for level in args)
 
 
 # maps the quality check ID to the function object
 function_mapper = {
                      'MEAN_IN_RANGE' : mean_in_range,
-                     'SAT_IN_RANGE' : sat_in_range
+                     'SAT_IN_RANGE' : sat_in_range,
+                     'SAT_LEVELS' : sat_levels
+                   }
+
+# maps the quality check ID to the vectorized function object
+vector_mapper = {
+                     'MEAN_IN_RANGE' : mean_in_range_v,
+                     'SAT_IN_RANGE' : sat_in_range_v,
+                     'SAT_LEVELS' : sat_levels_v
+                   }
+
+# maps the quality check ID to the function evaluating frames statistics
+stats_mapper = {
+                     'MEAN_IN_RANGE' : mean_in_range_s,
+                     'SAT_IN_RANGE' : sat_in_range_s,
+                     'SAT_LEVELS' : sat_levels_s
+                   }
+
+# maps the quality check ID to the statistics it is evaluated from, and the function returning
+# thresholds from the arguments, if the check counts pixels above thresholds
+stats_needed = {
+                     'MEAN_IN_RANGE' : (('sum',), None),
+                     'SAT_IN_RANGE' : (('above',), sat_thresholds),
+                     'SAT_LEVELS' : (('above',), levels_thresholds)
+                   }
+
+# maps the quality check ID to the verification id reported in results
+ver_ids = {
+                     'MEAN_IN_RANGE' : 'mean_in_range',
+                     'SAT_IN_RANGE' : 'saturation_in_range',
+                     'SAT_LEVELS' : 'saturation_levels'
                    }
 
 
@@ -156,9 +376,8 @@ def process_frame_seq(data, index, functions):
     """
     This method dispatches validation/repair functions that are included in the functions dictionary.
 
-    It calls a function defined in the functions dictionary, using the dictionary value as an argument.
-    The Results objects returned by each function are encapsulated in Results object and enqueued in a
-    results queue.
+    It evaluates the frame with the functions defined in the functions dictionary, using the dictionary
+    value as an argument. The Result objects are encapsulated in Results object.
 
     Parameters
     ----------
@@ -166,22 +385,299 @@ def process_frame_seq(data, index, functions):
         a frame
     index : int
         a frame index
-    resultsq : queue
-        a queue that will deliver results to parent process
     functions : dict
         a dictionary containing functins ids, and tuple values, the tuple containing positional arguments.
     Returns
     -------
-        none
+        results : Results
     """
-    results_list = []
-    failed = False
-    for function_id in functions:
-        function = function_mapper[function_id]
-        result = function(data.slice, functions[function_id])
-        results_list.append(result)
-        if not result.res:
-            failed = True
+    return process_block(data.slice[np.newaxis], index, functions)[0]
 
-    results = ct.Results(index, failed, results_list)
+
+def process_block(block, index, functions):
+    """
+    This method evaluates a block of consecutive frames.
+
+    The block is evaluated by evaluate_block, and the results are split into Results objects,
+    one for each frame.
+
+    Parameters
+    ----------
+    block : 3D array
+        a block of frames ordered by the first axis
+    index : int
+        index of the first frame in the block
+    functions : dict
+        a dictionary containing functins ids, and tuple values, the tuple containing positional arguments.
+    Returns
+    -------
+    results : list
+        list of Results objects, one for each frame
+    """
+    block_results = evaluate_block(block, functions)
+    results = []
+    for i in range(block.shape[0]):
+        results_list = [ct.Result(result.res[i], result.ver_id, result.value[i]) for result in block_results]
+        failed = not all(result.res for result in results_list)
+        results.append(ct.Results(index + i, failed, results_list))
+    return results
+
+
+def process_stack(stack, functions):
+    """
+    This method evaluates a stack of frames using vectorized functions.
+
+    Parameters
+    ----------
+    stack : 3D array
+        frames ordered by the first axis
+    functions : dict
+        a dictionary containing functins ids, and tuple values, the tuple containing positional arguments.
+    Returns
+    -------
+    results : list
+        list of Result objects, each holding array of results, one for each frame
+    """
+    return evaluate_block(stack, functions)
+
+
+def compute_stats(block, names, thresholds=()):
+    """
+    This method computes statistics of each frame in a block of frames.
+
+    Parameters
+    ----------
+    block : 3D array
+        a block of frames ordered by the first axis
+    names : iterable
+        names of the requested statistics: 'sum', 'min', 'max', 'nan'
+    thresholds : iterable
+        the numbers of pixels above each of the thresholds are counted, several thresholds are
+        counted in one pass by "count_above"
+    Returns
+    -------
+    stats : FrameStats
+        statistics of the frames
+    """
+    axes = tuple(range(1, block.ndim))
+    stats = ct.FrameStats(int(np.prod(block.shape[1:])))
+    if 'sum' in names:
+        # integer and half precision frames are summed in float64, as they would overflow
+        dtype = None if block.dtype.itemsize >= 4 and np.issubdtype(block.dtype, np.inexact) else np.float64
+        stats.sum = block.sum(axis=axes, dtype=dtype)
+    if 'min' in names:
+        stats.min = block.min(axis=axes)
+    if 'max' in names:
+        stats.max = block.max(axis=axes)
+    if 'nan' in names:
+        if np.issubdtype(block.dtype, np.inexact):
+            stats.nan = np.isnan(block).sum(axis=axes)
+        else:
+            stats.nan = np.zeros(block.shape[0], dtype=np.int64)
+    if len(thresholds) > 0:
+        stats.above = count_above(block, thresholds)
+    return stats
+
+
+def int_histograms(block):
+    """
+    This method computes exact histogram of each frame of small integer type, one bin per value.
+
+    Parameters
+    ----------
+    block : 3D array
+        a block of frames ordered by the first axis, of integer type of at most HIST_MAX_ITEMSIZE bytes
+    Returns
+    -------
+    hist : ndarray
+        histograms, one row per frame
+    offset : int
+        the value of the first bin
+    """
+    if block.dtype.kind == 'b':
+        offset, num_bins = 0, 2
+    else:
+        info = np.iinfo(block.dtype)
+        offset, num_bins = int(info.min), int(info.max) - int(info.min) + 1
+    num_frames = block.shape[0]
+    # the frames are histogrammed by one bincount, each frame's values shifted to its own bins
+    values = block.reshape(num_frames, -1).astype(np.int64)
+    values -= offset
+    values += (np.arange(num_frames, dtype=np.int64) * num_bins)[:, np.newaxis]
+    hist = np.bincount(values.ravel(), minlength=num_frames * num_bins)
+    return hist.reshape(num_frames, num_bins), offset
+
+
+def count_above(block, thresholds):
+    """
+    This method counts pixels above each of the thresholds in each frame, in one pass.
+
+    The frames of small integer types are histogrammed exactly, and the counts are read from the
+    cumulative histograms. For other types, each pixel is assigned the number of thresholds it
+    exceeds, and the assignments are counted per frame. Any number of thresholds costs about
+    the same. If there are only a few thresholds, the pixels are compared with each threshold.
+
+    Parameters
+    ----------
+    block : 3D array
+        a block of frames ordered by the first axis
+    thresholds : iterable
+        the thresholds
+    Returns
+    -------
+    above : dict
+        maps threshold to array of numbers of pixels above the threshold, one for each frame
+    """
+    thresholds = sorted(set(thresholds))
+    num_frames = block.shape[0]
+    small_int = block.dtype.kind in 'biu' and block.dtype.itemsize <= HIST_MAX_ITEMSIZE
+    if len(thresholds) < (HIST_MIN_THRESHOLDS if small_int else SEARCH_MIN_THRESHOLDS):
+        axes = tuple(range(1, block.ndim))
+        return dict((threshold, (block > threshold).sum(axis=axes)) for threshold in thresholds)
+    if small_int:
+        hist, offset = int_histograms(block)
+        # above[:, i] is number of pixels with value of bin i or greater
+        above = np.cumsum(hist[:, ::-1], axis=1)[:, ::-1]
+        num_bins = hist.shape[1]
+        counts = {}
+        for threshold in thresholds:
+            first = int(np.floor(threshold)) + 1 - offset
+            if first >= num_bins:
+                counts[threshold] = np.zeros(num_frames, dtype=np.int64)
+            else:
+                counts[threshold] = above[:, max(first, 0)].copy()
+        return counts
+
+    pixels = block.reshape(num_frames, -1)
+    # number of thresholds below each pixel, nan pixels are not above any threshold
+    levels = np.searchsorted(np.asarray(thresholds), pixels, side='left')
+    if block.dtype.kind in 'fc':
+        levels[np.isnan(pixels)] = 0
+    levels += (np.arange(num_frames) * (len(thresholds) + 1))[:, np.newaxis]
+    level_counts = np.bincount(levels.ravel(), minlength=num_frames * (len(thresholds) + 1))
+    level_counts = level_counts.reshape(num_frames, len(thresholds) + 1)
+    above = np.cumsum(level_counts[:, ::-1], axis=1)[:, ::-1]
+    return dict((threshold, above[:, i + 1].copy()) for i, threshold in enumerate(thresholds))
+
+
+def frame_histograms(block, bins=HIST_BINS, value_range=None):
+    """
+    This method computes histogram of each frame, for quality assessment and reports.
+
+    Parameters
+    ----------
+    block : 3D array
+        a block of frames ordered by the first axis
+    bins : int
+        number of bins
+    value_range : tuple
+        lower and upper edge of the histograms, defaults to the range of integer type, or the range
+        of values in the block; values outside of the range, and nans, are not counted
+    Returns
+    -------
+    hist : ndarray
+        histograms, one row per frame
+    edges : ndarray
+        edges of the bins
+    """
+    num_frames = block.shape[0]
+    if value_range is None:
+        if block.dtype.kind in 'biu':
+            info = np.iinfo(block.dtype) if block.dtype.kind != 'b' else None
+            value_range = (0, 2) if info is None else (int(info.min), int(info.max) + 1)
+        else:
+            value_range = (np.nanmin(block), np.nanmax(block))
+            if not value_range[1] > value_range[0]:
+                value_range = (value_range[0], value_range[0] + 1)
+    lo, hi = float(value_range[0]), float(value_range[1])
+    edges = np.linspace(lo, hi, bins + 1)
+    pixels = block.reshape(num_frames, -1)
+    with np.errstate(invalid='ignore'):
+        index = np.floor((pixels - lo) * (bins / (hi - lo)))
+        # the upper edge belongs to the last bin
+        index[pixels == hi] = bins - 1
+        index[~((index >= 0) & (index < bins))] = bins
+    index = index.astype(np.int64)
+    index += (np.arange(num_frames, dtype=np.int64) * (bins + 1))[:, np.newaxis]
+    hist = np.bincount(index.ravel(), minlength=num_frames * (bins + 1)).reshape(num_frames, bins + 1)
+    return hist[:, :bins], edges
+
+
+def evaluate_block(block, functions, function_ids=None):
+    """
+    This method evaluates a block of frames by all functions, computing the frames statistics once.
+
+    The statistics needed by the functions are collected first, and computed in one stage, so the
+    functions evaluated from the same statistics do not scan the frames again. A function that has
+    no statistics based version is evaluated by its vectorized version, or frame by frame.
+
+    Parameters
+    ----------
+    block : 3D array
+        a block of frames ordered by the first axis
+    functions : dict
+        a dictionary containing functins ids, and tuple values, the tuple containing positional arguments.
+    function_ids : list
+        ids of the evaluated functions in order of the results, defaults to all functions
+    Returns
+    -------
+    results : list
+        list of Result objects in order of function ids, each holding array of results and array
+        of values, one for each frame
+    """
+    if function_ids is None:
+        function_ids = list(functions)
+    names = set()
+    thresholds = []
+    for function_id in function_ids:
+        if function_id in stats_mapper:
+            needed, get_thresholds = stats_needed[function_id]
+            names.update(needed)
+            if get_thresholds is not None:
+                thresholds.extend(get_thresholds(functions[function_id]))
+    stats = compute_stats(block, names, thresholds) if len(names) > 0 else None
+
+    results = []
+    for function_id in function_ids:
+        if function_id in stats_mapper:
+            results.append(stats_mapper[function_id](stats, functions[function_id]))
+        elif function_id in vector_mapper:
+            results.append(vector_mapper[function_id](block, functions[function_id]))
+        else:
+            frame_results = [function_mapper[function_id](block[i], functions[function_id])
+                             for i in range(block.shape[0])]
+            res = np.array([result.res for result in frame_results], dtype=bool)
+            values = np.array([np.nan if result.value is None else result.value for result in frame_results])
+            results.append(ct.Result(res, ver_ids.get(function_id, function_id.lower()), values))
     return results
+
+
+def fill_table(block, index, functions, table):
+    """
+    This method evaluates a block of consecutive frames and writes the results into results table.
+
+    The block is evaluated by evaluate_block, so no object is created per frame, and the frames
+    statistics are computed once for all functions.
+
+    Parameters
+    ----------
+    block : 3D array
+        a block of frames ordered by the first axis
+    index : int
+        index of the first frame in the block, the row of the table
+    functions : dict
+        a dictionary containing functins ids, and tuple values, the tuple containing positional arguments.
+    table : ResultTable
+        results table
+    Returns
+    -------
+    failed : bool
+        True if any frame in the block failed verification
+    """
+    stop = index + block.shape[0]
+    for i, result in enumerate(evaluate_block(block, functions, table.check_ids)):
+        table.passed[index:stop, i] = result.res
+        if result.value is not None:
+            table.values[index:stop, i] = result.value
+    table.evaluated[index:stop] = True
+    return not table.passed[index:stop].all()
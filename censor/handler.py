@@ -53,76 +53,495 @@ This file handles verification and repair frame by frame.
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
-from multiprocessing import Queue, Process
-import sys
+from multiprocessing import Queue, Process, Array, cpu_count
+import itertools
+import threading
+import time
+import traceback
+import numpy as np
 import censor.frame as framer
+import censor.hdf as hdf
 import censor.common.containers as ct
-if sys.version[0] == '2':
-    import Queue as queue
-else:
-    import queue as queue
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    shared_memory = None
 
 __author__ = "Barbara Frosik"
 __copyright__ = "Copyright (c), UChicago Argonne, LLC."
 __docformat__ = 'restructuredtext en'
-__all__ = ['handle_data']
+__all__ = ['CheckEngine',
+           'handle_frames',
+           'share',
+           'share_table',
+           'tune_chunk_size',
+           'Collector',
+           'handle_data']
 
+# the auto-tuned chunk is evaluated at least this time (sec), and does not exceed this size (bytes)
+CHUNK_TIME = 0.01
+CHUNK_BYTES = 1 << 24
+# number of job slots in the engine's cancellation table
+MAX_JOBS = 1024
 
-def handle_data(dataq, checks, returnq, data_tag, logger):
+
+class CheckEngine:
+    """
+    This class is a pool of worker processes evaluating frames.
+
+    The engine starts a fixed number of worker processes when it is created. The workers receive
+    frames via a task queue and deliver the results via a results queue. The engine can be reused
+    by many "check" calls, and it must be shut down explicitly when no longer needed, either by
+    calling "shutdown" or by using the engine as a context manager.
+    Each "check" call runs as a job. A job can be cancelled, and the workers then skip the job's
+    remaining blocks.
+    """
+    def __init__(self, num_workers=None):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        num_workers : int
+            number of worker processes, defaults to number of cpus
+        """
+        if num_workers is None:
+            num_workers = cpu_count()
+        self.num_workers = num_workers
+        self.taskq = Queue()
+        self.resultsq = Queue()
+        self.cancelled = Array('b', MAX_JOBS, lock=False)
+        self.jobs = itertools.count()
+        self.workers = []
+        if shared_memory is not None:
+            # workers share the tracker with the parent, so the segments attached by workers
+            # are not considered leaked when a worker exits
+            resource_tracker.ensure_running()
+        for i in range(num_workers):
+            p = Process(target=handle_frames, args=(self.taskq, self.resultsq, self.cancelled))
+            p.daemon = True
+            p.start()
+            self.workers.append(p)
+
+    def __getstate__(self):
+        # the engine is passed to the handler process; the queues are shared with the child,
+        # but the workers remain owned by the process that created the engine
+        state = self.__dict__.copy()
+        state['workers'] = []
+        state['jobs'] = None
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def new_job(self):
+        """
+        This function allocates a job id.
+
+        Returns
+        -------
+        job : int
+            job id
+        """
+        job = next(self.jobs) % MAX_JOBS
+        self.cancelled[job] = 0
+        return job
+
+    def cancel(self, job):
+        """
+        This function cancels a job. The blocks of the job not yet evaluated are skipped.
+
+        Parameters
+        ----------
+        job : int
+            job id
+        Returns
+        -------
+        none
+        """
+        self.cancelled[job] = 1
+
+    def is_cancelled(self, job):
+        """
+        This function returns True if the job was cancelled, False otherwise.
+
+        Parameters
+        ----------
+        job : int
+            job id
+        Returns
+        -------
+            boolean
+        """
+        return self.cancelled[job] == 1
+
+    def submit(self, data, index, checks, job=0, table=None):
+        """
+        This function enqueues a block of frames to be evaluated by one of the workers.
+
+        Parameters
+        ----------
+        data : Data
+            data container with a block of consecutive frames
+        index : int
+            index of the first frame in the block
+        checks : dict
+            a dictionary containing functions ids, and tuple values, the tuple containing positional arguments
+        job : int
+            id of the job the block belongs to
+        table : TableRef
+            reference to results table the results are written to; if None, the results are
+            delivered as a list of Results, one for each frame
+        Returns
+        -------
+        none
+        """
+        self.taskq.put((data, index, checks, job, table))
+
+    def shutdown(self):
+        """
+        This function stops all the workers and waits for them to finish.
+
+        Returns
+        -------
+        none
+        """
+        for p in self.workers:
+            self.taskq.put((ct.Data(ct.Data.DATA_STATUS_END), None, None, None, None))
+        for p in self.workers:
+            p.join()
+        self.workers = []
+
+
+def handle_frames(taskq, resultsq, cancelled):
+    """
+    This method is a worker loop evaluating frames.
+
+    It receives blocks of frames via the task queue, and evaluates each frame with the requested
+    functions, until data with the status "DATA_STATUS_END" is received. Blocks delivered by
+    reference are read directly from the shared memory segment, or read from HDF5 file by the
+    worker, which also computes the value statistics requested by the file reference. If the task refers to results table, the results are written into the table in shared
+    memory, and only Results of the block, holding the index and failed flag, are delivered.
+    Otherwise the results of all frames in a block are delivered as one list, encoded by
+    "Results.pack". For a block of cancelled job nothing is evaluated. If the evaluation raises
+    an error, Failure with the traceback is delivered in place of the results.
+
+    Parameters
+    ----------
+    taskq : Queue
+        multiprocessing queue delivering tuples of data, frame index, checks, job id, and table
+        reference
+    resultsq : Queue
+        multiprocessing queue used to deliver results
+    cancelled : Array
+        shared array of flags, indexed by job id, set when the job is cancelled
+    Returns
+    -------
+        none
+    """
+    # the checks module imports this module
+    import censor.checks as checker
+    segment = None
+    h5file = None
+    while True:
+        data, index, checks, job, table_ref = taskq.get()
+        if data.status == ct.Data.DATA_STATUS_END:
+            break
+        stats = None
+        if cancelled[job]:
+            resultsq.put(ct.Results.pack([]) if table_ref is None else ct.Results(index, False, None))
+            continue
+        if data.status == ct.Data.DATA_STATUS_SHARED:
+            ref = data.ref
+            segment = shared_memory.SharedMemory(name=ref.name)
+            block = np.ndarray(ref.shape, dtype=ref.dtype, buffer=segment.buf, offset=ref.offset)
+            data = ct.Data(ct.Data.DATA_STATUS_DATA, block)
+            del block
+        elif data.status == ct.Data.DATA_STATUS_FILE:
+            ref = data.ref
+            if h5file is None or h5file.filename != ref.path:
+                if h5file is not None:
+                    h5file.close()
+                h5file = hdf.h5py.File(ref.path, 'r')
+            data = ct.Data(ct.Data.DATA_STATUS_DATA,
+                           hdf.read_block(h5file[ref.dataset], ref.start, ref.stop, ref.axis))
+            if ref.stats:
+                stats = checker.scan_values(data.slice, ref.stats)
+        try:
+            if table_ref is None:
+                resultsq.put(ct.Results.pack(framer.process_block(data.slice, index, checks)))
+            elif table_ref.name is None:
+                block_table = ct.ResultTable(data.slice.shape[0], table_ref.check_ids)
+                failed = framer.fill_table(data.slice, 0, checks, block_table)
+                resultsq.put(ct.Results(index, failed, block_table, stats))
+            else:
+                table_segment = shared_memory.SharedMemory(name=table_ref.name)
+                try:
+                    table = ct.ResultTable(table_ref.num_frames, table_ref.check_ids, table_segment.buf)
+                    failed = framer.fill_table(data.slice, index, checks, table)
+                    resultsq.put(ct.Results(index, failed, None, stats))
+                finally:
+                    table = None
+                    table_segment.close()
+        except Exception:
+            # the worker stays alive, and the error is raised in the caller
+            resultsq.put(ct.Failure(index, traceback.format_exc()))
+        del data
+        # the segments are released after each block, so a worker of a long-lived engine does
+        # not keep the data set mapped after the job ends
+        if segment is not None:
+            segment.close()
+            segment = None
+    if h5file is not None:
+        h5file.close()
+
+
+def share(arr, chunk_size=1):
+    """
+    This method copies frames stack into a shared memory segment.
+
+    Parameters
+    ----------
+    arr : ndarray
+        a stack of frames ordered by the first axis
+    chunk_size : int
+        number of consecutive frames described by one reference
+    Returns
+    -------
+    segment : SharedMemory
+        the created shared memory segment, the caller is responsible to close and unlink it
+    refs : list
+        list of FrameRef instances, describing consecutive blocks of frames
+    """
+    segment = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    stack = np.ndarray(arr.shape, dtype=arr.dtype, buffer=segment.buf)
+    stack[...] = arr
+    del stack
+    frame_shape = arr.shape[1:]
+    frame_nbytes = arr.itemsize * int(np.prod(frame_shape))
+    refs = [ct.FrameRef(segment.name, i * frame_nbytes, (min(chunk_size, arr.shape[0] - i),) + frame_shape,
+                        arr.dtype.str)
+            for i in range(0, arr.shape[0], chunk_size)]
+    return segment, refs
+
+
+def share_table(num_frames, check_ids):
+    """
+    This method creates results table in shared memory.
+
+    If shared memory is not supported, the table is allocated in memory, and the returned reference
+    has no name.
+
+    Parameters
+    ----------
+    num_frames : int
+        number of frames
+    check_ids : list
+        ids of the frame checks
+    Returns
+    -------
+    segment : SharedMemory
+        the created shared memory segment or None, the caller is responsible to close and unlink it
+    table : ResultTable
+        the table
+    ref : TableRef
+        reference to the table delivered to the workers
+    """
+    check_ids = list(check_ids)
+    if shared_memory is None:
+        return None, ct.ResultTable(num_frames, check_ids), ct.TableRef(None, num_frames, check_ids)
+    segment = shared_memory.SharedMemory(create=True,
+                                         size=max(ct.ResultTable.buffer_size(num_frames, len(check_ids)), 1))
+    table = ct.ResultTable(num_frames, check_ids, segment.buf)
+    table.values[...] = np.nan
+    table.passed[...] = True
+    table.evaluated[...] = False
+    return segment, table, ct.TableRef(segment.name, num_frames, check_ids)
+
+
+def tune_chunk_size(arr, checks, num_workers):
+    """
+    This method finds number of frames that are delivered to a worker in one message.
+
+    The evaluation of first frame is timed. The chunk is big enough so the evaluation of the
+    chunk takes at least CHUNK_TIME seconds, but it does not exceed CHUNK_BYTES, and the frames
+    are still spread among all workers.
+
+    Parameters
+    ----------
+    arr : ndarray
+        a stack of frames ordered by the first axis
+    checks : dict
+        a dictionary containing functions ids, and tuple values, the tuple containing positional arguments
+    num_workers : int
+        number of workers evaluating the frames
+    Returns
+    -------
+    chunk_size : int
+        number of frames in a chunk
+    """
+    start_time = time.time()
+    framer.process_frame_seq(ct.Data(ct.Data.DATA_STATUS_DATA, arr[0]), 0, checks)
+    frame_time = max(time.time() - start_time, 1e-6)
+    chunk_size = int(CHUNK_TIME / frame_time)
+    chunk_size = min(chunk_size, CHUNK_BYTES // max(arr[0].nbytes, 1))
+    chunk_size = min(chunk_size, -(-arr.shape[0] // max(num_workers, 1)))
+    return max(chunk_size, 1)
+
+
+def num_frames(data):
+    """
+    This method returns number of frames in a block delivered in data container.
+
+    Parameters
+    ----------
+    data : Data
+        data container with a block of frames or a reference to it
+    Returns
+    -------
+        number of frames
+    """
+    if data.status == ct.Data.DATA_STATUS_SHARED:
+        return data.ref.shape[0]
+    if data.status == ct.Data.DATA_STATUS_FILE:
+        return data.ref.stop - data.ref.start
+    return data.slice.shape[0]
+
+
+class Collector(threading.Thread):
+    """
+    This class is a thread collecting results of evaluated blocks.
+
+    The collector blocks on the results queue, so it does not use cpu while waiting. If the workers
+    deliver results of blocks in small tables, the collector copies them into results table.
+    When all blocks were dispatched, the handler calls "finish" with the
+    number of dispatched blocks, and the collector ends when all the results were received.
+    If a semaphore limiting the blocks in flight is given, it is released for each received block.
+    If a cancel function is given, it is called when a frame fails verification.
+    If a worker fails to evaluate a block, the first failure is kept in "failure". The value
+    statistics delivered with the blocks are kept in "stats" list.
+    """
+    def __init__(self, resultsq, table=None, slots=None, cancel=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.resultsq = resultsq
+        self.table = table
+        self.slots = slots
+        self.cancel = cancel
+        self.num_blocks = None
+        self.verified = True
+        self.failure = None
+        self.stats = []
+
+    def run(self):
+        done = 0
+        ended = False
+        while not (ended and done == self.num_blocks):
+            item = self.resultsq.get()
+            if isinstance(item, ct.Data):
+                # end marker, the number of blocks is known
+                ended = True
+                continue
+            if isinstance(item, ct.Failure):
+                self.verified = False
+                if self.failure is None:
+                    self.failure = item
+            elif item.failed:
+                self.verified = False
+                if self.cancel is not None:
+                    self.cancel()
+            if not isinstance(item, ct.Failure):
+                if item.results is not None:
+                    self.table.fill(item.index, item.results)
+                if item.stats is not None:
+                    self.stats.append(item.stats)
+            done += 1
+            if self.slots is not None:
+                self.slots.release()
+
+    def finish(self, num_blocks):
+        """
+        This function sets number of dispatched blocks and wakes up the collector.
+
+        Parameters
+        ----------
+        num_blocks : int
+            number of blocks dispatched to the workers
+        Returns
+        -------
+        none
+        """
+        self.num_blocks = num_blocks
+        self.resultsq.put(ct.Data(ct.Data.DATA_STATUS_END))
+
+
+def handle_data(dataq, checks, returnq, data_tag, logger, engine, table, max_inflight=None, job=0,
+                fail_fast=False):
     """
     This method validates and repairs data applying checks and repairs functions.
 
-    It receives data frame by frame via multiprocessing queue. It uses one process to validate/repair
-    each frame. The results are sent to aggregate for processing.
+    It receives data in blocks of frames via multiprocessing queue. Each block is dispatched to the
+    engine's worker pool. The workers write the results into results table, and a collector thread
+    receives acknowledgment of each block. Both, the handler and the collector block while waiting,
+    they do not poll.
+    If the number of blocks in flight is limited, the handler waits for results before dispatching
+    more blocks, and the producer is then held back by the bounded data queue.
+    In fail fast mode the job is cancelled when any frame fails, and the remaining data is
+    discarded.
 
     Parameters
     ----------
     dataq : Queue
-        multiprocessing queue delivering data slice by slice
+        multiprocessing queue delivering data block by block
     checks : dictionary
         a dictionary containing methods ids that will be applied to validate/repair each frame
     returnq : Queue
-        multiprocessing queue used to transfer final result to the parent process
+        multiprocessing queue used to transfer final result to the parent process, it delivers the
+        verification flag, the results table if it is not in shared memory, the Failure of
+        a worker or None, and list of value statistics of the blocks
     data_tag : string
         a string associated with the data, used when logging events
     logger : logger instance
         logger used to log events
+    engine : CheckEngine
+        a worker pool evaluating the frames
+    table : TableRef
+        reference to results table
+    max_inflight : int
+        maximum number of blocks dispatched to the workers and not yet collected, unlimited if None
+    job : int
+        id of the job in the engine
+    fail_fast : bool
+        if True, the evaluation is cancelled when any frame fails
     Returns
     -------
         none
     """
-    aggregate = ct.Aggregate(logger, data_tag)
-    resultsq = Queue()
-    interrupted = False
+    slots = None if max_inflight is None else threading.Semaphore(max_inflight)
+    cancel = (lambda: engine.cancel(job)) if fail_fast else None
+    local_table = None
+    if table.name is None:
+        local_table = ct.ResultTable(table.num_frames, table.check_ids)
+    collector = Collector(engine.resultsq, local_table, slots, cancel)
+    collector.start()
     index = 0
-    num_processes = 0
-    verified = True
-    while not interrupted:
-        try:
-            data = dataq.get(timeout=0.001)
-            if data.status == ct.Data.DATA_STATUS_END:
-                interrupted = True
-                while num_processes > 0:
-                    results = resultsq.get()
-                    if results.failed:
-                        verified = False
-                    aggregate.handle_results(logger, results)
-                    num_processes -= 1
-            elif data.status == ct.Data.DATA_STATUS_DATA:
-                p = Process(target=framer.process_frame,
-                            args=(data, index, resultsq, checks))
-                p.start()
-                num_processes += 1
-                index += 1
-
-        except queue.Empty:
-            pass
-
-        while not resultsq.empty():
-            results = resultsq.get_nowait()
-            if results.failed:
-                verified = False
-            aggregate.handle_results(logger, results)
-            num_processes -= 1
-
-    returnq.put(verified)
+    num_blocks = 0
+    while True:
+        data = dataq.get()
+        if data.status == ct.Data.DATA_STATUS_END:
+            break
+        elif engine.is_cancelled(job):
+            continue
+        else:
+            if slots is not None:
+                slots.acquire()
+            engine.submit(data, index, checks, job, table)
+            num_blocks += 1
+            index += num_frames(data)
+
+    collector.finish(num_blocks)
+    collector.join()
+    returnq.put((collector.verified, local_table, collector.failure, collector.stats))
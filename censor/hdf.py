@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# #########################################################################
+# Copyright (c) 2017, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2017. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+"""
+This module reads tomography data sets stored in HDF5 files.
+
+The data is read in blocks of consecutive frames that are aligned with the dataset's chunk
+layout, so each chunk is read and decompressed once, and the data set is never loaded as a whole.
+The default dataset paths follow the DXchange layout. The module requires h5py.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+__author__ = "Barbara Frosik"
+__copyright__ = "Copyright (c), UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+__all__ = ['open_dataset',
+           'block_ranges',
+           'read_block',
+           'iter_blocks']
+
+# DXchange paths of projections, white fields, and dark fields
+EXCHANGE_DATA = '/exchange/data'
+EXCHANGE_DATA_WHITE = '/exchange/data_white'
+EXCHANGE_DATA_DARK = '/exchange/data_dark'
+
+# size of frames block read from contiguous dataset (bytes)
+BLOCK_BYTES = 1 << 24
+
+
+def open_dataset(path, dataset=EXCHANGE_DATA):
+    """
+    This function opens HDF5 file for reading and returns the requested dataset.
+
+    Parameters
+    ----------
+    path : str
+        path to the HDF5 file
+    dataset : str
+        path of the dataset in the file
+    Returns
+    -------
+    file : h5py.File
+        opened file, the caller is responsible to close it
+    dset : h5py.Dataset
+        the dataset
+    """
+    if h5py is None:
+        raise ImportError('reading HDF5 files requires h5py')
+    f = h5py.File(path, 'r')
+    return f, f[dataset]
+
+
+def block_ranges(dset, axis=0):
+    """
+    This function divides dataset frames into blocks aligned with the chunk layout.
+
+    For chunked dataset each block spans the frames stored in one row of chunks along the frame
+    axis, unless the row exceeds BLOCK_BYTES, then the row is divided. For contiguous dataset the
+    block size is limited by BLOCK_BYTES.
+
+    Parameters
+    ----------
+    dset : h5py.Dataset
+        the dataset
+    axis : int
+        an axis by which the frames are ordered
+    Returns
+    -------
+    ranges : list
+        list of (start, stop) tuples of frame indexes
+    """
+    num_frames = dset.shape[axis]
+    frame_nbytes = dset.dtype.itemsize * int(np.prod(dset.shape)) // max(num_frames, 1)
+    step = max(BLOCK_BYTES // max(frame_nbytes, 1), 1)
+    if dset.chunks is not None:
+        step = min(dset.chunks[axis], step)
+    return [(start, min(start + step, num_frames)) for start in range(0, num_frames, step)]
+
+
+def read_block(dset, start, stop, axis=0):
+    """
+    This function reads a block of consecutive frames.
+
+    Parameters
+    ----------
+    dset : h5py.Dataset
+        the dataset
+    start : int
+        index of the first frame
+    stop : int
+        index after the last frame
+    axis : int
+        an axis by which the frames are ordered
+    Returns
+    -------
+    block : ndarray
+        frames ordered by the first axis
+    """
+    index = [slice(None)] * len(dset.shape)
+    index[axis] = slice(start, stop)
+    return np.moveaxis(dset[tuple(index)], axis, 0)
+
+
+def iter_blocks(path, dataset=EXCHANGE_DATA, axis=0):
+    """
+    This function generates blocks of frames of the dataset, in order.
+
+    Parameters
+    ----------
+    path : str
+        path to the HDF5 file
+    dataset : str
+        path of the dataset in the file
+    axis : int
+        an axis by which the frames are ordered
+    Returns
+    -------
+        generator of (index of first frame, block) tuples
+    """
+    f, dset = open_dataset(path, dataset)
+    try:
+        for start, stop in block_ranges(dset, axis):
+            yield start, read_block(dset, start, stop, axis)
+    finally:
+        f.close()
@@ -0,0 +1,408 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# #########################################################################
+# Copyright (c) 2017, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2017. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+"""
+This module validates frames during acquisition.
+
+The acquisition process writes frames into a ring buffer in shared memory, and a pool of
+consumer processes evaluates the frames with the frame functions as they arrive. The consumers
+publish rolling pass/fail status in shared memory. When the consumers fall behind and the
+acquisition overwrites frames that were not evaluated yet, the frames are counted as overruns.
+The writer releases a semaphore for each frame, and the idle consumers block on it. A writer that
+can not share the semaphore, for example a process not started by multiprocessing, is served by
+consumers polling the buffer.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from multiprocessing import Process, Value, Array, Event, Semaphore, cpu_count
+import sys
+import time
+import numpy as np
+import censor.frame as framer
+import censor.common.containers as ct
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    shared_memory = None
+
+__author__ = "Barbara Frosik"
+__copyright__ = "Copyright (c), UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+__all__ = ['RingBuffer',
+           'LiveChecker',
+           'watch']
+
+# indexes of counters in the status array
+STATUS_CHECKED = 0
+STATUS_FAILED = 1
+STATUS_OVERRUNS = 2
+STATUS_LAST_FAILED = 3
+
+# values of the recent results flags
+RECENT_NONE = 0
+RECENT_PASS = 1
+RECENT_FAIL = 2
+
+
+class RingBuffer:
+    """
+    This class is a ring buffer of frames in shared memory.
+
+    The buffer holds a fixed number of frame slots. A header preceding the slots holds number of
+    frames written so far, and for each slot the sequence number of the frame in the slot.
+    There is one writer, the acquisition, which may run in another process; it attaches to the
+    buffer by name and the frames geometry.
+    """
+    def __init__(self, shape, dtype, slots, name=None, create=True, track=False, ready=None):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        shape : tuple
+            shape of a frame
+        dtype : numpy.dtype
+            type of the frame elements
+        slots : int
+            number of frames the buffer holds
+        name : str
+            name of the shared memory segment, when attaching to existing buffer
+        create : bool
+            True to create the buffer, False to attach to existing buffer
+        track : bool
+            when attaching, True to keep the segment registered with the resource tracker; only
+            the processes sharing the tracker with the creator may keep it, otherwise the tracker
+            unlinks the buffer when the attached process exits
+        ready : Semaphore
+            semaphore released for each written frame; the creator creates one if not given, and a
+            writer attaching to the buffer must be given the creator's "ready" semaphore to wake up
+            the consumers; False if the writer can not share it, then the consumers poll
+        """
+        if shared_memory is None:
+            raise ImportError('ring buffer requires multiprocessing.shared_memory')
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slots = slots
+        if ready is None and create:
+            ready = Semaphore(0)
+        self.ready = ready or None
+        header_nbytes = 8 * (slots + 1)
+        # frames start at cache line boundary
+        self.offset = -(-header_nbytes // 64) * 64
+        frame_nbytes = self.dtype.itemsize * int(np.prod(self.shape))
+        if create:
+            self.segment = shared_memory.SharedMemory(name=name, create=True,
+                                                      size=self.offset + slots * frame_nbytes)
+        elif sys.version_info >= (3, 13):
+            self.segment = shared_memory.SharedMemory(name=name, track=track)
+        else:
+            self.segment = shared_memory.SharedMemory(name=name)
+            if not track:
+                resource_tracker.unregister(self.segment._name, 'shared_memory')
+        self.name = self.segment.name
+        self.header = np.ndarray((slots + 1,), dtype=np.int64, buffer=self.segment.buf)
+        self.frames = np.ndarray((slots,) + self.shape, dtype=self.dtype, buffer=self.segment.buf,
+                                 offset=self.offset)
+        if create:
+            self.header[0] = 0
+            self.header[1:] = -1
+
+    @property
+    def written(self):
+        """
+        Number of frames written to the buffer.
+        """
+        return int(self.header[0])
+
+    def write(self, frame):
+        """
+        This function writes frame to the next slot. It is called by the acquisition.
+
+        Parameters
+        ----------
+        frame : 2D array
+            a frame
+        Returns
+        -------
+        seq : int
+            sequence number of the frame
+        """
+        seq = int(self.header[0])
+        slot = seq % self.slots
+        # the slot is invalidated while it is overwritten, so a consumer does not accept torn frame
+        self.header[1 + slot] = -1
+        self.frames[slot] = frame
+        self.header[1 + slot] = seq
+        # the frame is published after it is written
+        self.header[0] = seq + 1
+        if self.ready is not None:
+            self.ready.release()
+        return seq
+
+    def close(self):
+        """
+        This function detaches from the shared memory.
+
+        Returns
+        -------
+        none
+        """
+        del self.header
+        del self.frames
+        self.segment.close()
+
+    def unlink(self):
+        """
+        This function releases the shared memory. It is called by the process that created the buffer.
+
+        Returns
+        -------
+        none
+        """
+        self.segment.unlink()
+
+
+class LiveChecker:
+    """
+    This class is a pool of consumer processes evaluating frames written into ring buffer.
+
+    The consumers claim frames in sequence order. If a frame was overwritten before it was
+    claimed, or while it was evaluated, it is counted as overrun. The status, including rolling
+    pass rate of the most recent frames, is kept in shared memory and can be read any time.
+    """
+    def __init__(self, ring, checks, num_workers=None, window=100, poll=0.001):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        ring : RingBuffer
+            the ring buffer the frames are written into
+        checks : dict
+            contains frame functions ids as keys, and corresponding tuple of parameters as value
+        num_workers : int
+            number of consumer processes, defaults to number of cpus
+        window : int
+            number of most recent frames the rolling status is computed from
+        poll : float
+            time (sec) a consumer waits before looking for a new frame when the buffer is empty,
+            if the buffer has no "ready" semaphore
+        """
+        if num_workers is None:
+            num_workers = cpu_count()
+        self.ring = ring
+        self.checks = checks
+        self.num_workers = num_workers
+        self.poll = poll
+        self.claim = Value('q', 0)
+        self.status = Array('q', 4)
+        self.status[STATUS_LAST_FAILED] = -1
+        self.recent = Array('b', window, lock=False)
+        self.stopped = Event()
+        self.workers = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        """
+        This function starts the consumer processes.
+
+        Returns
+        -------
+        none
+        """
+        # consumers share the tracker with the parent, so the attached buffer is not considered leaked
+        resource_tracker.ensure_running()
+        for i in range(self.num_workers):
+            p = Process(target=watch, args=(self.ring.name, self.ring.shape, self.ring.dtype.str,
+                                            self.ring.slots, self.checks, self.claim, self.status,
+                                            self.recent, self.stopped, self.poll, self.ring.ready))
+            p.daemon = True
+            p.start()
+            self.workers.append(p)
+
+    def stop(self, drain=True, timeout=None):
+        """
+        This function stops the consumer processes.
+
+        Parameters
+        ----------
+        drain : bool
+            if True, the consumers first evaluate all frames written so far
+        timeout : float
+            maximum time (sec) to wait for the frames to be evaluated, no limit if None
+        Returns
+        -------
+        none
+        """
+        if drain:
+            start_time = time.time()
+            while self.claim.value < self.ring.written and len(self.workers) > 0:
+                if timeout is not None and time.time() - start_time > timeout:
+                    break
+                time.sleep(self.poll)
+        self.stopped.set()
+        if self.ring.ready is not None:
+            # wake up the blocked consumers
+            for p in self.workers:
+                self.ring.ready.release()
+        for p in self.workers:
+            p.join()
+        self.workers = []
+
+    def get_status(self):
+        """
+        This function returns current status of the evaluation.
+
+        Returns
+        -------
+        status : dict
+            'written' - frames written, 'checked' - frames evaluated, 'failed' - frames failed,
+            'overruns' - frames not evaluated because they were overwritten, 'last_failed' -
+            sequence number of the last failed frame or -1, 'pass_rate' - ratio of passed frames
+            among the recent frames, or None if no frame was evaluated yet
+        """
+        with self.status.get_lock():
+            counters = list(self.status)
+        recent = np.frombuffer(self.recent, dtype=np.int8)
+        evaluated = np.count_nonzero(recent != RECENT_NONE)
+        passed = np.count_nonzero(recent == RECENT_PASS)
+        return {'written': self.ring.written,
+                'checked': counters[STATUS_CHECKED],
+                'failed': counters[STATUS_FAILED],
+                'overruns': counters[STATUS_OVERRUNS],
+                'last_failed': counters[STATUS_LAST_FAILED],
+                'pass_rate': passed / evaluated if evaluated > 0 else None}
+
+
+def watch(name, shape, dtype, slots, checks, claim, status, recent, stopped, poll, ready=None):
+    """
+    This method is a consumer loop evaluating frames from ring buffer.
+
+    Parameters
+    ----------
+    name : str
+        name of the ring buffer shared memory
+    shape : tuple
+        shape of a frame
+    dtype : str
+        type of the frame elements
+    slots : int
+        number of frames the buffer holds
+    checks : dict
+        contains frame functions ids as keys, and corresponding tuple of parameters as value
+    claim : Value
+        shared sequence number of the next frame to evaluate
+    status : Array
+        shared status counters
+    recent : Array
+        shared flags of the most recent results
+    stopped : Event
+        set when the consumers should stop
+    poll : float
+        time (sec) to wait when there is no new frame, if there is no semaphore
+    ready : Semaphore
+        semaphore released for each written frame, the consumer blocks on it when there is no new
+        frame
+    Returns
+    -------
+        none
+    """
+    # consumers share the resource tracker with the creator, the segment stays registered
+    ring = RingBuffer(shape, dtype, slots, name=name, create=False, track=True)
+    try:
+        while not stopped.is_set():
+            overruns = 0
+            with claim.get_lock():
+                seq = claim.value
+                written = ring.written
+                if seq < written:
+                    if written - seq > slots:
+                        # the frames were overwritten before they were claimed
+                        overruns = written - slots - seq
+                        seq = written - slots
+                    claim.value = seq + 1
+                else:
+                    seq = None
+            if seq is None:
+                if ready is not None:
+                    # a permit of a frame claimed without waiting, or of overrun frame, only
+                    # causes another look
+                    ready.acquire()
+                else:
+                    time.sleep(poll)
+                continue
+
+            slot = seq % slots
+            results = framer.process_frame_seq(ct.Data(ct.Data.DATA_STATUS_DATA, ring.frames[slot]),
+                                               seq, checks)
+            # the frame might be overwritten while it was evaluated
+            valid = ring.header[1 + slot] == seq and ring.written - seq <= slots
+            with status.get_lock():
+                status[STATUS_OVERRUNS] += overruns
+                # the overrun frames have no result in the recent results
+                for skipped in range(seq - min(overruns, len(recent)), seq):
+                    recent[skipped % len(recent)] = RECENT_NONE
+                if not valid:
+                    status[STATUS_OVERRUNS] += 1
+                    recent[seq % len(recent)] = RECENT_NONE
+                else:
+                    status[STATUS_CHECKED] += 1
+                    if results.failed:
+                        status[STATUS_FAILED] += 1
+                        status[STATUS_LAST_FAILED] = max(status[STATUS_LAST_FAILED], seq)
+                    recent[seq % len(recent)] = RECENT_FAIL if results.failed else RECENT_PASS
+    finally:
+        ring.close()
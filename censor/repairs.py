@@ -58,6 +58,7 @@ from __future__ import (absolute_import, division, print_function,
 
 import numpy as np
 import logging
+import os
 
 __author__ = "Barbara Frosik"
 __copyright__ = "Copyright (c), UChicago Argonne, LLC."
@@ -65,7 +66,8 @@ __docformat__ = 'restructuredtext en'
 __all__ = ['replace_negative',
            'replace_nan',
            'to_type',
-           'replace']
+           'replace',
+           'replace_file']
 
 
 def replace_negative(arr, value):
@@ -129,8 +131,45 @@ function_mapper = { 'REPLACE_NEGATIVE' : replace_negative,
                     'TO_TYPE' : to_type
                    }
 
+# maps the quality repair ID to the function finding the elements the repair replaces
+mask_mapper = { 'REPLACE_NEGATIVE' : lambda arr: arr < 0,
+                'REPLACE_NAN' : np.isnan
+               }
 
-def replace(arr, fixers, data_tag='mydata', logger=None):
+# order in which the repairs are applied; values are repaired before type conversion
+fixers_order = ['REPLACE_NAN',
+                'REPLACE_NEGATIVE',
+                'TO_TYPE']
+
+# size of array chunk repaired at once (bytes)
+REPAIR_CHUNK_BYTES = 1 << 22
+
+
+def repair_slices(arr, chunk_bytes):
+    """
+    This function generates slices dividing array along the first axis into chunks.
+
+    Parameters
+    ----------
+    arr : ndarray
+        repaired array
+    chunk_bytes : int
+        approximate size of a chunk
+    Returns
+    -------
+        generator of slices
+    """
+    if arr.ndim == 0:
+        yield Ellipsis
+        return
+    row_nbytes = max(arr[0:1].nbytes, 1) if arr.shape[0] > 0 else 1
+    step = max(chunk_bytes // row_nbytes, 1)
+    for i in range(0, arr.shape[0], step):
+        yield slice(i, i + step)
+
+
+def replace(arr, fixers, data_tag='mydata', logger=None, out=None, chunk_bytes=REPAIR_CHUNK_BYTES,
+            record=None):
     """
     This function provides data repair.
 
@@ -140,6 +179,15 @@ def replace(arr, fixers, data_tag='mydata', logger=None):
     corresponding arguments grouped in tuple. Fixers dictionary example:
     fixers = {const.REPLACE_NEGATIVE:(0), const.REPLACE_NAN:(0), const.TO_TYPE:(np.dtype(np.float))}
 
+    The repairs are applied in the order given by fixers_order, and all of them are applied to one
+    chunk of the array before moving to the next chunk, so the temporary memory is limited to the
+    chunk size. The values are repaired in place, unless "out" array is given. If the type is
+    changed, the repaired chunks are converted into "out" array, or into a new array if "out"
+    is not given.
+
+    If "record" is given, the frames changed by the repair are flagged in it, so the repaired data
+    can be re-checked incrementally with "censor.checks.recheck".
+
     Parameters
     ----------
     arr : ndarray
@@ -150,6 +198,13 @@ def replace(arr, fixers, data_tag='mydata', logger=None):
         string identifying the data
     logger : logger instance
         logger used to log events
+    out : ndarray
+        array the repaired data is written to, of the same shape as repaired array; if not given,
+        the array is repaired in place
+    chunk_bytes : int
+        approximate size of array chunk repaired at once
+    record : RepairRecord
+        record the changed frames are flagged in
     Returns
     -------
     arr : ndarray
@@ -163,8 +218,78 @@ def replace(arr, fixers, data_tag='mydata', logger=None):
         handler.setLevel(logging.INFO)
         logger.addHandler(handler)
 
-    for fix in sorted(fixers):
-        if fix in function_mapper:
-            arr = function_mapper[fix](arr, fixers[fix])
-            logger.info(data_tag + ' repaired ' + fix.lower() )
-    return arr
+    fixes = [fix for fix in fixers_order if fix in fixers]
+    value_fixes = [fix for fix in fixes if fix != 'TO_TYPE']
+    if out is None:
+        if 'TO_TYPE' in fixers and np.dtype(fixers['TO_TYPE']) != arr.dtype:
+            out = np.empty(arr.shape, dtype=fixers['TO_TYPE'])
+        else:
+            out = arr
+    elif out.shape != arr.shape:
+        raise ValueError('out array shape ' + str(out.shape) + ' does not match ' + str(arr.shape))
+
+    for chunk_slice in repair_slices(arr, chunk_bytes):
+        chunk = arr[chunk_slice]
+        if out is not arr and len(value_fixes) > 0:
+            # do not modify the input, repair a copy of the chunk
+            chunk = chunk.copy()
+        for fix in value_fixes:
+            if record is not None:
+                record.mark(chunk_slice, mask_mapper[fix](chunk))
+            chunk = function_mapper[fix](chunk, fixers[fix])
+        if out is not arr:
+            out[chunk_slice] = chunk
+
+    if record is not None:
+        record.fixes.extend(value_fixes)
+        # a conversion that can not represent all values changes the frames
+        if out.dtype != arr.dtype and not np.can_cast(arr.dtype, out.dtype, 'safe'):
+            record.dirty[...] = True
+
+    for fix in fixes:
+        logger.info(data_tag + ' repaired ' + fix.lower() )
+    return out
+
+
+def replace_file(path, out_path, fixers, data_tag=None, logger=None, chunk_bytes=REPAIR_CHUNK_BYTES,
+                 record=None):
+    """
+    This function provides repair of data stored in numpy .npy file.
+
+    The input file is opened with memory mapping and it is not modified. The repaired data is
+    written chunk by chunk into a new memory mapped .npy file, so the data set is never loaded
+    into memory as a whole.
+
+    Parameters
+    ----------
+    path : str
+        path to the repaired .npy file
+    out_path : str
+        path to the .npy file the repaired data is written to, it must not be the input file
+    fixers : dict
+        contains functions ids as keys, and corresponding tuple of parameters as value
+    data_tag : str
+        string identifying the data, defaults to the file path
+    logger : logger instance
+        logger used to log events
+    chunk_bytes : int
+        approximate size of array chunk repaired at once
+    record : RepairRecord
+        record the changed frames are flagged in
+    Returns
+    -------
+    arr : memmap
+        corrected array, mapped to the output file
+    """
+    if os.path.realpath(out_path) == os.path.realpath(path) or \
+            (os.path.exists(out_path) and os.path.samefile(out_path, path)):
+        # the output file is truncated before the input is read
+        raise ValueError('out path ' + out_path + ' is the repaired file ' + path)
+    if data_tag is None:
+        data_tag = path
+    arr = np.load(path, mmap_mode='r')
+    dtype = fixers.get('TO_TYPE', arr.dtype)
+    out = np.lib.format.open_memmap(out_path, mode='w+', dtype=dtype, shape=arr.shape)
+    out = replace(arr, fixers, data_tag, logger, out, chunk_bytes, record)
+    out.flush()
+    return out
@@ -46,6 +46,391 @@
 # POSSIBILITY OF SUCH DAMAGE.                                             #
 # #########################################################################
 
+
+"""
+This module builds reports of data set evaluation.
+
+A report is built incrementally, from results of single frames as they are evaluated, or from
+results tables. It holds pass rates of each check, indexes of failing frames, and series of the
+metrics the results were derived from (for example mean value, number of saturated pixels).
+Optionally it holds intensity histogram of each frame.
+The report keeps a fixed number of bytes per frame, and it can be exported to JSON, CSV, or
+NPZ file.
+"""
+
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+import json
+import numpy as np
+import censor.frame as framer
+
+__author__ = "Barbara Frosik"
+__copyright__ = "Copyright (c), UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+__all__ = ['Report',
+           'from_table']
+
+# number of frames the report is allocated for, if the number of frames is not known
+INITIAL_FRAMES = 1024
+# number of frames rows written to CSV file at once
+CSV_CHUNK = 4096
+
+
+class Report:
+    """
+    This class is a report of data set evaluation.
+
+    The results are kept in arrays with one row per frame and one column per check, the columns
+    are named by the verification ids. The arrays grow as frames with higher indexes are added.
+    A frame is flagged as evaluated by each check separately, as the added results may not hold
+    all checks. The counters of evaluated and passed frames are updated with each added result.
+    """
+    def __init__(self, data_tag, ver_ids=None, num_frames=None):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        data_tag : str
+            string identifying the data
+        ver_ids : list
+            verification ids of the frame checks, if not given, they are taken from the first
+            added results
+        num_frames : int
+            number of frames, if known, the arrays are allocated once
+        """
+        self.data_tag = data_tag
+        self.ver_ids = None
+        self.globals = {}
+        self.histograms = None
+        self.histogram_edges = None
+        self.num_frames = 0
+        self.capacity = num_frames if num_frames is not None else INITIAL_FRAMES
+        if ver_ids is not None:
+            self.set_columns(ver_ids)
+
+    def set_columns(self, ver_ids):
+        """
+        This function allocates the report arrays for the given checks.
+
+        Parameters
+        ----------
+        ver_ids : list
+            verification ids of the frame checks
+        Returns
+        -------
+        none
+        """
+        self.ver_ids = list(ver_ids)
+        shape = (self.capacity, len(self.ver_ids))
+        self.passed = np.ones(shape, dtype=bool)
+        self.values = np.full(shape, np.nan)
+        self.evaluated = np.zeros(shape, dtype=bool)
+        self.num_evaluated = np.zeros(len(self.ver_ids), dtype=np.int64)
+        self.num_passed = np.zeros(len(self.ver_ids), dtype=np.int64)
+
+    def reserve(self, num_frames):
+        """
+        This function grows the report arrays to hold at least the given number of frames.
+
+        The capacity is at least doubled, so adding frames one by one is linear in time.
+
+        Parameters
+        ----------
+        num_frames : int
+            number of frames
+        Returns
+        -------
+        none
+        """
+        if num_frames <= self.capacity:
+            return
+        capacity = max(num_frames, 2 * self.capacity)
+        passed = np.ones((capacity, len(self.ver_ids)), dtype=bool)
+        values = np.full((capacity, len(self.ver_ids)), np.nan)
+        evaluated = np.zeros((capacity, len(self.ver_ids)), dtype=bool)
+        passed[:self.capacity] = self.passed
+        values[:self.capacity] = self.values
+        evaluated[:self.capacity] = self.evaluated
+        self.passed, self.values, self.evaluated = passed, values, evaluated
+        if self.histograms is not None:
+            histograms = np.zeros((capacity, self.histograms.shape[1]), dtype=self.histograms.dtype)
+            histograms[:self.capacity] = self.histograms
+            self.histograms = histograms
+        self.capacity = capacity
+
+    def add_results(self, rs):
+        """
+        This function adds results of evaluation of one frame.
+
+        The frames can be added in any order, for example in order of completion.
+
+        Parameters
+        ----------
+        rs : Results
+            results of frame validation
+        Returns
+        -------
+        none
+        """
+        if self.ver_ids is None:
+            self.set_columns([result.ver_id for result in rs.results])
+        self.reserve(rs.index + 1)
+        self.num_frames = max(self.num_frames, rs.index + 1)
+        for result in rs.results:
+            i = self.ver_ids.index(result.ver_id)
+            if self.evaluated[rs.index, i]:
+                self.num_evaluated[i] -= 1
+                self.num_passed[i] -= self.passed[rs.index, i]
+            self.passed[rs.index, i] = result.res
+            self.values[rs.index, i] = np.nan if result.value is None else result.value
+            self.evaluated[rs.index, i] = True
+            self.num_evaluated[i] += 1
+            self.num_passed[i] += bool(result.res)
+
+    def add_table(self, table, start=0):
+        """
+        This function adds results of frames held in results table.
+
+        Parameters
+        ----------
+        table : ResultTable
+            results of frames validation
+        start : int
+            index of the first frame of the table in the report
+        Returns
+        -------
+        none
+        """
+        ver_ids = [framer.ver_ids.get(check_id, check_id.lower()) for check_id in table.check_ids]
+        if self.ver_ids is None:
+            self.set_columns(ver_ids)
+        self.globals.update(table.globals)
+        rows = np.nonzero(table.evaluated)[0]
+        if len(rows) == 0:
+            return
+        frames = rows + start
+        last = int(frames[-1])
+        self.reserve(last + 1)
+        self.num_frames = max(self.num_frames, last + 1)
+        columns = [self.ver_ids.index(ver_id) for ver_id in ver_ids]
+        # only the columns of the table's checks are updated
+        cells = np.ix_(frames, columns)
+        old = self.evaluated[cells]
+        self.num_evaluated[columns] -= old.sum(axis=0)
+        self.num_passed[columns] -= (old & self.passed[cells]).sum(axis=0)
+        self.passed[cells] = table.passed[rows]
+        self.values[cells] = table.values[rows]
+        self.evaluated[cells] = True
+        self.num_evaluated[columns] += len(frames)
+        self.num_passed[columns] += table.passed[rows].sum(axis=0)
+
+    def add_histograms(self, start, hist, edges):
+        """
+        This function adds intensity histograms of consecutive frames.
+
+        Parameters
+        ----------
+        start : int
+            index of the first frame
+        hist : ndarray
+            histograms, one row per frame, as returned by "censor.frame.frame_histograms"
+        edges : ndarray
+            edges of the bins, the same for all added histograms
+        Returns
+        -------
+        none
+        """
+        if self.ver_ids is None:
+            self.set_columns([])
+        if self.histograms is None:
+            self.histograms = np.zeros((self.capacity, hist.shape[1]), dtype=np.int32)
+            self.histogram_edges = np.asarray(edges)
+        stop = start + hist.shape[0]
+        self.reserve(stop)
+        self.num_frames = max(self.num_frames, stop)
+        self.histograms[start:stop] = hist
+
+    def pass_rates(self):
+        """
+        This function returns ratio of passed frames of each check.
+
+        Returns
+        -------
+        rates : dict
+            verification ids as keys, and the ratio of passed to evaluated frames as values,
+            None if no frame was evaluated
+        """
+        if self.ver_ids is None:
+            return {}
+        return {ver_id: (self.num_passed[i] / self.num_evaluated[i] if self.num_evaluated[i] > 0 else None)
+                for i, ver_id in enumerate(self.ver_ids)}
+
+    def failed_frames(self, ver_id):
+        """
+        This function returns indexes of frames that failed the given check.
+
+        Parameters
+        ----------
+        ver_id : str
+            verification id of the check
+        Returns
+        -------
+            array of frame indexes
+        """
+        i = self.ver_ids.index(ver_id)
+        return np.nonzero(self.evaluated[:self.num_frames, i] & ~self.passed[:self.num_frames, i])[0]
+
+    def metrics(self, ver_id):
+        """
+        This function returns the metric series of the given check.
+
+        Parameters
+        ----------
+        ver_id : str
+            verification id of the check
+        Returns
+        -------
+            array of metric values, one per frame, nan for frames not evaluated
+        """
+        return self.values[:self.num_frames, self.ver_ids.index(ver_id)]
+
+    def to_json(self, path):
+        """
+        This function writes the report into JSON file.
+
+        The file holds data tag, results of the checks evaluating the whole array, and for each
+        frame check the counts, pass rate, failing frames, and the metric series.
+
+        Parameters
+        ----------
+        path : str
+            path to the file
+        Returns
+        -------
+        none
+        """
+        checks = {}
+        rates = self.pass_rates()
+        for i, ver_id in enumerate(self.ver_ids or []):
+            metrics = self.metrics(ver_id)
+            checks[ver_id] = {'evaluated': int(self.num_evaluated[i]),
+                              'passed': int(self.num_passed[i]),
+                              'pass_rate': rates[ver_id],
+                              'failed_frames': self.failed_frames(ver_id).tolist(),
+                              # nan is not valid JSON, frames not evaluated are null
+                              'metrics': np.where(np.isnan(metrics), None, metrics).tolist()}
+        report = {'data_tag': self.data_tag,
+                  'num_frames': self.num_frames,
+                  'globals': {check: bool(res) for check, res in self.globals.items()},
+                  'checks': checks}
+        with open(path, 'w') as f:
+            json.dump(report, f)
+
+    def to_csv(self, path):
+        """
+        This function writes results of evaluated frames into CSV file.
+
+        The file has one row per frame, with frame index, and result and metric of each check;
+        both are empty if the check did not evaluate the frame. The rows are formatted and written
+        in chunks.
+
+        Parameters
+        ----------
+        path : str
+            path to the file
+        Returns
+        -------
+        none
+        """
+        header = ['frame']
+        for ver_id in self.ver_ids or []:
+            header += [ver_id, ver_id + '_value']
+        frames = np.nonzero(self.evaluated[:self.num_frames].any(axis=1))[0]
+        with open(path, 'w') as f:
+            f.write(','.join(header) + '\n')
+            for start in range(0, len(frames), CSV_CHUNK):
+                rows = frames[start:start + CSV_CHUNK]
+                passed = self.passed[rows].tolist()
+                values = self.values[rows].tolist()
+                evaluated = self.evaluated[rows].tolist()
+                lines = []
+                for j, index in enumerate(rows.tolist()):
+                    fields = [str(index)]
+                    for i in range(len(self.ver_ids)):
+                        # nan is the only value not equal to itself
+                        value = values[j][i]
+                        fields += [str(passed[j][i]) if evaluated[j][i] else '',
+                                   repr(value) if value == value else '']
+                    lines.append(','.join(fields))
+                f.write('\n'.join(lines) + '\n')
+
+    def to_npz(self, path):
+        """
+        This function writes the report arrays into NPZ file.
+
+        The file holds "frames" array of evaluated frames indexes, and for each check the arrays
+        "<ver_id>_passed", "<ver_id>_values", and "<ver_id>_evaluated" of the evaluated frames,
+        the last flagging the frames evaluated by the check. If histograms were added,
+        the file holds "histograms", one row per frame index, and "histogram_edges".
+
+        Parameters
+        ----------
+        path : str
+            path to the file
+        Returns
+        -------
+        none
+        """
+        frames = np.nonzero(self.evaluated[:self.num_frames].any(axis=1))[0]
+        arrays = {'frames': frames}
+        for i, ver_id in enumerate(self.ver_ids or []):
+            arrays[ver_id + '_passed'] = self.passed[frames, i]
+            arrays[ver_id + '_values'] = self.values[frames, i]
+            arrays[ver_id + '_evaluated'] = self.evaluated[frames, i]
+        if self.histograms is not None:
+            arrays['histograms'] = self.histograms[:self.num_frames]
+            arrays['histogram_edges'] = self.histogram_edges
+        np.savez(path, **arrays)
+
+    def save(self, path):
+        """
+        This function writes the report in a format given by the file extension.
+
+        Parameters
+        ----------
+        path : str
+            path to the file, ending with ".json", ".csv", or ".npz"
+        Returns
+        -------
+        none
+        """
+        if path.endswith('.json'):
+            self.to_json(path)
+        elif path.endswith('.csv'):
+            self.to_csv(path)
+        elif path.endswith('.npz'):
+            self.to_npz(path)
+        else:
+            raise ValueError('unsupported report format: ' + path)
+
+
+def from_table(table, data_tag):
+    """
+    This function creates report from results table.
+
+    Parameters
+    ----------
+    table : ResultTable
+        results of data set evaluation, as returned by "censor.checks.check"
+    data_tag : str
+        string identifying the data
+    Returns
+    -------
+    report : Report
+        the report
+    """
+    report = Report(data_tag, num_frames=max(table.num_frames, 1))
+    report.add_table(table)
+    return report
@@ -7,6 +7,9 @@ setup(
     name='censor',
     author='Barbara Frosik, Doga Gursoy',
     packages=find_packages(),
+    entry_points={
+        'console_scripts': ['censor=censor.batch:main'],
+    },
     version=open('VERSION').read().strip(),
     description = 'Unit-testing for scientific data.',
     license='BSD-3',
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# #########################################################################
+# Copyright (c) 2017, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2017. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import json
+import numpy as np
+import censor.batch as bt
+
+
+def test_batch(tmpdir):
+    good = np.ones((4, 3, 4))
+    bad = good.copy()
+    bad[2, 1, 1] = np.nan
+    np.save(str(tmpdir.join('good.npy')), good)
+    np.save(str(tmpdir.join('bad.npy')), bad)
+    spec = str(tmpdir.join('spec.json'))
+    with open(spec, 'w') as f:
+        json.dump({'checks': {'IS_SIZE': [4, 3, 4], 'HAS_NO_NAN': [], 'MEAN_IN_RANGE': [0, 7]},
+                   'fixers': {'REPLACE_NAN': 0, 'TO_TYPE': 'float32'}}, f)
+    summary = str(tmpdir.join('summary.json'))
+    status = bt.main([str(tmpdir), '-s', spec, '-w', '2', '-o', summary,
+                      '-l', str(tmpdir.join('censor.log'))])
+    assert status == 1
+    with open(summary) as f:
+        result = json.load(f)
+    assert result['total'] == 2
+    assert result['verified'] == 1
+    datasets = dict((d['path'], d) for d in result['datasets'])
+    assert not datasets[str(tmpdir.join('bad.npy'))]['verified']
+    fixed = np.load(datasets[str(tmpdir.join('bad.npy'))]['repaired'])
+    assert fixed.dtype == np.float32
+    assert not np.isnan(fixed).any()
+    # passed data set is not repaired
+    assert datasets[str(tmpdir.join('good.npy'))]['repaired'] is None
+    assert not tmpdir.join('good' + bt.FIXED_SUFFIX).exists()
+    # repaired data sets are not picked up by pattern
+    assert bt.find_datasets([str(tmpdir.join('*.npy'))]) == [str(tmpdir.join('bad.npy')),
+                                                            str(tmpdir.join('good.npy'))]
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# #########################################################################
+# Copyright (c) 2017, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2017. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import logging
+import os
+import numpy as np
+import censor.cache as cs
+import censor.checks as ck
+
+logger = logging.getLogger(__name__)
+data_tag = 'test'
+checks = {'HAS_NO_NAN': (), 'IS_SIZE': (6, 3, 4), 'MEAN_IN_RANGE': (0, 7)}
+
+
+def make_data():
+    arr = np.ones((6, 3, 4))
+    arr[4] = 9
+    return arr
+
+
+def test_check_cached(tmpdir, monkeypatch):
+    cache = cs.ResultCache(str(tmpdir.join('cache')))
+    arr = make_data()
+    table = ck.check(arr, dict(checks), data_tag, logger, par='v', cache=cache)
+    assert not table
+
+    # a hit does not evaluate the data
+    monkeypatch.setattr(ck, 'check_slices_vec', None)
+    cached = ck.check(arr.copy(), {'MEAN_IN_RANGE': (0, 7), 'IS_SIZE': [6, 3, 4], 'HAS_NO_NAN': ()},
+                      data_tag, logger, par='v', cache=cache)
+    assert not cached
+    assert cached.globals == table.globals
+    assert cached.failed_frames('MEAN_IN_RANGE').tolist() == [4]
+    assert (cached.values == table.values).all()
+    monkeypatch.undo()
+
+    arr[4] = 1
+    assert ck.check(arr, dict(checks), data_tag, logger, par='v', cache=cache)
+    assert not ck.check(arr, {'MEAN_IN_RANGE': (0, 0.5)}, data_tag, logger, par='v', cache=cache)
+    assert len(os.listdir(str(tmpdir.join('cache')))) == 3
+
+
+def test_file_identity(tmpdir):
+    path = str(tmpdir.join('data.npy'))
+    np.save(path, make_data())
+    identity = cs.data_id(np.load(path, mmap_mode='r'))
+    assert identity.startswith('file:')
+    assert identity == cs.data_id(np.load(path, mmap_mode='r'))
+    # the size changes, the identity does not depend on the timestamp resolution
+    np.save(path, make_data()[:5])
+    assert identity != cs.data_id(np.load(path, mmap_mode='r'))
+    assert cs.data_id(make_data()) == cs.data_id(make_data())
+    assert cs.data_id('a') is None
+
+
+
+def test_mapped_views(tmpdir):
+    path = str(tmpdir.join('data.npy'))
+    arr = np.ones((20, 3, 4))
+    arr[15:] = np.nan
+    np.save(path, arr)
+    cache = cs.ResultCache(str(tmpdir.join('cache')))
+    mapped = np.load(path, mmap_mode='r')
+    # views of the same shape, at different offsets, are different data
+    assert cs.data_id(mapped[0:5]).startswith('data:')
+    assert ck.check(mapped[0:5], {'HAS_NO_NAN': ()}, data_tag, logger, par='v', cache=cache)
+    assert not ck.check(mapped[15:20], {'HAS_NO_NAN': ()}, data_tag, logger, par='v', cache=cache)
+
+    # copy-on-write array changed in memory differs from the file
+    mapped = np.load(path, mmap_mode='c')
+    assert not ck.check(mapped, {'HAS_NO_NAN': ()}, data_tag, logger, par='v', cache=cache)
+    mapped[:] = 0
+    assert ck.check(mapped, {'HAS_NO_NAN': ()}, data_tag, logger, par='v', cache=cache)
+
+
+def test_key_arguments(tmpdir):
+    cache = cs.ResultCache(str(tmpdir.join('cache')))
+    key = cache.key('data', {'SAT_LEVELS': ((500, 6),), 'MEAN_IN_RANGE': (0, 7.5)})
+    assert key == cache.key('data', {'SAT_LEVELS': [[500, 6]], 'MEAN_IN_RANGE': [0, 7.5]})
+    assert key == cache.key('data', {'SAT_LEVELS': [(np.int64(500), np.uint8(6))],
+                                     'MEAN_IN_RANGE': (np.int32(0), np.float64(7.5))})
+    assert key != cache.key('data', {'SAT_LEVELS': [[500, 7]], 'MEAN_IN_RANGE': [0, 7.5]})
+
+
+def test_eviction(tmpdir):
+    cache = cs.ResultCache(str(tmpdir.join('cache')))
+    arr = make_data()
+    table = ck.check(arr, {'MEAN_IN_RANGE': (0, 7)}, data_tag, logger, par='v')
+    keys = [cache.key(str(i), checks) for i in range(4)]
+    for i, key in enumerate(keys):
+        cache.put(key, table)
+        os.utime(cache.path(key), (i, i))
+    entry_size = os.path.getsize(cache.path(keys[0]))
+    # reading an entry makes it the most recently used
+    assert cache.get(keys[0]) is not None
+    cache.max_bytes = 2 * entry_size
+    cache.evict()
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[3]) is not None
+    assert cache.get(keys[1]) is None and cache.get(keys[2]) is None
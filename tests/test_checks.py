@@ -53,8 +53,10 @@ from __future__ import (absolute_import, division, print_function,
 import logging
 import numpy as np
 import os
+import pytest
 #import censor.common.constantsx as const
 import censor.checks as ck
+import censor.handler as hd
 
 
 arr_2D = np.array([[1, 2, 3], [np.log(-1.), -5, -7]])
@@ -116,6 +118,28 @@ def test_has_nans():
     assert not verified
 
 
+def test_scan_values():
+    arr = np.arange(-50., 50.).reshape(10, 10)
+    arr[3, 3] = np.nan
+    arr[7, 1] = np.inf
+    for a in (arr, arr.T, arr[::2, ::3]):
+        stats = ck.scan_values(a, ('negative', 'nan', 'inf', 'min', 'max'), chunk_bytes=24)
+        assert stats['negative'] == (a < 0).sum()
+        assert stats['nan'] == np.isnan(a).sum()
+        assert stats['inf'] == np.isinf(a).sum()
+        assert stats['min'] == np.nanmin(a)
+        assert stats['max'] == np.nanmax(a)
+
+
+def test_fused_value_checks():
+    open(logfile, 'w').close()
+    checks = {'HAS_NO_NEGATIVE': (), 'HAS_NO_NAN': (), 'HAS_NO_INF': ()}
+    verified = ck.check(arr_3D, checks, data_tag, logger)
+    assert not verified
+    assert is_text_in_file(logfile, data_tag + ' evaluated "has_no_inf" with result True')
+    assert is_text_in_file(logfile, data_tag + ' evaluated "has_no_nan" with result False')
+
+
 def test_is_int():
     checks = {'IS_INT': ()}
     arr = arr_3D.copy()
@@ -310,6 +334,348 @@ def test_3D_axis1():
     assert not is_text_in_file(logfile, 'frame #2')
 
 
+def test_engine_reused():
+    arr = arr_3D.copy()
+    arr[np.isnan(arr)] = 0
+    arr[arr < 0] = 0
+    with hd.CheckEngine(2) as engine:
+        verified = ck.check(arr, {'MEAN_IN_RANGE': (0, 7)}, data_tag, logger, engine=engine)
+        assert verified
+        verified = ck.check(arr, {'MEAN_IN_RANGE': (100, 107)}, data_tag, logger, engine=engine)
+        assert not verified
+        assert len(engine.workers) == 2
+    assert len(engine.workers) == 0
+
+
+
+def test_worker_error():
+    arr = np.ones((4, 3, 3))
+    with hd.CheckEngine(2) as engine:
+        for transport in ('queue', 'shm'):
+            with pytest.raises(RuntimeError) as error:
+                ck.check(arr, {'MEAN_IN_RANGE': (1,)}, data_tag, logger, par='p', engine=engine,
+                         transport=transport, chunk_size=1)
+            assert 'IndexError' in str(error.value)
+        with pytest.raises(RuntimeError):
+            list(ck.check_stream(iter(arr), {'MEAN_IN_RANGE': (1,)}, data_tag, logger, par='p',
+                                 engine=engine))
+        # the workers survive the errors
+        assert all(p.is_alive() for p in engine.workers)
+        assert ck.check(arr, {'MEAN_IN_RANGE': (0, 2)}, data_tag, logger, par='p', engine=engine)
+
+def test_shared_memory():
+    open(logfile, 'w').close()
+    checks = {'MEAN_IN_RANGE': (0, 7)}
+    arr = arr_3D.copy()
+    arr[np.isnan(arr)] = 0
+    arr[arr < 0] = 0
+    verified = ck.check(arr, checks, data_tag, logger, 2, transport='shm')
+    assert verified
+    assert is_text_in_file(logfile, 'frame #2')
+    assert not is_text_in_file(logfile, 'frame #3')
+    assert not ck.check(arr_3D, {'SAT_IN_RANGE': (1, 2)}, data_tag, logger, transport='shm')
+
+
+def test_chunks():
+    open(logfile, 'w').close()
+    checks = {'SAT_IN_RANGE': (1, 2)}
+    arr = np.zeros((7, 3, 4))
+    arr[5, 0, :] = 2
+    verified = ck.check(arr, checks, data_tag, logger, chunk_size=3)
+    assert not verified
+    assert is_text_in_file(logfile, 'frame #6 saturation_in_range with result True')
+    assert is_text_in_file(logfile, 'frame #5 saturation_in_range with result False')
+    assert not is_text_in_file(logfile, 'frame #7')
+    checks = {'SAT_IN_RANGE': (1, 2)}
+    assert not ck.check(arr, checks, data_tag, logger, transport='shm', chunk_size=4)
+
+
+def test_bounded_queue():
+    open(logfile, 'w').close()
+    checks = {'MEAN_IN_RANGE': (0, 7)}
+    arr = np.ones((20, 3, 4))
+    arr[13] = 10
+    verified = ck.check(arr, checks, data_tag, logger, chunk_size=1, max_queued_bytes=arr[0].nbytes)
+    assert not verified
+    assert is_text_in_file(logfile, 'frame #13 mean_in_range with result False')
+    assert is_text_in_file(logfile, 'frame #19 mean_in_range with result True')
+
+
+def test_threads():
+    open(logfile, 'w').close()
+    arr = np.ones((9, 3, 4))
+    arr[4, 0, :] = 5
+    verified = ck.check(arr, {'SAT_IN_RANGE': (1, 2)}, data_tag, logger, par='t', num_threads=3,
+                        chunk_size=2)
+    assert not verified
+    assert is_text_in_file(logfile, 'frame #4 saturation_in_range with result False')
+    assert is_text_in_file(logfile, 'frame #8 saturation_in_range with result True')
+    assert ck.check(arr, {'MEAN_IN_RANGE': (0, 7)}, data_tag, logger, par='t')
+
+
+def test_vectorized():
+    open(logfile, 'w').close()
+    arr = np.ones((9, 3, 4))
+    arr[4, 0, :] = 5
+    arr[7] = 8
+    verified = ck.check(arr, {'SAT_IN_RANGE': (1, 2)}, data_tag, logger, par='v', chunk_size=4)
+    assert not verified
+    assert is_text_in_file(logfile, 'frame #4 saturation_in_range with result False')
+    assert is_text_in_file(logfile, 'frame #8 saturation_in_range with result True')
+    assert not ck.check(arr, {'MEAN_IN_RANGE': (0, 7)}, data_tag, logger, par='v')
+    assert is_text_in_file(logfile, 'frame #7 mean_in_range with result False')
+    assert is_text_in_file(logfile, 'frame #6 mean_in_range with result True')
+
+
+def test_fail_fast_global():
+    checks = {'HAS_NO_NAN': (), 'IS_NPARRAY': (), 'MEAN_IN_RANGE': (0, 7)}
+    verified = ck.check('a', checks, data_tag, logger, fail_fast=True)
+    assert not verified
+
+
+def test_fail_fast_frames():
+    arr = np.ones((10, 3, 4))
+    arr[2] = 10
+    for par in ('s', 'v', 't', 'p'):
+        open(logfile, 'w').close()
+        verified = ck.check(arr, {'MEAN_IN_RANGE': (0, 7)}, data_tag, logger, par=par, chunk_size=1,
+                            fail_fast=True)
+        assert not verified
+        assert is_text_in_file(logfile, 'frame #2 mean_in_range with result False')
+        if par in ('s', 'v'):
+            assert not is_text_in_file(logfile, 'frame #3')
+
+
+def test_check_file(tmpdir):
+    open(logfile, 'w').close()
+    path = str(tmpdir.join('data.npy'))
+    arr = np.ones((6, 3, 4))
+    arr[4] = 9
+    np.save(path, arr)
+    for par in ('s', 'p'):
+        checks = {'IS_SIZE': (6, 3, 4), 'HAS_NO_NAN': (), 'MEAN_IN_RANGE': (0, 7)}
+        assert not ck.check_file(path, checks, data_tag, logger, par=par)
+        assert is_text_in_file(logfile, 'frame #4 mean_in_range with result False')
+    assert ck.check_file(path, {'HAS_NO_NEGATIVE': ()}, data_tag, logger)
+
+
+def test_check_hdf(tmpdir):
+    h5py = pytest.importorskip('h5py')
+    path = str(tmpdir.join('data.h5'))
+    arr = np.ones((10, 3, 4))
+    arr[7] = 9
+    arr[8, 0, 0] = -1
+    with h5py.File(path, 'w') as f:
+        f.create_dataset('/exchange/data', data=arr, chunks=(3, 3, 4), compression='gzip')
+    for par in ('s', 'p'):
+        open(logfile, 'w').close()
+        checks = {'IS_SIZE': (10, 3, 4), 'HAS_NO_NEGATIVE': (), 'HAS_NO_NAN': (),
+                  'MEAN_IN_RANGE': (0, 7)}
+        assert not ck.check_hdf(path, checks, data_tag=data_tag, logger=logger, par=par)
+        assert is_text_in_file(logfile, data_tag + ' evaluated "is_size" with result True')
+        assert is_text_in_file(logfile, data_tag + ' evaluated "has_no_negative" with result False')
+        assert is_text_in_file(logfile, data_tag + ' evaluated "has_no_nan" with result True')
+        assert is_text_in_file(logfile, 'frame #7 mean_in_range with result False')
+        assert is_text_in_file(logfile, 'frame #9 mean_in_range with result True')
+
+
+def test_hdf_blocks(tmpdir, monkeypatch):
+    h5py = pytest.importorskip('h5py')
+    path = str(tmpdir.join('data.h5'))
+    arr = np.ones((12, 3, 4))
+    arr[10, 0, 0] = -1
+    with h5py.File(path, 'w') as f:
+        dset = f.create_dataset('/exchange/data', data=arr, chunks=(12, 3, 4), compression='gzip')
+        # a row of chunks larger than the block limit is divided
+        monkeypatch.setattr(ck.hdf, 'BLOCK_BYTES', arr[0].nbytes * 5)
+        assert ck.hdf.block_ranges(dset) == [(0, 5), (5, 10), (10, 12)]
+    with hd.CheckEngine(2) as engine:
+        # in parallel mode the blocks are read and scanned only by the workers
+        monkeypatch.setattr(ck.hdf, 'read_block', None)
+        table = ck.check_hdf(path, {'HAS_NO_NEGATIVE': (), 'MEAN_IN_RANGE': (-1, 2)}, data_tag=data_tag,
+                             logger=logger, par='p', engine=engine)
+    assert table.globals['HAS_NO_NEGATIVE'] is False
+    assert table.evaluated.all()
+
+
+def test_result_table():
+    arr = np.ones((8, 3, 4))
+    arr[2] = 9
+    arr[5] = 8
+    arr[6, 0, :] = 5
+    checks = {'IS_FLOAT': (), 'MEAN_IN_RANGE': (0, 7), 'SAT_IN_RANGE': (1, 2)}
+    for par in ('s', 'v', 't', 'p'):
+        table = ck.check(arr, dict(checks), data_tag, logger, par=par, chunk_size=3)
+        assert not table
+        assert table.globals == {'IS_FLOAT': True}
+        assert table.evaluated.all()
+        assert list(table.failed_frames('MEAN_IN_RANGE')) == [2, 5]
+        assert list(table.failed_frames()) == [2, 5, 6]
+        passed, values = table.column('MEAN_IN_RANGE')
+        assert not passed[2] and passed[3]
+        assert values[2] == 9
+        assert table.column('SAT_IN_RANGE')[1][6] == 4
+
+
+def test_log_summary(tmpdir):
+    import json
+    open(logfile, 'w').close()
+    records = str(tmpdir.join('records.jsonl'))
+    arr = np.ones((12, 3, 4))
+    arr[2] = 9
+    arr[7:10] = 8
+    checks = {'MEAN_IN_RANGE': (0, 7), 'SAT_IN_RANGE': (0, 13)}
+    for par in ('s', 'p'):
+        assert not ck.check(arr, dict(checks), data_tag, logger, par=par, log_frames='summary',
+                            records=records)
+        assert is_text_in_file(logfile, data_tag + ' frames 0-11 mean_in_range: pass except [2, 7-9]')
+        assert is_text_in_file(logfile, data_tag + ' frames 0-11 saturation_in_range: pass\n')
+        assert not is_text_in_file(logfile, 'frame #')
+    with open(records) as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) == 24
+    assert lines[2] == {'data_tag': data_tag, 'frame': 2, 'mean_in_range': False,
+                        'mean_in_range_value': 9.0, 'saturation_in_range': True,
+                        'saturation_in_range_value': 12.0}
+
+
+def test_frame_stats():
+    import censor.frame as framer
+    stack = np.arange(60).reshape(5, 3, 4)
+    functions = {'MEAN_IN_RANGE': (10, 40), 'SAT_IN_RANGE': (20, 8)}
+    for arr in (stack, stack.astype(np.float32)):
+        function_ids = ['SAT_IN_RANGE', 'MEAN_IN_RANGE']
+        results = framer.evaluate_block(arr, functions, function_ids)
+        assert [r.ver_id for r in results] == ['saturation_in_range', 'mean_in_range']
+        for function_id, result in zip(function_ids, results):
+            expected = framer.vector_mapper[function_id](arr, functions[function_id])
+            assert (result.res == expected.res).all()
+            assert np.allclose(result.value, expected.value)
+    arr = stack.astype(float)
+    arr[1, 0, 0] = np.nan
+    stats = framer.compute_stats(arr, ('min', 'max', 'nan'), (20, 20, 50))
+    assert stats.sum is None
+    assert stats.nan.tolist() == [1 if i == 1 else 0 for i in range(5)]
+    assert stats.max[0] == 11 and stats.min[2] == 24
+    assert sorted(stats.above) == [20, 50]
+    assert stats.above[50].tolist() == [0, 0, 0, 0, 9]
+    # half precision frames do not overflow
+    arr = np.ones((2, 512, 512), dtype=np.float16)
+    for par in ('s', 'v', 't'):
+        assert ck.check(arr, {'MEAN_IN_RANGE': (0.5, 2)}, data_tag, logger, par=par)
+
+
+def test_check_plan(monkeypatch):
+    checks = {'HAS_NO_NAN': (), 'HAS_NO_NEGATIVE': (), 'HAS_NO_INF': (), 'IS_SIZE': (4, 3, 2),
+              'MEAN_IN_RANGE': (0, 7), 'SAT_IN_RANGE': (5, 2)}
+    plan = ck.compile_plan(np.ones((4, 3, 2), dtype=np.uint16), checks)
+    assert plan.static == {'HAS_NO_NAN': True, 'HAS_NO_NEGATIVE': True, 'HAS_NO_INF': True,
+                           'IS_SIZE': True}
+    assert plan.scan == {}
+    assert plan.frame_modes == {'MEAN_IN_RANGE': 'stats', 'SAT_IN_RANGE': 'stats'}
+    assert plan.frame_stats == {'sum', 'above'} and plan.thresholds == {5}
+    assert plan.mode == 'v'
+    assert plan.order.index('IS_SIZE') < plan.order.index('HAS_NO_NAN')
+
+    plan = ck.compile_plan(np.ones((4, 3, 2), dtype=np.int16), checks, par='p')
+    assert plan.scan == {'HAS_NO_NEGATIVE': 'negative'}
+    assert plan.mode == 'p'
+    assert 'one pass: negative' in plan.describe()
+
+    # an integer array is not scanned for nan, and no frames are scanned more than once
+    monkeypatch.setattr(ck, 'scan_values', None)
+    table = ck.check(np.ones((4, 3, 2), dtype=np.uint8), dict(checks), data_tag, logger, par='auto')
+    assert table
+    assert table.globals['HAS_NO_NAN'] and table.evaluated.all()
+
+
+def test_sat_levels():
+    import censor.frame as framer
+    arr = np.zeros((6, 10, 10), dtype=np.uint16)
+    arr[1, 0, :5] = 1000
+    arr[3, :3, :] = 60000
+    levels = ((500, 6), (50000, 20))
+    for par in ('s', 'v', 'p'):
+        table = ck.check(arr, {'SAT_LEVELS': levels, 'SAT_IN_RANGE': (500, 50)}, data_tag, logger,
+                         par=par)
+        assert table.failed_frames('SAT_LEVELS').tolist() == [3]
+        assert table.column('SAT_LEVELS')[1][3] == 2
+    rng = np.random.RandomState(0)
+    thresholds = [-1, 0.5, 10, 100, 1000, 30000, 65534, 65535, 70000]
+    for dtype in (np.uint8, np.uint16, np.float32):
+        block = (rng.rand(4, 8, 8) * 70000).astype(dtype)
+        for count in (1, framer.HIST_MIN_THRESHOLDS, framer.SEARCH_MIN_THRESHOLDS):
+            above = framer.count_above(block, (thresholds * 6)[:count] + list(range(count)))
+            for threshold in above:
+                assert (above[threshold] == (block > threshold).sum(axis=(1, 2))).all()
+    hist, edges = framer.frame_histograms(arr, 64)
+    assert hist.shape == (6, 64) and len(edges) == 65
+    assert (hist.sum(axis=1) == 100).all()
+    assert hist[3, 60000 * 64 // 65536] == 30
+
+
+def test_results_pack():
+    import pickle
+    import censor.frame as framer
+    import censor.common.containers as ct
+    arr = np.ones((5, 3, 4))
+    arr[3] = 9
+    block = framer.process_block(arr, 10, {'MEAN_IN_RANGE': (0, 7), 'SAT_IN_RANGE': (1, 2)})
+    unpacked = ct.Results.unpack(pickle.loads(pickle.dumps(ct.Results.pack(block))))
+    assert [rs.index for rs in unpacked] == list(range(10, 15))
+    assert [rs.failed for rs in unpacked] == [False, False, False, True, False]
+    for rs, rs_unpacked in zip(block, unpacked):
+        assert [r.ver_id for r in rs_unpacked.results] == [r.ver_id for r in rs.results]
+        assert [r.res for r in rs_unpacked.results] == [bool(r.res) for r in rs.results]
+        assert [r.value for r in rs_unpacked.results] == [r.value for r in rs.results]
+    assert ct.Results.unpack(ct.Results.pack([])) == []
+    data = pickle.loads(pickle.dumps(ct.Data(ct.Data.DATA_STATUS_SHARED, ct.FrameRef('seg', 8, (1, 3), '<f8'))))
+    assert data.status == ct.Data.DATA_STATUS_SHARED and data.ref.offset == 8
+
+
+def test_check_stream():
+    def frames():
+        for i in range(7):
+            yield np.full((3, 4), i)
+
+    for par in ('s', 't', 'p'):
+        results = list(ck.check_stream(frames(), {'MEAN_IN_RANGE': (-1, 5), 'IS_INT': ()}, data_tag,
+                                       logger, par=par, max_inflight=2))
+        assert sorted(r.index for r in results) == list(range(7))
+        assert sorted(r.index for r in results if r.failed) == [5, 6]
+
+
+def test_sample():
+    import censor.common.containers as ct
+    arr = np.ones((400, 8, 8))
+    checks = {'HAS_NO_NAN': (), 'MEAN_IN_RANGE': (0, 2)}
+    sample = ct.Sample(40, escalate=False)
+    table = ck.check(arr, dict(checks), data_tag, logger, sample=sample)
+    assert table.evaluated.sum() == 40
+    assert (np.nonzero(table.evaluated)[0] == ck.sample_frames(400, sample)).all()
+    assert table.estimates['HAS_NO_NAN'].decision == 'passed'
+    assert table.estimates['MEAN_IN_RANGE'].decision == 'inconclusive'
+    assert table.estimates['MEAN_IN_RANGE'].upper == ck.upper_bound(0, 40)
+    # inconclusive sample escalates to evaluation of all frames
+    table = ck.check(arr, dict(checks), data_tag, logger, par='v', sample=ct.Sample(40))
+    assert table and table.evaluated.all() and 'MEAN_IN_RANGE' in table.estimates
+    # failure found in the sample is conclusive
+    arr[::2, 0, 0] = np.nan
+    table = ck.check(arr, dict(checks), data_tag, logger, sample=ct.Sample(20, tile=(4, 4), seed=3))
+    assert not table and table.evaluated.sum() == 20
+    assert table.estimates['MEAN_IN_RANGE'].decision == 'failed'
+    assert 0 < table.estimates['MEAN_IN_RANGE'].estimate < 1
+    assert ck.upper_bound(0, 1000) < 0.003 < ck.upper_bound(0, 999, 0.99)
+    # not an array is evaluated without sampling
+    assert not ck.check('a', {'IS_NPARRAY': ()}, data_tag, logger, sample=ct.Sample())
+    # the default sample of a clean scan passes without evaluating all frames
+    arr = np.ones((1800, 64, 64), dtype=np.float32)
+    table = ck.check(arr, dict(checks), data_tag, logger, par='v', log_frames=None, sample=ct.Sample())
+    assert table and 0 < table.evaluated.sum() < 1800
+    assert table.estimates['MEAN_IN_RANGE'].decision == 'passed'
+    assert table.estimates['HAS_NO_NAN'].decision == 'passed'
+
+
 def test_3D_axis2():
     open(logfile, 'w').close()
     checks = {'MEAN_IN_RANGE': (0, 7)}
@@ -322,5 +688,3 @@ def test_3D_axis2():
     assert is_text_in_file(logfile, 'frame #2')
     assert not is_text_in_file(logfile, 'frame #3')
     os.remove(logfile)
-
-
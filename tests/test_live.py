@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# #########################################################################
+# Copyright (c) 2017, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2017. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+import censor.live as lv
+
+
+def test_live_checker():
+    # the ring holds all frames, so none is overrun
+    ring = lv.RingBuffer((3, 4), np.float32, 32)
+    try:
+        with lv.LiveChecker(ring, {'MEAN_IN_RANGE': (0, 7)}, num_workers=2) as checker:
+            for i in range(20):
+                ring.write(np.full((3, 4), 9 if i == 13 else 1))
+            checker.stop()
+            status = checker.get_status()
+        assert status['written'] == 20
+        assert status['checked'] == 20 and status['overruns'] == 0
+        assert status['failed'] == 1
+        assert status['last_failed'] == 13
+    finally:
+        ring.close()
+        ring.unlink()
+
+
+def test_live_overruns():
+    ring = lv.RingBuffer((3, 4), np.uint16, 2)
+    try:
+        for i in range(10):
+            ring.write(np.full((3, 4), i))
+        checker = lv.LiveChecker(ring, {'MEAN_IN_RANGE': (0, 7)}, num_workers=1)
+        checker.start()
+        checker.stop()
+        status = checker.get_status()
+        assert status['overruns'] == 8
+        assert status['checked'] == 2
+        assert status['failed'] == 2
+        assert status['last_failed'] == 9
+        assert status['pass_rate'] == 0
+    finally:
+        ring.close()
+        ring.unlink()
+
+
+def test_writer_process():
+    import subprocess
+    import sys
+    import time
+    # the writer can not share the semaphore, the consumers poll
+    ring = lv.RingBuffer((3, 4), np.uint16, 32, ready=False)
+    writer = ('import numpy as np, censor.live as lv\n'
+              'ring = lv.RingBuffer((3, 4), np.uint16, 32, name="' + ring.name + '", create=False)\n'
+              'for i in range(20):\n'
+              '    ring.write(np.full((3, 4), 9 if i == 5 else 1))\n'
+              'ring.close()\n')
+    try:
+        with lv.LiveChecker(ring, {'MEAN_IN_RANGE': (0, 7)}, num_workers=2) as checker:
+            subprocess.check_call([sys.executable, '-c', writer])
+            checker.stop()
+            status = checker.get_status()
+        assert status['written'] == 20 and status['checked'] == 20
+        assert status['last_failed'] == 5
+        # the buffer outlives the writer process, including its resource tracker, which would
+        # unlink tracked segments shortly after the process exits
+        time.sleep(0.5)
+        attached = lv.RingBuffer((3, 4), np.uint16, 32, name=ring.name, create=False)
+        assert attached.written == 20
+        attached.close()
+    finally:
+        ring.close()
+        ring.unlink()
@@ -53,8 +53,11 @@ from __future__ import (absolute_import, division, print_function,
 
 import logging
 import numpy as np
+import pytest
 #import censor.common.constants as const
 import censor.repairs as rp
+import censor.checks as ck
+import censor.common.containers as ct
 
 
 arr_2D = np.array([[1, 2, 3], [np.log(-1.), -5, -7]])
@@ -95,3 +98,110 @@ def test_to_type():
     assert arr.dtype is np.dtype(np.cfloat)
 
 
+
+def test_repair_order():
+    fixers = {'TO_TYPE': (np.dtype(np.int32)), 'REPLACE_NAN': (-1), 'REPLACE_NEGATIVE': (0)}
+    arr = np.array([[[1, 2, 3], [np.nan, -5, -7]], [[1, 2, 3], [4, 5, 6]]])
+    arr = rp.replace(arr, fixers, data_tag, logger, chunk_bytes=8)
+    assert arr.dtype == np.int32
+    assert not ((arr < 0).any())
+    assert arr[0, 1, 0] == 0
+
+
+def test_repair_in_place_and_out():
+    fixers = {'REPLACE_NAN': (0), 'REPLACE_NEGATIVE': (0)}
+    src = np.array([[[1, 2, 3], [np.nan, -5, -7]], [[1, 2, 3], [4, 5, 6]]])
+    out = np.empty_like(src)
+    arr = rp.replace(src, fixers, data_tag, logger, out=out, chunk_bytes=16)
+    assert arr is out
+    assert np.isnan(src).any()
+    assert not ((out < 0).any() or np.isnan(out).any())
+    arr = rp.replace(src, fixers, data_tag, logger)
+    assert arr is src
+    assert np.array_equal(src, out)
+
+
+def test_replace_file(tmpdir):
+    path = str(tmpdir.join('data.npy'))
+    out_path = str(tmpdir.join('fixed.npy'))
+    np.save(path, np.array([[[1, 2, 3], [np.nan, -5, -7]], [[1, 2, 3], [4, 5, 6]]]))
+    fixers = {'REPLACE_NAN': (0), 'REPLACE_NEGATIVE': (0), 'TO_TYPE': (np.dtype(np.int16))}
+    rp.replace_file(path, out_path, fixers, data_tag, logger, chunk_bytes=8)
+    arr = np.load(out_path)
+    assert arr.dtype == np.int16
+    assert arr.min() == 0
+    assert np.isnan(np.load(path)).any()
+    # the input is not overwritten
+    with pytest.raises(ValueError):
+        rp.replace_file(path, str(tmpdir.join('.', 'data.npy')), fixers, data_tag, logger)
+    assert np.isnan(np.load(path)).any()
+
+
+def test_repair_record():
+    arr = np.ones((6, 3, 4))
+    arr[1, 0, 0] = np.nan
+    arr[4, 2, 1] = -3
+    record = ct.RepairRecord(arr.shape)
+    rp.replace(arr, {'REPLACE_NAN': 0, 'REPLACE_NEGATIVE': 0}, data_tag, logger, chunk_bytes=arr[0].nbytes * 4,
+               record=record)
+    assert record.dirty_frames().tolist() == [1, 4]
+    assert record.fixes == ['REPLACE_NAN', 'REPLACE_NEGATIVE']
+
+    arr = np.ones((3, 4, 6))
+    arr[0, 0, 5] = -1
+    record = ct.RepairRecord(arr.shape, axis=2)
+    rp.replace(arr, {'REPLACE_NEGATIVE': 0}, data_tag, logger, chunk_bytes=1, record=record)
+    assert record.dirty_frames().tolist() == [5]
+
+    record = ct.RepairRecord(arr.shape, axis=2)
+    rp.replace(arr, {'TO_TYPE': np.dtype(np.int32)}, data_tag, logger, record=record)
+    assert record.dirty.all()
+
+
+def test_recheck(monkeypatch):
+    checks = {'HAS_NO_NAN': (), 'HAS_NO_NEGATIVE': (), 'HAS_NO_INF': (), 'IS_FLOAT': (),
+              'MEAN_IN_RANGE': (0.5, 7)}
+    arr = np.ones((8, 3, 4))
+    arr[2] = np.nan
+    arr[5, 0, 0] = -100
+    arr[6] = 9
+    table = ck.check(arr, dict(checks), data_tag, logger, par='v')
+    assert table.globals['HAS_NO_NAN'] is False
+    assert table.failed_frames('MEAN_IN_RANGE').tolist() == [2, 5, 6]
+
+    record = ct.RepairRecord(arr.shape)
+    rp.replace(arr, {'REPLACE_NAN': 1, 'REPLACE_NEGATIVE': 1}, data_tag, logger, record=record)
+    evaluated = []
+    fill_table = ck.framer.fill_table
+    monkeypatch.setattr(ck.framer, 'fill_table',
+                        lambda block, index, functions, table: evaluated.append(index) or
+                        fill_table(block, index, functions, table))
+    rechecked = ck.recheck(arr, checks, table, record, data_tag, logger)
+    assert evaluated == [2, 5]
+    assert rechecked.globals == {'HAS_NO_NAN': True, 'HAS_NO_NEGATIVE': True, 'HAS_NO_INF': True,
+                                 'IS_FLOAT': True}
+    assert rechecked.failed_frames('MEAN_IN_RANGE').tolist() == [6]
+    monkeypatch.undo()
+    full = ck.check(arr, dict(checks), data_tag, logger, par='v')
+    assert (full.passed == rechecked.passed).all()
+    assert (full.values == rechecked.values).all()
+
+    # frames not evaluated by the previous evaluation are evaluated
+    arr = np.ones((8, 3, 4))
+    arr[0] = np.nan
+    arr[7] = 100
+    checks = {'MEAN_IN_RANGE': (0.5, 7)}
+    table = ck.check(arr, dict(checks), data_tag, logger, par='s', fail_fast=True)
+    assert not table.evaluated[7]
+    record = ct.RepairRecord(arr.shape)
+    rp.replace(arr, {'REPLACE_NAN': 1}, data_tag, logger, record=record)
+    rechecked = ck.recheck(arr, checks, table, record, data_tag, logger)
+    assert rechecked.failed_frames('MEAN_IN_RANGE').tolist() == [7]
+    assert not rechecked
+
+    # the repair record must order the frames by the same axis
+    table = ck.check(arr, dict(checks), data_tag, logger, axis=2, par='v')
+    assert table.axis == 2
+    with pytest.raises(ValueError):
+        ck.recheck(arr, checks, table, ct.RepairRecord(arr.shape), data_tag, logger)
+    assert ck.recheck(arr, checks, table, ct.RepairRecord(arr.shape, 2), data_tag, logger).axis == 2
@@ -49,3 +49,101 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+
+import csv
+import json
+import logging
+import numpy as np
+import censor.checks as ck
+import censor.common.containers as ct
+import censor.reports as rp
+
+logger = logging.getLogger(__name__)
+data_tag = 'test'
+
+
+def make_data():
+    arr = np.ones((10, 3, 4))
+    arr[3] = 9
+    arr[8, 0, :] = 5
+    return arr
+
+
+def test_from_table(tmpdir):
+    checks = {'HAS_NO_NAN': (), 'MEAN_IN_RANGE': (0, 7), 'SAT_IN_RANGE': (1, 2)}
+    table = ck.check(make_data(), checks, data_tag, logger, par='v', log_frames=None)
+    report = rp.from_table(table, data_tag)
+    assert report.pass_rates() == {'mean_in_range': 0.9, 'saturation_in_range': 0.8}
+    assert report.failed_frames('mean_in_range').tolist() == [3]
+    assert report.failed_frames('saturation_in_range').tolist() == [3, 8]
+    assert report.metrics('mean_in_range')[3] == 9
+    assert report.metrics('saturation_in_range')[8] == 4
+
+    report.save(str(tmpdir.join('report.json')))
+    with open(str(tmpdir.join('report.json'))) as f:
+        saved = json.load(f)
+    assert saved['globals'] == {'HAS_NO_NAN': True}
+    assert saved['checks']['mean_in_range']['failed_frames'] == [3]
+    assert saved['checks']['mean_in_range']['passed'] == 9
+    assert len(saved['checks']['mean_in_range']['metrics']) == 10
+
+    report.save(str(tmpdir.join('report.csv')))
+    with open(str(tmpdir.join('report.csv'))) as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 10
+    assert rows[3]['mean_in_range'] == 'False'
+    assert float(rows[3]['mean_in_range_value']) == 9
+
+    report.save(str(tmpdir.join('report.npz')))
+    saved = np.load(str(tmpdir.join('report.npz')))
+    assert saved['frames'].tolist() == list(range(10))
+    assert not saved['saturation_in_range_passed'][8]
+
+
+def test_streaming():
+    report = rp.Report(data_tag)
+    for results in ck.check_stream(make_data(), {'MEAN_IN_RANGE': (0, 7)}, data_tag, logger, par='t'):
+        report.add_results(results)
+    assert report.num_frames == 10
+    assert report.pass_rates() == {'mean_in_range': 0.9}
+    assert report.failed_frames('mean_in_range').tolist() == [3]
+    # re-evaluated frame replaces its result
+    report.add_results(ct.Results(3, False, [ct.Result(True, 'mean_in_range', 1.0)]))
+    assert report.pass_rates() == {'mean_in_range': 1.0}
+
+
+
+def test_partial_columns():
+    report = rp.Report(data_tag, ['mean_in_range', 'saturation_in_range'])
+    report.add_table(ck.check(make_data(), {'MEAN_IN_RANGE': (0, 7)}, data_tag, logger, par='v',
+                              log_frames=None))
+    assert report.pass_rates() == {'mean_in_range': 0.9, 'saturation_in_range': None}
+    report.add_results(ct.Results(8, True, [ct.Result(False, 'saturation_in_range', 4)]))
+    assert report.pass_rates() == {'mean_in_range': 0.9, 'saturation_in_range': 0.0}
+    assert report.failed_frames('saturation_in_range').tolist() == [8]
+    assert report.failed_frames('mean_in_range').tolist() == [3]
+
+def test_growth():
+    report = rp.Report(data_tag, ['mean_in_range'], num_frames=2)
+    for index in (0, 1, 2, 7, 100):
+        report.add_results(ct.Results(index, index == 7, [ct.Result(index != 7, 'mean_in_range', index)]))
+    assert report.num_frames == 101
+    assert report.failed_frames('mean_in_range').tolist() == [7]
+    assert report.metrics('mean_in_range')[100] == 100
+    assert np.isnan(report.metrics('mean_in_range')[50])
+
+
+def test_histograms(tmpdir):
+    import censor.frame as framer
+    arr = make_data()
+    report = rp.from_table(ck.check(arr, {'MEAN_IN_RANGE': (0, 7)}, data_tag, logger, par='v',
+                                    log_frames=None), data_tag)
+    hist, edges = framer.frame_histograms(arr[:4], 10, (0, 10))
+    report.add_histograms(0, hist, edges)
+    hist, edges = framer.frame_histograms(arr[4:], 10, (0, 10))
+    report.add_histograms(4, hist, edges)
+    report.save(str(tmpdir.join('report.npz')))
+    saved = np.load(str(tmpdir.join('report.npz')))
+    assert saved['histograms'].shape == (10, 10)
+    assert saved['histograms'][3, 9] == 12 and saved['histograms'][0, 1] == 12
+    assert len(saved['histogram_edges']) == 11